@@ -1,20 +1,25 @@
 #!/usr/bin/env python3
 """
 AFTIS Auto-Processor
-Monitors inbox directory and automatically processes PDF files
-Deletes successfully processed files, moves failed files to failed/ directory
+Monitors inbox directories and automatically processes PDF files
+Deletes successfully processed files, moves failed files to each inbox's failed/ directory
 """
 
 import os
 import time
 import json
+import random
 import logging
 import requests
 import shutil
 import threading
+from datetime import datetime, timezone
 from pathlib import Path
+from requests.adapters import HTTPAdapter
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
+import tracing
+from scheduling import Scheduler, Inbox, load_inboxes, estimate_pages
 
 # Configure logging
 logging.basicConfig(
@@ -22,33 +27,99 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
         logging.StreamHandler(),
-        logging.FileHandler('/srv/aftis/auto-processor.log')
+        logging.FileHandler(os.getenv('LOG_PATH', '/srv/aftis/auto-processor.log'))
     ]
 )
 logger = logging.getLogger(__name__)
 
+# HTTP statuses worth retrying when the server sent no error category
+RETRYABLE_STATUSES = {429, 502, 503, 504}
+
+
+def failure(category, message, retryable, status=None, retry_after=None):
+    """Describe why processing a file failed and whether a retry can help"""
+    return {
+        'category': category,
+        'message': message,
+        'retryable': retryable,
+        'status': status,
+        'retry_after': retry_after,
+    }
+
+
+def response_failure(response):
+    """Build a failure from an error response, using the server's category when it sent one"""
+    retry_after = response.headers.get('Retry-After')
+    retry_after = float(retry_after) if retry_after and retry_after.isdigit() else None
+    try:
+        error = response.json().get('error')
+    except ValueError:
+        error = None
+    
+    if isinstance(error, dict) and 'category' in error:
+        return failure(error['category'], error.get('message', ''), bool(error.get('retryable')),
+                       response.status_code, retry_after)
+    return failure(f"http_{response.status_code}", response.text[:500],
+                   response.status_code in RETRYABLE_STATUSES, response.status_code, retry_after)
+
 class PDFProcessor(FileSystemEventHandler):
     def __init__(self):
         self.parser_url = os.getenv('PARSER_URL', "http://parser:8080")
-        self.inbox_path = os.getenv('INBOX_PATH', "/srv/aftis/inbox")
-        self.failed_path = "/srv/aftis/failed"
         self.processing_files = set()  # Track files currently being processed
+        self.settling_files = set()  # Detected files still waiting to be fully written
+        
+        # Environment configuration; INBOXES_PATH lists several named inboxes, each may override these
+        default_inbox = Inbox(
+            'default',
+            os.getenv('INBOX_PATH', "/srv/aftis/inbox"),
+            os.getenv('FAILED_PATH', "/srv/aftis/failed"),
+            max_retries=int(os.getenv('MAX_RETRIES', '3')),
+            retry_max_backoff_seconds=float(os.getenv('RETRY_MAX_BACKOFF_SECONDS', '30')),
+            auto_delete=os.getenv('AUTO_DELETE_PDFS', 'true').lower() == 'true',
+        )
+        self.inboxes = {inbox.path: inbox for inbox in load_inboxes(os.getenv('INBOXES_PATH', ''), default_inbox)}
         
         # Ensure directories exist
-        os.makedirs(self.failed_path, exist_ok=True)
+        for inbox in self.inboxes.values():
+            os.makedirs(inbox.failed_path, exist_ok=True)
         
-        # Environment configuration
-        self.auto_delete = os.getenv('AUTO_DELETE_PDFS', 'true').lower() == 'true'
         self.process_delay = int(os.getenv('PROCESS_DELAY_SECONDS', '2'))
-        self.max_retries = int(os.getenv('MAX_RETRIES', '3'))
+        self.pool_size = int(os.getenv('HTTP_POOL_SIZE', '4'))
+        # Longer than the server's PARSE_TIMEOUT_SECONDS, which stops a parse on its own
+        self.request_timeout = float(os.getenv('PARSE_REQUEST_TIMEOUT_SECONDS', '330'))
+        
+        # Pooled keep-alive session shared by health checks and parse requests
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.latencies = {}  # endpoint -> recent request durations in seconds
+        self.stats_lock = threading.Lock()
         self.scan_interval = int(os.getenv('SCAN_INTERVAL_SECONDS', '60'))  # Periodic scan every 60s
         
+        # Files are queued by estimated cost (page count) instead of processed in arrival order
+        policy = os.getenv('SCHEDULE_POLICY', 'sjf')
+        self.scheduler = Scheduler(
+            policy,
+            large_pages=int(os.getenv('SCHEDULE_LARGE_PAGES', '20')),
+            aging_pages_per_minute=float(os.getenv('SCHEDULE_AGING_PAGES_PER_MINUTE', '10')),
+        )
+        self.workers = int(os.getenv('SCHEDULE_WORKERS', '2' if policy == 'lanes' else '1'))
+        for inbox in self.inboxes.values():
+            self.scheduler.add_inbox(inbox.name, inbox.weight, inbox.max_workers)
+        
         logger.info(f"Auto-processor initialized:")
-        logger.info(f"  - Inbox path: {self.inbox_path}")
-        logger.info(f"  - Auto delete: {self.auto_delete}")
+        for inbox in self.inboxes.values():
+            logger.info(f"  - Inbox {inbox.name}: {inbox.path} (weight {inbox.weight:g}, "
+                        f"max retries {inbox.max_retries}, auto delete {inbox.auto_delete}, failed to {inbox.failed_path})")
         logger.info(f"  - Process delay: {self.process_delay}s")
-        logger.info(f"  - Max retries: {self.max_retries}")
         logger.info(f"  - Scan interval: {self.scan_interval}s")
+        logger.info(f"  - Schedule: {policy}, {self.workers} worker(s), large files from "
+                    f"{self.scheduler.large_pages} pages")
+    
+    def inbox_of(self, file_path):
+        """The inbox a file was dropped into, None for a path outside every inbox"""
+        return self.inboxes.get(os.path.dirname(os.path.abspath(file_path)))
     
     def wait_for_file_stable(self, file_path, timeout=10):
         """Wait for file to be completely written"""
@@ -73,17 +144,58 @@ class PDFProcessor(FileSystemEventHandler):
         return False
     
     
+    def request(self, method, endpoint, **kwargs):
+        """Send a request on the pooled session as a traced client span and record its latency"""
+        started = time.perf_counter()
+        try:
+            with tracing.span(f"{method} {endpoint}", kind='client') as client_span:
+                headers = dict(kwargs.pop('headers', None) or {}, traceparent=client_span.traceparent)
+                response = self.session.request(method, f"{self.parser_url}{endpoint}", headers=headers, **kwargs)
+                client_span.set_attribute('http.status_code', response.status_code)
+                return response
+        finally:
+            with self.stats_lock:
+                samples = self.latencies.setdefault(endpoint, [])
+                samples.append(time.perf_counter() - started)
+                del samples[:-1000]
+    
+    def log_http_stats(self):
+        """Log connection reuse of the session pool and per-endpoint latency"""
+        pools = self.session.get_adapter(self.parser_url).poolmanager.pools
+        pools = [pools[key] for key in pools.keys()]
+        num_requests = sum(pool.num_requests for pool in pools)
+        num_connections = sum(pool.num_connections for pool in pools)
+        if not num_requests:
+            return
+        reuse = 1 - num_connections / num_requests
+        parts = []
+        with self.stats_lock:
+            for endpoint, samples in sorted(self.latencies.items()):
+                ordered = sorted(samples)
+                p50 = ordered[(len(ordered) - 1) // 2] * 1000
+                p95 = ordered[max(0, -(-len(ordered) * 95 // 100) - 1)] * 1000
+                parts.append(f"{endpoint} p50 {p50:.0f}ms p95 {p95:.0f}ms")
+        logger.info(f"📊 HTTP: {num_requests} requests over {num_connections} connections "
+                    f"({reuse:.1%} reused); " + ', '.join(parts))
+    
+    def log_queue_stats(self):
+        """Log per-lane queue depth, queue wait and completions, then throughput and latency per inbox"""
+        logger.info(f"📊 Queue: {self.scheduler.summary()}")
+        for line in self.scheduler.inbox_summaries():
+            logger.info(f"📊 Inbox {line}")
+    
     def process_pdf(self, file_path):
-        """Process a PDF file through the parser API"""
+        """Process a PDF file through the parser API, return (success, failure)"""
         filename = os.path.basename(file_path)
         
         try:
             # Check if parser service is available before processing
             logger.debug(f"Checking parser health before processing {filename}")
-            health_response = requests.get(f"{self.parser_url}/health", timeout=5)
+            health_response = self.request('GET', '/health', timeout=5)
             if health_response.status_code != 200:
                 logger.error(f"Parser service unhealthy (status {health_response.status_code}), skipping {filename}")
-                return False
+                return False, failure('parser_unhealthy', f"Health check returned HTTP {health_response.status_code}",
+                                      True, health_response.status_code)
             
             logger.debug(f"Parser healthy, processing {filename}")
             
@@ -91,11 +203,7 @@ class PDFProcessor(FileSystemEventHandler):
             payload = {"pdf_path": file_path}
             logger.debug(f"Calling {self.parser_url}/parse-and-store with payload: {payload}")
             
-            response = requests.post(
-                f"{self.parser_url}/parse-and-store",
-                json=payload,
-                timeout=30
-            )
+            response = self.request('POST', '/parse-and-store', json=payload, timeout=self.request_timeout)
             
             logger.debug(f"Parse response: {response.status_code} - {response.text[:200]}...")
             
@@ -103,39 +211,46 @@ class PDFProcessor(FileSystemEventHandler):
                 result = response.json()
                 if result.get('success'):
                     parsed_count = result.get('parsed_count', 0)
-                    db_stored = result.get('database_stored', False)
                     
-                    logger.info(f"✓ Processed {filename}: {parsed_count} transactions" + 
-                               (", stored in DB" if db_stored else ", DB storage failed"))
-                    return True
+                    logger.info(f"✓ Processed {filename}: {parsed_count} transactions, stored in DB")
+                    return True, None
                 else:
                     logger.error(f"✗ Processing failed for {filename}: {result}")
-                    return False
+                    return False, failure('processing_failed', str(result)[:500], False, response.status_code)
             else:
-                logger.error(f"✗ API call failed for {filename}: HTTP {response.status_code}")
-                logger.error(f"Response: {response.text}")
-                return False
+                error = response_failure(response)
+                logger.error(f"✗ API call failed for {filename}: HTTP {response.status_code} "
+                             f"[{error['category']}{', retryable' if error['retryable'] else ''}]")
+                logger.error(f"Response: {error['message']}")
+                return False, error
                 
         except requests.Timeout as e:
             logger.error(f"✗ Timeout error processing {filename}: {e}")
-            return False
+            return False, failure('timeout', str(e), True)
         except requests.ConnectionError as e:
             logger.error(f"✗ Connection error processing {filename}: {e}")
-            return False
+            return False, failure('connection_error', str(e), True)
         except requests.RequestException as e:
             logger.error(f"✗ Network error processing {filename}: {e}")
-            return False
+            return False, failure('network_error', str(e), True)
         except Exception as e:
             logger.error(f"✗ Unexpected error processing {filename}: {e}")
             import traceback
             logger.error(f"Traceback: {traceback.format_exc()}")
-            return False
+            return False, failure('unexpected_error', str(e), False)
     
-    def handle_successful_processing(self, file_path):
+    def backoff_seconds(self, attempt, error, max_backoff):
+        """Full-jitter exponential backoff, never shorter than the server's Retry-After"""
+        delay = random.uniform(0, min(max_backoff, 2 ** attempt))
+        if error and error.get('retry_after'):
+            delay = max(delay, error['retry_after'])
+        return delay
+    
+    def handle_successful_processing(self, file_path, inbox):
         """Handle successfully processed file"""
         filename = os.path.basename(file_path)
         
-        if self.auto_delete:
+        if inbox.auto_delete:
             try:
                 os.remove(file_path)
                 logger.info(f"🗑️  Deleted processed file: {filename}")
@@ -144,55 +259,90 @@ class PDFProcessor(FileSystemEventHandler):
         else:
             logger.info(f"✓ Processing complete: {filename} (auto-delete disabled)")
     
-    def handle_failed_processing(self, file_path):
-        """Move failed file to failed directory"""
+    def handle_failed_processing(self, file_path, inbox, report=None):
+        """Move failed file to its inbox's failed (dead-letter) directory with its error report"""
         filename = os.path.basename(file_path)
-        failed_file_path = os.path.join(self.failed_path, filename)
+        failed_file_path = os.path.join(inbox.failed_path, filename)
         
         try:
             # Add timestamp to avoid conflicts
             if os.path.exists(failed_file_path):
                 base, ext = os.path.splitext(filename)
                 timestamp = int(time.time())
-                failed_file_path = os.path.join(self.failed_path, f"{base}_{timestamp}{ext}")
+                failed_file_path = os.path.join(inbox.failed_path, f"{base}_{timestamp}{ext}")
             
             shutil.move(file_path, failed_file_path)
             logger.warning(f"📁 Moved failed file to: {failed_file_path}")
         except OSError as e:
             logger.error(f"Failed to move {filename} to failed directory: {e}")
+            return
+        
+        if report:
+            report_path = f"{os.path.splitext(failed_file_path)[0]}.error.json"
+            try:
+                with open(report_path, 'w') as f:
+                    json.dump(report, f, indent=2)
+            except OSError as e:
+                logger.error(f"Failed to write error report for {filename}: {e}")
     
-    def process_file_with_retries(self, file_path):
-        """Process file with retry logic"""
+    def process_file_with_retries(self, file_path, inbox, **attributes):
+        """Process file with its inbox's retry policy, retrying only transient failures; True on success"""
         filename = os.path.basename(file_path)
         
-        if filename in self.processing_files:
+        if file_path in self.processing_files:
             logger.debug(f"Already processing {filename}, skipping")
-            return
+            return False
         
-        self.processing_files.add(filename)
+        self.processing_files.add(file_path)
         
         try:
-            logger.info(f"🔄 Processing: {filename}")
+            logger.info(f"🔄 Processing: {filename} ({inbox.name})")
+            attempts = []
             
-            for attempt in range(1, self.max_retries + 1):
-                if attempt > 1:
-                    logger.info(f"Retry {attempt}/{self.max_retries} for {filename}")
-                
-                success = self.process_pdf(file_path)
-                
-                if success:
-                    self.handle_successful_processing(file_path)
-                    return
+            # Child of the detection span for watched files, a new trace for scanned ones
+            with tracing.span('process_file', file=filename, inbox=inbox.name, **attributes) as file_span:
+                for attempt in range(1, inbox.max_retries + 1):
+                    if attempt > 1:
+                        logger.info(f"Retry {attempt}/{inbox.max_retries} for {filename}")
+                    
+                    with tracing.span('attempt', attempt=attempt) as attempt_span:
+                        success, error = self.process_pdf(file_path)
+                        if error:
+                            attempt_span.set_attribute('error.category', error['category'])
+                    
+                    if success:
+                        self.handle_successful_processing(file_path, inbox)
+                        return True
+                    
+                    attempts.append(dict(error, attempt=attempt, at=datetime.now(timezone.utc).isoformat()))
+                    
+                    # Deterministic failures (bad layout, parser errors) cannot succeed on a retry
+                    if not error['retryable']:
+                        logger.error(f"Not retrying {filename}: {error['category']} is not a transient failure")
+                        break
+                    
+                    if attempt < inbox.max_retries:
+                        with tracing.span('backoff'):
+                            time.sleep(self.backoff_seconds(attempt, error, inbox.retry_max_backoff_seconds))
+                else:
+                    # All retries failed
+                    logger.error(f"All retries failed for {filename}")
                 
-                if attempt < self.max_retries:
-                    time.sleep(2 ** attempt)  # Exponential backoff
-            
-            # All retries failed
-            logger.error(f"All retries failed for {filename}")
-            self.handle_failed_processing(file_path)
+                file_span.set_attribute('error.category', attempts[-1]['category'])
+                self.handle_failed_processing(file_path, inbox, {
+                    'filename': filename,
+                    'inbox': inbox.name,
+                    'failed_at': datetime.now(timezone.utc).isoformat(),
+                    'category': attempts[-1]['category'],
+                    'retryable': attempts[-1]['retryable'],
+                    'message': attempts[-1]['message'],
+                    'attempts': attempts,
+                    'trace_id': file_span.trace_id,
+                })
+                return False
             
         finally:
-            self.processing_files.discard(filename)
+            self.processing_files.discard(file_path)
     
     def on_created(self, event):
         """Handle file creation events"""
@@ -204,34 +354,97 @@ class PDFProcessor(FileSystemEventHandler):
             return
         
         filename = os.path.basename(file_path)
-        logger.info(f"📄 New PDF detected: {filename}")
+        inbox = self.inbox_of(file_path)
+        if file_path in self.settling_files or inbox is None:
+            return
+        logger.info(f"📄 New PDF detected in {inbox.name}: {filename}")
         
-        # Wait for processing delay
-        time.sleep(self.process_delay)
+        # The trace of a statement starts when it is detected and ends when a worker is done with it
+        inbox_span = tracing.start_span('inbox_file', file=filename, inbox=inbox.name)
+        self.settling_files.add(file_path)
+        # Settle on a thread of its own so one slow copy does not delay detecting the others
+        threading.Thread(target=self.settle_and_schedule, args=(file_path, inbox_span), daemon=True).start()
+    
+    def settle_and_schedule(self, file_path, inbox_span):
+        """Wait for a detected file to be fully written, then queue it"""
+        filename = os.path.basename(file_path)
+        try:
+            # Wait for processing delay
+            with tracing.span('process_delay', parent=inbox_span, seconds=self.process_delay):
+                time.sleep(self.process_delay)
+            
+            # Wait for file to be stable (fully written)
+            with tracing.span('wait_for_file_stable', parent=inbox_span) as stable_span:
+                stable = self.wait_for_file_stable(file_path)
+                stable_span.set_attribute('stable', stable)
+            if not stable:
+                logger.warning(f"File {filename} may not be fully written, processing anyway")
+        finally:
+            self.settling_files.discard(file_path)
         
-        # Wait for file to be stable (fully written)
-        if not self.wait_for_file_stable(file_path):
-            logger.warning(f"File {filename} may not be fully written, processing anyway")
+        self.schedule(file_path, inbox_span)
+    
+    def schedule(self, file_path, inbox_span=None):
+        """Queue a file for the workers by its estimated cost and its inbox's share"""
+        filename = os.path.basename(file_path)
+        inbox = self.inbox_of(file_path)
+        with tracing.span('estimate_cost', parent=inbox_span) as cost_span:
+            pages = estimate_pages(file_path)
+            cost_span.set_attribute('pages', pages)
         
-        # Process the file
-        self.process_file_with_retries(file_path)
+        if self.scheduler.submit(file_path, pages, inbox_span, inbox.name):
+            logger.info(f"📥 Queued {filename} in {inbox.name}: {pages} page(s), {self.scheduler.lane_of(pages)} lane")
+        else:
+            logger.debug(f"Already queued {filename}, skipping")
+            if inbox_span:
+                inbox_span.end()
+    
+    def worker_loop(self, lanes):
+        """Process queued files in scheduling order"""
+        while True:
+            item = self.scheduler.take(lanes)
+            succeeded = False
+            try:
+                # Scanned files have no detection span and start a trace of their own
+                with tracing.use_span(item.context):
+                    succeeded = self.process_file_with_retries(
+                        item.path, self.inbox_of(item.path), pages=item.pages, lane=item.lane,
+                        queue_wait_seconds=round(item.started_at - item.queued_at, 3)
+                    )
+            except Exception as e:
+                logger.error(f"Worker error processing {os.path.basename(item.path)}: {e}")
+            finally:
+                if item.context:
+                    item.context.end()
+                self.scheduler.done(item, succeeded)
+    
+    def start_workers(self):
+        """Start the worker threads that take files from the scheduler"""
+        for index, lanes in enumerate(self.scheduler.worker_lanes(self.workers)):
+            threading.Thread(target=self.worker_loop, args=(lanes,), name=f"worker-{index}", daemon=True).start()
+        logger.info(f"⚙️  Started {self.workers} worker(s), {self.scheduler.policy} scheduling")
     
     def scan_for_missed_files(self):
-        """Periodic scan for files that might have been missed"""
-        try:
-            if not os.path.exists(self.inbox_path):
-                return
-            
-            existing_files = [f for f in os.listdir(self.inbox_path) if f.lower().endswith('.pdf')]
-            
-            if existing_files:
-                logger.info(f"🔍 Periodic scan found {len(existing_files)} unprocessed files")
-                for filename in existing_files:
-                    file_path = os.path.join(self.inbox_path, filename)
-                    logger.info(f"📄 Processing missed file: {filename}")
-                    self.process_file_with_retries(file_path)
-        except Exception as e:
-            logger.error(f"Error during periodic scan: {e}")
+        """Periodic scan of every inbox for files that might have been missed"""
+        for inbox in self.inboxes.values():
+            try:
+                if not os.path.exists(inbox.path):
+                    continue
+                
+                # Files still settling, queued or being processed are not missed
+                existing_files = [
+                    f for f in os.listdir(inbox.path)
+                    if f.lower().endswith('.pdf') and os.path.join(inbox.path, f) not in self.settling_files
+                    and os.path.join(inbox.path, f) not in self.scheduler
+                ]
+                
+                if existing_files:
+                    logger.info(f"🔍 Periodic scan found {len(existing_files)} unprocessed files in {inbox.name}")
+                    for filename in existing_files:
+                        logger.info(f"📄 Scheduling missed file: {filename}")
+                        self.schedule(os.path.join(inbox.path, filename))
+            except Exception as e:
+                logger.error(f"Error during periodic scan of {inbox.name}: {e}")
     
     def start_periodic_scanner(self):
         """Start periodic scanning in background thread"""
@@ -239,6 +452,8 @@ class PDFProcessor(FileSystemEventHandler):
             while True:
                 time.sleep(self.scan_interval)
                 self.scan_for_missed_files()
+                self.log_http_stats()
+                self.log_queue_stats()
         
         scanner_thread = threading.Thread(target=scanner_loop, daemon=True)
         scanner_thread.start()
@@ -254,42 +469,42 @@ class PDFProcessor(FileSystemEventHandler):
             event.src_path = event.dest_path
             self.on_created(event)
 
-def process_existing_files():
-    """Process any existing files in inbox on startup"""
-    processor = PDFProcessor()
-    inbox_path = processor.inbox_path
-    
-    if not os.path.exists(inbox_path):
-        logger.info("Inbox directory does not exist, creating it")
-        os.makedirs(inbox_path, exist_ok=True)
-        return
-    
-    existing_files = [f for f in os.listdir(inbox_path) if f.lower().endswith('.pdf')]
-    
-    if existing_files:
-        logger.info(f"Found {len(existing_files)} existing PDF files, processing...")
-        for filename in existing_files:
-            file_path = os.path.join(inbox_path, filename)
-            processor.process_file_with_retries(file_path)
-    else:
-        logger.info("No existing PDF files found in inbox")
+def process_existing_files(processor):
+    """Queue any existing files in the inboxes on startup"""
+    for inbox in processor.inboxes.values():
+        if not os.path.exists(inbox.path):
+            logger.info(f"Inbox directory of {inbox.name} does not exist, creating it")
+            os.makedirs(inbox.path, exist_ok=True)
+            continue
+        
+        existing_files = [f for f in os.listdir(inbox.path) if f.lower().endswith('.pdf')]
+        
+        if existing_files:
+            logger.info(f"Found {len(existing_files)} existing PDF files in {inbox.name}, scheduling...")
+            for filename in existing_files:
+                processor.schedule(os.path.join(inbox.path, filename))
+        else:
+            logger.info(f"No existing PDF files found in {inbox.name}")
 
 def main():
     """Main function to start the auto-processor"""
     logger.info("🚀 AFTIS Auto-Processor starting...")
     
-    # Process any existing files
-    process_existing_files()
-    
-    # Start watching for new files
     event_handler = PDFProcessor()
-    inbox_path = event_handler.inbox_path
+    
+    # Queue all existing files before the workers start, so the first one taken is the cheapest
+    process_existing_files(event_handler)
+    event_handler.start_workers()
+    
+    # Start watching for new files, one watch per inbox
     observer = Observer()
-    observer.schedule(event_handler, inbox_path, recursive=False)
+    for inbox in event_handler.inboxes.values():
+        observer.schedule(event_handler, inbox.path, recursive=False)
     
     try:
         observer.start()
-        logger.info(f"👀 Watching {inbox_path} for new PDF files...")
+        for inbox in event_handler.inboxes.values():
+            logger.info(f"👀 Watching {inbox.path} ({inbox.name}) for new PDF files...")
         
         # Start periodic scanner for missed files
         event_handler.start_periodic_scanner()
@@ -302,6 +517,8 @@ def main():
     except KeyboardInterrupt:
         logger.info("🛑 Stopping auto-processor...")
         observer.stop()
+        event_handler.log_http_stats()
+        event_handler.log_queue_stats()
     
     observer.join()
     logger.info("✅ Auto-processor stopped")
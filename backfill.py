@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+AFTIS Backfill
+Loads a directory tree of historical statements straight into the database:
+PDFs are parsed in a process pool and stored with one COPY (batched inserts
+on SQLite) per group of files, without the inbox, HTTP or a parser
+subprocess per file. Each file is checkpointed by content hash in
+statement_files in the same transaction as its rows, so an interrupted run
+resumes where it stopped and a statement copied twice into the tree is
+loaded once.
+Parse workers are replaced after PARSE_WORKER_MAX_JOBS files or once their
+RSS passes PARSE_WORKER_MAX_RSS_MB; statements estimated above the parse
+memory budget are reported as failed instead of parsed.
+Usage: python backfill.py <directory> [--jobs 4] [--batch-rows 50000]
+"""
+
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from parse import iter_parse_batches
+from layouts import file_sha256
+from categorize import CATEGORY_RULES_PATH
+from scheduling import estimate_pages
+import storage
+from memory import (
+    WorkerPool, MemoryBudget, MemoryBudgetExceeded, total_peak_mb, format_memory,
+    PARSE_WORKER_MAX_JOBS, PARSE_WORKER_MAX_RSS_MB,
+)
+import server
+
+# Rows per batch sent back by a parse worker; larger than the HTTP stream's to cut pickling overhead
+PARSE_BATCH_ROWS = 5000
+INSERT_STATEMENT_FILES = """
+    INSERT INTO statement_files (sha256, path, account_number, period, rows) VALUES %s
+    ON CONFLICT (sha256) DO NOTHING
+"""
+
+
+def find_pdfs(root):
+    """PDF files under root, in a stable order"""
+    pdf_paths = []
+    for directory, subdirectories, filenames in os.walk(root):
+        subdirectories.sort()
+        pdf_paths.extend(
+            os.path.join(directory, filename) for filename in sorted(filenames) if filename.lower().endswith('.pdf')
+        )
+    return pdf_paths
+
+
+def parse_file(pdf_path):
+    """Parse one statement in a worker process into TransactionBatch objects"""
+    return list(iter_parse_batches(pdf_path, batch_size=PARSE_BATCH_ROWS))
+
+
+def ensure_schema(conn):
+    """Load the backend's schema into an empty database; fail early if a table added since is missing"""
+    tables = storage.backend.tables(conn.cursor())
+    if 'transactions' not in tables:
+        with open(storage.backend.schema_path) as f:
+            storage.backend.run_script(conn, f.read())
+        conn.commit()
+        print(f"Created tables from {storage.backend.schema_path}")
+        return
+    for table in ('statement_files', 'transaction_changes'):
+        if table not in tables:
+            raise RuntimeError(f"Table {table} is missing, apply the migration in README.md first")
+
+
+def loaded_hashes(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT sha256 FROM statement_files")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def load_files(conn, files):
+    """Store the rows of parsed files in one bulk write and checkpoint them, all in one transaction
+
+    `files` are dicts with path, sha256 and batches. daily_balances is updated
+    as the ingest path does, later files winning for a shared date.
+    """
+    cursor = conn.cursor()
+    first_id = storage.backend.first_possible_id(cursor)
+    batches = []
+    balances = {}
+    checkpoints = []
+    for parsed in files:
+        rows = 0
+        for batch in parsed['batches']:
+            if server.categorizer:
+                server.categorizer.apply(batch)
+            batches.append(batch)
+            for day, cents in batch.daily_balances():
+                balances[(batch.account_number, day)] = cents
+            rows += len(batch)
+        first = parsed['batches'][0] if parsed['batches'] else None
+        checkpoints.append((
+            parsed['sha256'], parsed['path'],
+            first.account_number if first else None, first.period if first else None, rows
+        ))
+
+    if batches:
+        storage.backend.insert_batches(cursor, batches)
+    # One row per (account, date): a single upsert statement cannot update a row twice
+    storage.backend.upsert_daily_balances(cursor, [
+        (account_number, day, cents)
+        for (account_number, day), cents in balances.items() if account_number is not None
+    ])
+    storage.backend.insert_values(cursor, INSERT_STATEMENT_FILES, checkpoints)
+    # One change feed entry per file, as if each had been ingested on its own
+    storage.backend.record_changes(cursor, first_id, [checkpoint[2:] for checkpoint in checkpoints])
+    conn.commit()
+    return sum(checkpoint[-1] for checkpoint in checkpoints)
+
+
+class Progress:
+    """Files and rows loaded so far, printed after every commit"""
+
+    def __init__(self, total_files):
+        self.total_files = total_files
+        self.files = 0
+        self.rows = 0
+        self.failed = []
+        self.load_seconds = 0.0
+        self.peak_mb = 0.0
+        self.started = time.perf_counter()
+
+    def loaded(self, files, rows, seconds):
+        self.files += files
+        self.rows += rows
+        self.load_seconds += seconds
+        elapsed = time.perf_counter() - self.started
+        print(f"{self.files}/{self.total_files} files, {self.rows} rows, "
+              f"{self.rows / elapsed:.0f} rows/s, job peak {self.peak_mb:.0f} MB ({len(self.failed)} failed)",
+              flush=True)
+
+    def parsed(self, figures):
+        if figures:
+            self.peak_mb = max(self.peak_mb, total_peak_mb(figures))
+
+    def fail(self, pdf_path, error, figures=None):
+        self.failed.append(pdf_path)
+        memory = f" [{format_memory(figures)}]" if figures else ''
+        print(f"✗ {pdf_path}: {error}{memory}", file=sys.stderr, flush=True)
+
+
+def flush(conn, pending, progress):
+    """Load pending files; if the group is rejected, load them one by one to isolate the bad file"""
+    if not pending:
+        return
+    started = time.perf_counter()
+    try:
+        rows = load_files(conn, pending)
+        progress.loaded(len(pending), rows, time.perf_counter() - started)
+    except storage.RejectedError as e:
+        conn.rollback()
+        if len(pending) == 1:
+            progress.fail(pending[0]['path'], e)
+            return
+        for parsed in pending:
+            flush(conn, [parsed], progress)
+    finally:
+        pending.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk load a directory tree of statements into the database')
+    parser.add_argument('directory')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='Parser processes (default: CPU count)')
+    parser.add_argument('--batch-rows', type=int, default=50000,
+                        help='Rows per COPY and commit; a file is never split across commits (default: 50000)')
+    parser.add_argument('--max-jobs-per-worker', type=int, default=PARSE_WORKER_MAX_JOBS,
+                        help=f'Replace a parse worker after this many files (default: {PARSE_WORKER_MAX_JOBS})')
+    parser.add_argument('--max-worker-rss-mb', type=float, default=PARSE_WORKER_MAX_RSS_MB,
+                        help=f'Replace a parse worker whose RSS is above this after a file '
+                             f'(default: {PARSE_WORKER_MAX_RSS_MB:g})')
+    args = parser.parse_args()
+
+    pdf_paths = find_pdfs(args.directory)
+    conn = server.get_db_connection()
+    if not conn:
+        sys.exit(1)
+
+    try:
+        ensure_schema(conn)
+        if os.path.isfile(CATEGORY_RULES_PATH):
+            # Same rules and category_rules bookkeeping as the server
+            print(f"Categorization rules: {server.reload_categories()}")
+
+        # Checkpoint: files whose content is already stored are skipped, as are copies within the tree
+        done = loaded_hashes(conn)
+        todo = {}
+        for pdf_path in pdf_paths:
+            sha256 = file_sha256(pdf_path)
+            if sha256 not in done:
+                todo[pdf_path] = sha256
+                done.add(sha256)
+        print(f"Found {len(pdf_paths)} statements, {len(pdf_paths) - len(todo)} already loaded or duplicate, "
+              f"{len(todo)} to load")
+
+        progress = Progress(len(todo))
+        pending = []
+        pending_rows = 0
+        queue = iter(todo.items())
+        budget = MemoryBudget()
+        with WorkerPool(args.jobs, args.max_jobs_per_worker, args.max_worker_rss_mb) as pool:
+            running = {}
+
+            def submit_next():
+                for pdf_path, sha256 in queue:
+                    pages = estimate_pages(pdf_path)
+                    estimate = budget.estimate(pages)
+                    if budget.budget_mb and estimate > budget.budget_mb:
+                        progress.fail(pdf_path, MemoryBudgetExceeded(estimate, budget.budget_mb))
+                        continue
+                    running[pool.submit(parse_file, pdf_path)] = (pdf_path, sha256, pages)
+                    return
+
+            # Two files in flight per worker bound the parsed rows held in memory
+            for _ in range(args.jobs * 2):
+                submit_next()
+            try:
+                while running:
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        pdf_path, sha256, pages = running.pop(future)
+                        submit_next()
+                        if future.memory:
+                            budget.observe(pages, future.memory)
+                        progress.parsed(future.memory)
+                        try:
+                            batches = future.result()
+                        except Exception as e:
+                            progress.fail(pdf_path, e, future.memory)
+                            continue
+                        pending.append({'path': pdf_path, 'sha256': sha256, 'batches': batches})
+                        pending_rows += sum(len(batch) for batch in batches)
+                        if pending_rows >= args.batch_rows:
+                            flush(conn, pending, progress)
+                            pending_rows = 0
+                flush(conn, pending, progress)
+            except KeyboardInterrupt:
+                # Committed files are checkpointed; the next run resumes after them
+                for future in running:
+                    future.cancel()
+                print("Interrupted, rerun the same command to resume", file=sys.stderr)
+                sys.exit(130)
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - progress.started
+    print(f"Loaded {progress.files} files, {progress.rows} rows in {elapsed:.1f}s "
+          f"({progress.rows / elapsed:.0f} rows/s, {progress.load_seconds:.1f}s in the database)")
+    memory = budget.snapshot()
+    if memory['measured']:
+        print(f"Job memory: peak p50 {memory['peak_p50_mb']:.0f} MB, max {memory['peak_max_mb']:.0f} MB; "
+              f"workers replaced after max jobs {pool.recycled['jobs']}, over RSS {pool.recycled['rss']}, "
+              f"crashed {pool.recycled['crashed']}")
+    if progress.failed:
+        print(f"{len(progress.failed)} files failed and will be retried on the next run", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
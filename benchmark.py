@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+AFTIS Benchmark Suite
+Times the parsing and storage stages against synthetic BCA statements and
+fails when throughput drops below the recorded thresholds.
+Usage: python benchmark.py [--sizes 1 10 100 500] [--cases ...] [--storage sqlite] [--update-thresholds]
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import socket
+import platform
+import argparse
+import tempfile
+import subprocess
+from contextlib import contextmanager, ExitStack
+from datetime import datetime, timezone
+
+import statement_generator
+
+CASES = [
+    'union_source',
+    'clean_numeric_columns',
+    'extract_transactions',
+    'calculate_balance',
+    'categorize',
+    'parse_pdf',
+    'insert_transactions',
+]
+
+DEFAULT_SIZES = [1, 10, 100, 500]
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+
+class SkipCase(Exception):
+    """Raised when a case cannot run on this machine (no Java, no Postgres...)"""
+
+
+def best_of(repeat, setup, func):
+    """Run setup() then time func(*setup()) repeat times, return the fastest run"""
+    best = None
+    for _ in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def find_pg_binary(name):
+    """Locate a PostgreSQL server binary on PATH, PG_BIN or the Debian layout"""
+    search = [os.getenv('PG_BIN'), None] + sorted(glob.glob('/usr/lib/postgresql/*/bin'), reverse=True)
+    for directory in search:
+        found = shutil.which(name, path=directory)
+        if found:
+            return found
+    return None
+
+
+@contextmanager
+def throwaway_postgres():
+    """Start a temporary local PostgreSQL cluster loaded with schema.sql"""
+    initdb = find_pg_binary('initdb')
+    pg_ctl = find_pg_binary('pg_ctl')
+    if not initdb or not pg_ctl:
+        raise SkipCase('initdb/pg_ctl not found (set PG_BIN)')
+
+    import psycopg2
+
+    data_dir = tempfile.mkdtemp(prefix='aftis-pg-')
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    try:
+        subprocess.run(
+            [initdb, '-D', data_dir, '-U', 'aftis_user', '--auth=trust', '-E', 'UTF8'],
+            check=True, capture_output=True
+        )
+        subprocess.run(
+            [pg_ctl, '-D', data_dir, '-w', '-l', os.path.join(data_dir, 'server.log'),
+             '-o', f"-p {port} -k {data_dir} -c listen_addresses=127.0.0.1", 'start'],
+            check=True, capture_output=True
+        )
+
+        conn = psycopg2.connect(host='127.0.0.1', port=port, dbname='postgres', user='aftis_user')
+        conn.autocommit = True
+        conn.cursor().execute('CREATE DATABASE aftis')
+        conn.close()
+
+        conn = psycopg2.connect(host='127.0.0.1', port=port, dbname='aftis', user='aftis_user')
+        with open(SCHEMA_PATH) as f:
+            conn.cursor().execute(f.read())
+        conn.commit()
+        conn.close()
+
+        yield {
+            'POSTGRES_HOST': '127.0.0.1',
+            'POSTGRES_PORT': str(port),
+            'POSTGRES_DB': 'aftis',
+            'POSTGRES_USER': 'aftis_user',
+            'POSTGRES_PASSWORD': '',
+        }
+    finally:
+        subprocess.run([pg_ctl, '-D', data_dir, '-m', 'immediate', 'stop'], capture_output=True)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+@contextmanager
+def throwaway_storage(name):
+    """Environment for a temporary database of the given STORAGE_BACKEND"""
+    if name != 'sqlite':
+        with throwaway_postgres() as env:
+            yield dict(env, STORAGE_BACKEND=name)
+        return
+
+    data_dir = tempfile.mkdtemp(prefix='aftis-sqlite-')
+    try:
+        # storage.py creates the schema from schema.sqlite.sql on first connect
+        yield {'STORAGE_BACKEND': 'sqlite', 'SQLITE_PATH': os.path.join(data_dir, 'aftis.db')}
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def prepare_frame(statement):
+    """Run union_source and clean_numeric_columns to get an extract-ready frame"""
+    import parse
+
+    df = parse.union_source(statement_generator.page_frames(statement))
+    return parse.clean_numeric_columns(df, ['amount', 'balance'])
+
+
+def bench_union_source(statement, context, repeat):
+    import parse
+
+    seconds = best_of(repeat, lambda: (statement_generator.page_frames(statement),), parse.union_source)
+    return statement['row_count'], seconds, 'rows/s'
+
+
+def bench_clean_numeric_columns(statement, context, repeat):
+    import parse
+
+    df = parse.union_source(statement_generator.page_frames(statement))
+    seconds = best_of(
+        repeat,
+        lambda: (df.copy(), ['amount', 'balance']),
+        parse.clean_numeric_columns
+    )
+    return statement['row_count'], seconds, 'rows/s'
+
+
+def bench_extract_transactions(statement, context, repeat):
+    import parse
+
+    df = prepare_frame(statement)
+    seconds = best_of(repeat, lambda: (df.copy(),), parse.extract_transactions)
+    return statement['row_count'], seconds, 'rows/s'
+
+
+def bench_calculate_balance(statement, context, repeat):
+    import main
+
+    frames = statement_generator.page_frames(statement)
+    df = main.union_source(frames)
+    df = main.clean_numeric_columns(df, ['amount', 'balance'])
+    df = main.insert_shifted_column(df)
+    transaction_dataframe = main.extract_transactions(df).drop('balance', axis=1)
+
+    init_balance = statement['init_balance']
+    seconds = best_of(repeat, lambda: (transaction_dataframe.copy(), init_balance), main.calculate_balance)
+    return len(transaction_dataframe), seconds, 'transactions/s'
+
+
+def bench_categorize(statement, context, repeat):
+    import parse
+    from categorize import Categorizer
+
+    transactions = parse.extract_transactions(prepare_frame(statement))
+    descriptions = [transaction['description'] for transaction in transactions]
+    details = [transaction['detail'] for transaction in transactions]
+
+    # Counterparty rules plus filler merchants, so the automaton is the size of a real rules file
+    rules = {name: 'Merchant' for name in statement_generator.COUNTERPARTIES}
+    rules.update((f"MERCHANT {index:05d}", 'Filler') for index in range(5000))
+    categorizer = Categorizer(rules)
+
+    seconds = best_of(repeat, lambda: (descriptions, details), categorizer.categorize)
+    return len(transactions), seconds, 'transactions/s'
+
+
+def bench_parse_pdf(statement, context, repeat):
+    if not shutil.which('java'):
+        raise SkipCase('java not found, tabula cannot run')
+    import parse
+
+    pdf_path = os.path.join(context['work_dir'], f"{statement['account_number']}.pdf")
+    statement_generator.write_pdf(statement, pdf_path)
+
+    transactions = parse.parse_pdf(pdf_path)
+    if len(transactions) != statement['transaction_count']:
+        raise RuntimeError(
+            f"parse_pdf returned {len(transactions)} transactions, "
+            f"expected {statement['transaction_count']}"
+        )
+
+    seconds = best_of(repeat, lambda: (pdf_path,), parse.parse_pdf)
+    return len(statement['pages']), seconds, 'pages/s'
+
+
+def bench_insert_transactions(statement, context, repeat):
+    if 'database' not in context:
+        # Before the first import: storage.py picks its backend from the environment
+        context['database'] = context['stack'].enter_context(throwaway_storage(context['storage']))
+        os.environ.update(context['database'])
+    import parse
+    import server
+
+    transactions = parse.extract_transactions(prepare_frame(statement))
+    for transaction in transactions:
+        transaction['account_number'] = statement['account_number']
+        transaction['period'] = statement['periode']
+        transaction['date'] = '2024-12-' + transaction['date'].split('/')[0]
+
+    def setup():
+        conn = server.get_db_connection()
+        conn.cursor().execute('DELETE FROM transactions' if context['storage'] == 'sqlite'
+                              else 'TRUNCATE transactions')
+        conn.commit()
+        conn.close()
+        return (transactions,)
+
+    def run(rows):
+        if not server.insert_transactions(rows):
+            raise RuntimeError('insert_transactions failed')
+
+    seconds = best_of(repeat, setup, run)
+    return len(transactions), seconds, 'transactions/s'
+
+
+def run_case(case, statement, context, repeat):
+    """Run one benchmark case and return its result record"""
+    record = {'case': case, 'pages': len(statement['pages'])}
+    if case == 'insert_transactions' and context['storage'] != 'postgres':
+        record['storage'] = context['storage']
+    try:
+        count, seconds, unit = globals()[f'bench_{case}'](statement, context, repeat)
+    except SkipCase as e:
+        record.update({'status': 'skipped', 'reason': str(e)})
+        return record
+
+    record.update({
+        'status': 'ok',
+        'items': count,
+        'seconds': round(seconds, 6),
+        'throughput': round(count / seconds, 2) if seconds > 0 else None,
+        'unit': unit,
+    })
+    return record
+
+
+def threshold_key(record):
+    if 'storage' in record:
+        return f"{record['case']}/{record['storage']}/{record['pages']}p"
+    return f"{record['case']}/{record['pages']}p"
+
+
+def check_thresholds(results, thresholds):
+    """Compare results to minimum throughputs, return the list of regressions"""
+    regressions = []
+    for record in results:
+        limit = thresholds.get('cases', {}).get(threshold_key(record))
+        if record['status'] != 'ok' or not limit:
+            continue
+        record['min_throughput'] = limit['min_throughput']
+        if record['throughput'] < limit['min_throughput']:
+            record['status'] = 'regression'
+            regressions.append(threshold_key(record))
+    return regressions
+
+
+def load_thresholds(path):
+    if not os.path.exists(path):
+        return {'cases': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark AFTIS parsing and storage stages')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='Statement sizes in pages (1-500)')
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=CASES)
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per case, fastest is kept')
+    parser.add_argument('--storage', default=os.getenv('STORAGE_BACKEND', 'postgres'),
+                        choices=('postgres', 'sqlite'), help='STORAGE_BACKEND for insert_transactions')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--thresholds', default='bench-thresholds.json')
+    parser.add_argument('--output', default='bench-results.json')
+    parser.add_argument('--update-thresholds', action='store_true',
+                        help='Record current throughput (times --margin) as the new minimums')
+    parser.add_argument('--margin', type=float, default=0.5,
+                        help='Fraction of measured throughput stored by --update-thresholds')
+    args = parser.parse_args()
+
+    results = []
+    with ExitStack() as stack, tempfile.TemporaryDirectory(prefix='aftis-bench-') as work_dir:
+        context = {'stack': stack, 'work_dir': work_dir, 'storage': args.storage}
+        for pages in args.sizes:
+            if not 1 <= pages <= 500:
+                print(f"Error: size {pages} outside 1-500", file=sys.stderr)
+                sys.exit(1)
+            statement = statement_generator.generate_statement(pages=pages, seed=args.seed)
+            for case in args.cases:
+                record = run_case(case, statement, context, args.repeat)
+                results.append(record)
+                if record['status'] == 'ok':
+                    print(f"{threshold_key(record):32} {record['seconds']:10.4f}s "
+                          f"{record['throughput']:14,.0f} {record['unit']}")
+                else:
+                    print(f"{threshold_key(record):32} skipped: {record['reason']}")
+
+    thresholds = load_thresholds(args.thresholds)
+    if args.update_thresholds:
+        for record in results:
+            if record['status'] == 'ok':
+                thresholds.setdefault('cases', {})[threshold_key(record)] = {
+                    'min_throughput': round(record['throughput'] * args.margin, 2),
+                    'unit': record['unit'],
+                }
+        with open(args.thresholds, 'w') as f:
+            json.dump(thresholds, f, indent=2, sort_keys=True)
+        print(f"Updated thresholds in {args.thresholds}")
+
+    regressions = check_thresholds(results, thresholds)
+
+    report = {
+        'generated_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'storage': args.storage,
+        'results': results,
+        'regressions': regressions,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if regressions:
+        print(f"✗ Throughput regression in: {', '.join(regressions)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+AFTIS Transaction Categorizer
+Compiles a rules file of merchant/counterparty patterns into one Aho-Corasick
+automaton and assigns a category to each transaction from its description and
+detail. Matching is case-insensitive; when several patterns match, the longest
+one wins, then the one listed first.
+Usage: python categorize.py [--rules categories.csv] <text>...
+"""
+
+import os
+import csv
+import sys
+import argparse
+from collections import deque
+
+CATEGORY_RULES_PATH = os.getenv('CATEGORY_RULES_PATH', '/srv/aftis/categories.csv')
+
+
+def load_rules(path=CATEGORY_RULES_PATH):
+    """Read a `pattern,category` CSV into {PATTERN: category}; a repeated pattern keeps its last category"""
+    rules = {}
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            pattern = ' '.join((row.get('pattern') or '').split()).upper()
+            category = (row.get('category') or '').strip()
+            if pattern and category:
+                rules.pop(pattern, None)
+                rules[pattern] = category
+    return rules
+
+
+def changed_patterns(old_rules, new_rules):
+    """Patterns added, removed or moved to another category between two rule sets"""
+    return {
+        pattern for pattern in old_rules.keys() | new_rules.keys()
+        if old_rules.get(pattern) != new_rules.get(pattern)
+    }
+
+
+class Categorizer:
+    """Aho-Corasick automaton over all rule patterns; matching cost is independent of the rule count"""
+
+    def __init__(self, rules):
+        self.rules = dict(rules)
+        self.goto = [{}]
+        self.fail = [0]
+        # Best rule ending at each node, including those reached through fail links:
+        # (pattern length, -rule order, category), so max() prefers long then early rules
+        self.best = [None]
+
+        for order, (pattern, category) in enumerate(self.rules.items()):
+            node = 0
+            for char in pattern:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.best.append(None)
+                node = next_node
+            self.best[node] = (len(pattern), -order, category)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                inherited = self.best[self.fail[child]]
+                if inherited and (self.best[child] is None or inherited > self.best[child]):
+                    self.best[child] = inherited
+
+    def __len__(self):
+        return len(self.rules)
+
+    def match(self, text):
+        """Category of the best rule found in text, None if no pattern occurs"""
+        goto, fail, best = self.goto, self.fail, self.best
+        node = 0
+        found = None
+        for char in text.upper():
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if best[node] is not None and (found is None or best[node] > found):
+                found = best[node]
+        return found[2] if found else None
+
+    def categorize(self, descriptions, details):
+        """Categories for parallel description/detail columns, each distinct text matched once"""
+        seen = {}
+        categories = []
+        for description, detail in zip(descriptions, details):
+            # Newline separator: no pattern can match across the two fields
+            text = f"{description or ''}\n{detail or ''}"
+            if text not in seen:
+                seen[text] = self.match(text)
+            categories.append(seen[text])
+        return categories
+
+    def apply(self, batch):
+        """Fill the category column of a TransactionBatch"""
+        batch.categories = self.categorize(batch.descriptions, batch.details)
+        return batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Categorize transaction text with the AFTIS rules file')
+    parser.add_argument('--rules', default=CATEGORY_RULES_PATH)
+    parser.add_argument('texts', nargs='+')
+    args = parser.parse_args()
+
+    try:
+        categorizer = Categorizer(load_rules(args.rules))
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    for text in args.texts:
+        print(f"{text}: {categorizer.match(text) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+AFTIS Statement Layouts
+Registry of extraction templates (tabula header area, table area and column
+boundaries) and a cheap page-1 fingerprint that picks one before any tabula
+call. The template chosen for a file is cached by its content hash.
+Usage: python layouts.py <pdf_file_path>...
+"""
+
+import os
+import sys
+import json
+import hashlib
+import logging
+import threading
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+# Areas are (top, left, bottom, right) in points from the top-left corner, as tabula expects.
+# Anchors are text that must start inside their area on page 1 for the template to match,
+# compared on letters and digits only.
+TEMPLATES = [
+    {
+        'name': 'bca-tahapan',
+        'anchors': [
+            {'text': 'NO. REKENING', 'area': (70, 315, 141, 548)},
+            {'text': 'PERIODE', 'area': (70, 315, 141, 548)},
+        ],
+        'header_area': (70, 315, 141, 548),
+        'table_area': (231, 25, 797, 577),
+        'table_columns': [86, 184, 300, 340, 467],
+    },
+]
+DEFAULT_TEMPLATE = 'bca-tahapan'
+
+# Extra templates, a JSON list in the TEMPLATES format, added to the registry
+LAYOUT_TEMPLATES_PATH = os.getenv('LAYOUT_TEMPLATES_PATH', '')
+# Persistent content hash → template name cache shared by parser runs; in-memory only when unset
+LAYOUT_CACHE_PATH = os.getenv('LAYOUT_CACHE_PATH', '')
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownLayoutError(ValueError):
+    """Raised by a strict fingerprint when page 1 has text but no template's anchors match it"""
+
+
+def load_templates(path=None):
+    """Built-in templates plus those of LAYOUT_TEMPLATES_PATH, most anchors first"""
+    path = LAYOUT_TEMPLATES_PATH if path is None else path
+    templates = list(TEMPLATES)
+    if path:
+        with open(path) as f:
+            templates = json.load(f) + templates
+    # A template with more anchors is more specific than one it overlaps with
+    return sorted(templates, key=lambda template: -len(template['anchors']))
+
+
+def page_lines(pdf_path):
+    """Text lines of page 1 as (top, left, text), None if the page has no text layer"""
+    page = PdfReader(pdf_path).pages[0]
+    height = float(page.mediabox.top)
+    lines = []
+
+    def visit(text, cm, tm, font_dict, font_size):
+        text = ' '.join(text.split())
+        if text:
+            # Text position in user space: text matrix times the current transformation matrix
+            x = tm[4] * cm[0] + tm[5] * cm[2] + cm[4]
+            y = tm[4] * cm[1] + tm[5] * cm[3] + cm[5]
+            lines.append((height - y, x, text.upper()))
+
+    page.extract_text(visitor_text=visit)
+    return lines or None
+
+
+def anchor_text(text):
+    """Letters and digits of text, upper case: a label drawn as several runs is joined
+    without spaces by pypdf ('NO.REKENING'), so spacing and punctuation are ignored"""
+    return ''.join(ch for ch in text.upper() if ch.isalnum())
+
+
+def matches(template, lines):
+    lines = [(line_top, line_left, anchor_text(text)) for line_top, line_left, text in lines]
+    for anchor in template['anchors']:
+        top, left, bottom, right = anchor['area']
+        text = anchor_text(anchor['text'])
+        if not any(
+            top <= line_top <= bottom and left <= line_left <= right and text in line_text
+            for line_top, line_left, line_text in lines
+        ):
+            return False
+    return True
+
+
+def fingerprint(pdf_path, templates=None, strict=False):
+    """Name of the first template whose anchors all match page 1
+
+    Statements without a readable text layer, or without pypdf installed, get
+    DEFAULT_TEMPLATE. So do statements whose text matches no template, with a
+    warning, unless strict: then UnknownLayoutError is raised. Whether the
+    default template can read them is up to tabula.
+    """
+    templates = load_templates() if templates is None else templates
+    if PdfReader is None:
+        return DEFAULT_TEMPLATE
+
+    try:
+        lines = page_lines(pdf_path)
+    except Exception:
+        lines = None  # pypdf cannot read it; tabula reports whether the file is usable
+    if lines is None:
+        return DEFAULT_TEMPLATE
+
+    for template in templates:
+        if matches(template, lines):
+            return template['name']
+    error = UnknownLayoutError(
+        f"Unrecognized statement layout, no template matches page 1 "
+        f"(known: {', '.join(template['name'] for template in templates)})"
+    )
+    if strict:
+        raise error
+    return fall_back(pdf_path, error)
+
+
+def fall_back(pdf_path, error):
+    logger.warning(f"{os.path.basename(pdf_path)}: {error}, trying {DEFAULT_TEMPLATE}")
+    return DEFAULT_TEMPLATE
+
+
+def file_sha256(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class LayoutCache:
+    """Content hash → template name, optionally persisted to a JSON file"""
+
+    def __init__(self, path=LAYOUT_CACHE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = self.load()
+
+    def load(self):
+        if not self.path or not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, sha256):
+        with self.lock:
+            return self.entries.get(sha256)
+
+    def put(self, sha256, name):
+        with self.lock:
+            self.entries[sha256] = name
+            if not self.path:
+                return
+            # Another parser process may have added entries since this one started
+            entries = self.load()
+            entries.update(self.entries)
+            self.entries = entries
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with open(temp_path, 'w') as f:
+                    json.dump(entries, f)
+                os.replace(temp_path, self.path)
+            except OSError:
+                pass  # The cache is an optimization, parsing goes on without it
+
+
+layout_cache = LayoutCache()
+
+
+def select_template(pdf_path, templates=None, cache=layout_cache):
+    """Extraction template for a statement, from the cache or one page-1 fingerprint"""
+    templates = load_templates() if templates is None else templates
+    by_name = {template['name']: template for template in templates}
+    sha256 = file_sha256(pdf_path)
+
+    name = cache.get(sha256)
+    if name not in by_name:
+        try:
+            name = fingerprint(pdf_path, templates, strict=True)
+        except UnknownLayoutError as e:
+            # Not cached: a template added later for this layout must still get the file
+            return by_name[fall_back(pdf_path, e)]
+        cache.put(sha256, name)
+    return by_name[name]
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__.strip().splitlines()[-1], file=sys.stderr)
+        sys.exit(1)
+
+    templates = load_templates()
+    for pdf_path in sys.argv[1:]:
+        try:
+            print(f"{pdf_path}: {fingerprint(pdf_path, templates, strict=True)}")
+        except (UnknownLayoutError, OSError) as e:
+            print(f"{pdf_path}: {e}")
+
+
+if __name__ == "__main__":
+    main()
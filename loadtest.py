@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+AFTIS Load and Soak Test
+Drops generated statements into a temporary inbox at a fixed rate and runs
+auto-processor.py and server.py against a throwaway local PostgreSQL (or
+SQLite with --storage sqlite), then
+reports throughput, file-to-row latency, retries, failed/ moves and peak RSS.
+Usage: python loadtest.py [--files 200] [--rate 20] [--pages 1 5] [--duration SECONDS] [--storage sqlite]
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+from datetime import datetime, timezone
+
+import statement_generator
+from benchmark import throwaway_storage, SkipCase
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+POLL_INTERVAL = 0.25
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def read_status(pid, field):
+    """Read a kB field such as VmRSS or VmHWM from /proc/<pid>/status"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def process_tree(root_pid):
+    """Return root_pid and all of its descendants, read from /proc"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # ppid is the 2nd field after the parenthesised command name
+        ppid = int(stat.rsplit(')', 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+
+    tree = [root_pid]
+    for pid in tree:
+        tree.extend(children.get(pid, []))
+    return tree
+
+
+class RSSSampler(threading.Thread):
+    """Sample peak RSS of each named process tree until stopped"""
+
+    def __init__(self, processes, interval=0.2):
+        super().__init__(daemon=True)
+        self.processes = processes
+        self.interval = interval
+        self.peak_tree_rss = {name: 0 for name in processes}
+        self.peak_root_rss = {name: 0 for name in processes}
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            for name, proc in self.processes.items():
+                tree = process_tree(proc.pid)
+                rss = sum(read_status(pid, 'VmRSS') for pid in tree)
+                self.peak_tree_rss[name] = max(self.peak_tree_rss[name], rss)
+                self.peak_root_rss[name] = max(self.peak_root_rss[name], read_status(proc.pid, 'VmHWM'))
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def wait_for_health(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{url}/health", timeout=2) as response:
+                if response.status == 200:
+                    return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def wait_for_log(log_path, marker, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if os.path.exists(log_path):
+            with open(log_path) as f:
+                if marker in f.read():
+                    return True
+        time.sleep(0.2)
+    return False
+
+
+def stage_statements(staging_dir, files, pages, seed):
+    """Pre-generate PDFs so generation cost stays out of the measurement"""
+    staged = []
+    for index in range(files):
+        page_count = pages[index % len(pages)]
+        account_number = f"{9_000_000_000 + index}"
+        statement = statement_generator.generate_statement(
+            pages=page_count, seed=seed + index, account_number=account_number
+        )
+        pdf_path = os.path.join(staging_dir, f"{account_number}.pdf")
+        statement_generator.write_pdf(statement, pdf_path)
+        staged.append({
+            'account_number': account_number,
+            'path': pdf_path,
+            'pages': page_count,
+            'transactions': statement['transaction_count'],
+        })
+    return staged
+
+
+def drop_files(staged, inbox, rate, duration, dropped):
+    """Move staged files into the inbox at `rate` files/s, Syncthing style (temp name, then rename)"""
+    start = time.time()
+    index = 0
+    while index < len(staged):
+        if duration and time.time() - start > duration:
+            break
+        item = staged[index]
+        temp_path = os.path.join(inbox, f".syncthing.{item['account_number']}.tmp")
+        shutil.copyfile(item['path'], temp_path)
+        os.replace(temp_path, os.path.join(inbox, os.path.basename(item['path'])))
+        dropped[item['account_number']] = time.time()
+        index += 1
+        if rate > 0:
+            next_at = start + index / rate
+            time.sleep(max(0.0, next_at - time.time()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load/soak test the inbox → auto-processor → server → Postgres pipeline')
+    parser.add_argument('--files', type=int, default=200, help='Statements to drop')
+    parser.add_argument('--rate', type=float, default=20, help='Files per second, 0 drops everything at once')
+    parser.add_argument('--pages', type=int, nargs='+', default=[1], help='Page counts, used round robin')
+    parser.add_argument('--duration', type=float, default=0,
+                        help='Soak mode: keep dropping at --rate for this many seconds')
+    parser.add_argument('--drain-timeout', type=float, default=600,
+                        help='Seconds to wait for the pipeline after the last drop')
+    parser.add_argument('--process-delay', default='2', help='PROCESS_DELAY_SECONDS for the auto-processor')
+    parser.add_argument('--schedule-policy', default=os.getenv('SCHEDULE_POLICY', 'sjf'),
+                        choices=('fifo', 'sjf', 'lanes'), help='SCHEDULE_POLICY for the auto-processor')
+    parser.add_argument('--storage', default=os.getenv('STORAGE_BACKEND', 'postgres'),
+                        choices=('postgres', 'sqlite'), help='STORAGE_BACKEND for the server')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='loadtest-results.json')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='aftis-load-')
+    paths = {name: os.path.join(work_dir, name) for name in ('inbox', 'failed', 'tmp', 'staging')}
+    for path in paths.values():
+        os.makedirs(path)
+
+    processes = {}
+    try:
+        files = args.files
+        if args.duration and args.rate > 0:
+            # Soak: stage enough statements to keep dropping at `rate` for the whole duration
+            files = max(files, int(args.rate * args.duration))
+        print(f"Generating {files} statements...")
+        staged = stage_statements(paths['staging'], files, args.pages, args.seed)
+
+        with throwaway_storage(args.storage) as db_env:
+            port = free_port()
+            parser_url = f"http://127.0.0.1:{port}"
+            env = dict(os.environ, **db_env)
+            env.update({
+                'AFTIS_PORT': str(port),
+                'INBOX_PATH': paths['inbox'],
+                'TMP_PATH': paths['tmp'],
+                'FAILED_PATH': paths['failed'],
+                'PARSER_SCRIPT': os.path.join(HERE, 'parse.py'),
+                'PARSER_URL': parser_url,
+                'LOG_PATH': os.path.join(work_dir, 'auto-processor.log'),
+                'PROCESS_DELAY_SECONDS': args.process_delay,
+                'SCHEDULE_POLICY': args.schedule_policy,
+            })
+
+            processes['server'] = subprocess.Popen(
+                [sys.executable, os.path.join(HERE, 'server.py')],
+                env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            if not wait_for_health(parser_url):
+                raise RuntimeError("server.py did not become healthy")
+
+            processes['auto-processor'] = subprocess.Popen(
+                [sys.executable, os.path.join(HERE, 'auto-processor.py')],
+                env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+
+            if not wait_for_log(env['LOG_PATH'], 'Watching'):
+                raise RuntimeError("auto-processor.py did not start watching the inbox")
+
+            sampler = RSSSampler(processes)
+            sampler.start()
+
+            dropped = {}
+            completed = {}
+            dropper = threading.Thread(
+                target=drop_files,
+                args=(staged, paths['inbox'], args.rate, args.duration, dropped),
+                daemon=True
+            )
+            started_at = time.time()
+            dropper.start()
+
+            if args.storage == 'sqlite':
+                import sqlite3
+                conn = sqlite3.connect(db_env['SQLITE_PATH'], isolation_level=None, timeout=30)
+            else:
+                import psycopg2
+                conn = psycopg2.connect(
+                    host=db_env['POSTGRES_HOST'], port=db_env['POSTGRES_PORT'],
+                    dbname=db_env['POSTGRES_DB'], user=db_env['POSTGRES_USER']
+                )
+                conn.autocommit = True
+            cursor = conn.cursor()
+            rows_seen = 0
+            last_drop_done = None
+            while True:
+                cursor.execute("SELECT account_number, COUNT(*) FROM transactions GROUP BY account_number")
+                now = time.time()
+                rows_seen = 0
+                for account_number, count in cursor.fetchall():
+                    rows_seen += count
+                    if account_number in dropped and account_number not in completed:
+                        completed[account_number] = now
+
+                failed = [f for f in os.listdir(paths['failed']) if f.lower().endswith('.pdf')]
+                if not dropper.is_alive():
+                    last_drop_done = last_drop_done or now
+                    if len(completed) + len(failed) >= len(dropped):
+                        break
+                    if now - last_drop_done > args.drain_timeout:
+                        print("✗ Drain timeout reached, reporting partial results", file=sys.stderr)
+                        break
+                time.sleep(POLL_INTERVAL)
+            finished_at = time.time()
+            conn.close()
+
+            # Server-side connection reuse and per-route latency
+            try:
+                with urllib.request.urlopen(f"{parser_url}/metrics", timeout=5) as response:
+                    server_http = json.load(response)
+            except OSError:
+                server_http = None
+
+            sampler.stop()
+
+        with open(os.path.join(work_dir, 'auto-processor.log')) as f:
+            log_lines = f.readlines()
+        retries = sum(1 for line in log_lines if ' - Retry ' in line)
+        failed_moves = sum(1 for line in log_lines if 'Moved failed file' in line)
+
+        latencies = [completed[acc] - dropped[acc] for acc in completed]
+        elapsed = finished_at - started_at
+        report = {
+            'generated_at': datetime.now(timezone.utc).isoformat(),
+            'config': {
+                'files': len(dropped),
+                'rate': args.rate,
+                'pages': args.pages,
+                'duration': args.duration,
+                'process_delay_seconds': args.process_delay,
+                'schedule_policy': args.schedule_policy,
+                'storage': args.storage,
+                'poll_interval_seconds': POLL_INTERVAL,
+            },
+            'elapsed_seconds': round(elapsed, 3),
+            'completed_files': len(completed),
+            'failed_moves': failed_moves,
+            'failed_files': len(failed),
+            'missing_files': len(dropped) - len(completed) - len(failed),
+            'retries': retries,
+            'rows': rows_seen,
+            'throughput': {
+                'files_per_second': round(len(completed) / elapsed, 3) if elapsed else None,
+                'rows_per_second': round(rows_seen / elapsed, 3) if elapsed else None,
+            },
+            'latency_seconds': {
+                'p50': percentile(latencies, 50),
+                'p95': percentile(latencies, 95),
+                'p99': percentile(latencies, 99),
+                'max': max(latencies) if latencies else None,
+            },
+            'server_http': server_http,
+            'peak_rss_mb': {
+                name: {
+                    'process': round(sampler.peak_root_rss[name] / 2 ** 20, 1),
+                    'tree': round(sampler.peak_tree_rss[name] / 2 ** 20, 1),
+                }
+                for name in processes
+            },
+        }
+
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+        print(f"Files: {report['completed_files']}/{len(dropped)} stored, "
+              f"{report['failed_files']} failed, {report['retries']} retries")
+        print(f"Throughput: {report['throughput']['files_per_second']} files/s, "
+              f"{report['throughput']['rows_per_second']} rows/s")
+        lat = report['latency_seconds']
+        if latencies:
+            print(f"Latency: p50 {lat['p50']:.2f}s  p95 {lat['p95']:.2f}s  p99 {lat['p99']:.2f}s  max {lat['max']:.2f}s")
+        if server_http and server_http['requests']:
+            print(f"Server HTTP: {server_http['requests']} requests over {server_http['connections']} connections, "
+                  f"{server_http['connection_reuse_rate']:.1%} reused")
+        for name, rss in report['peak_rss_mb'].items():
+            print(f"Peak RSS {name}: {rss['process']} MB (with children {rss['tree']} MB)")
+        print(f"Results written to {args.output}")
+
+    except SkipCase as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        for proc in processes.values():
+            proc.terminate()
+        for proc in processes.values():
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,29 @@ from tabula import read_pdf
 import pandas as pd
 import numpy as np
 import os
+import json
+import argparse
+from decimal import Decimal
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
-from openpyxl import load_workbook
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
+
+# One cents parser and one content hash for the standalone script and the service
+from parse import AMOUNT_PATTERN, cents_from_parts, extract_amounts
+from layouts import file_sha256
+
+try:
+    import pyarrow  # noqa: F401
+    STRING_DTYPE = 'string[pyarrow]'
+except ImportError:
+    STRING_DTYPE = 'string'
+
+CURRENCY_FORMAT = '_-Rp* #,##0.00_-;[Red]-Rp* #,##0.00_-;_-Rp* "-"_-;_-@_-'
+CURRENCY_COLUMNS = ['amount', 'balance']
+MANIFEST_FILENAME = 'statements-manifest.json'
 
 
 def is_currency(value):
@@ -19,33 +40,34 @@ def is_currency(value):
 
 def clean_numeric_columns(dataframe, columns):
 
+    # Columns already parsed to cents (amount, by union_source) are kept
     for column in columns:
-        dataframe[column] = dataframe[column].str.replace(',', '')
-        dataframe[column] = pd.to_numeric(dataframe[column], errors='coerce')
-        dataframe[column] = dataframe[column].astype('float')
+        if not pd.api.types.is_integer_dtype(dataframe[column]):
+            dataframe[column] = cents_from_parts(extract_amounts(dataframe[column]))
 
     return dataframe
 
 
 def union_source(dataframes):
 
-    dfs = []
-    for temp_df in dataframes:
+    # Cells of every transaction page (6 columns) copied once into a single object array
+    cells = np.concatenate([temp_df.to_numpy(dtype=object) for temp_df in dataframes if len(temp_df.columns) == 6])
 
-        # Split DB into new column
-        temp_df[['amount', 'type']] = temp_df[4].str.extract(r'([\d,]+(?:\.\d+)?)\s*(DB|CR)?')
-        temp_df = temp_df.drop(temp_df.columns[4], axis=1)
+    # Amount in cents and DB/CR from one pass over the whole mutasi column
+    parts = extract_amounts(pd.Series(cells[:, 4], dtype=object))
 
-        if(len(temp_df.columns) == 7):
-            # Name column and reorder
-            temp_df.columns = ['date', 'desc', 'detail', 'branch', 'balance', 'amount', 'type']
-            temp_df = temp_df[['date', 'desc', 'detail', 'branch', 'amount', 'type', 'balance']]
+    # Repetitive columns as categoricals, free text as Arrow-backed strings when available
+    df = pd.DataFrame({
+        'date': pd.Categorical(cells[:, 0]),
+        'desc': pd.Categorical(cells[:, 1]),
+        'detail': pd.array(cells[:, 2], dtype=STRING_DTYPE),
+        'branch': pd.Categorical(cells[:, 3]),
+        'amount': cents_from_parts(parts).array,
+        'type': pd.Categorical(parts[4]),
+        # Converted to cents right away by clean_numeric_columns
+        'balance': pd.Series(cells[:, 5], dtype=object),
+    })
 
-            dfs.append(temp_df)
-
-    df = pd.concat(dfs, ignore_index=True)
-    df = df.fillna(value=np.nan)
-                
     return df
 
 
@@ -126,32 +148,28 @@ def extract_transactions(dataframe):
     return transaction_dataframe
 
 
-def calculate_balance(dataframe):
+def calculate_balance(dataframe, init_balance):
 
-    dataframe['balance'] = init_balance
-    # Iterate over rows
-    for index, row in dataframe.iterrows():
-        # If transaction type is 'DB', subtract amount from balance
-        if row['transaction_type'] == 'DB':
-            if index == 0:
-                # For the first row, subtract amount from init_balance
-                dataframe.at[index, 'balance'] -= row['amount']
-            else:
-                # For subsequent rows, subtract amount from the previous row's balance
-                dataframe.at[index, 'balance'] = dataframe.at[index - 1, 'balance'] - row['amount']
-        # If transaction type is 'CR', add amount to balance
-        elif row['transaction_type'] == 'CR':
-            if index == 0:
-                # For the first row, add amount to init_balance
-                dataframe.at[index, 'balance'] += row['amount']
-            else:
-                # For subsequent rows, add amount to the previous row's balance
-                dataframe.at[index, 'balance'] = dataframe.at[index - 1, 'balance'] + row['amount']
+    # Running balance in integer cents: DB subtracts, CR adds
+    amounts = dataframe['amount'].fillna(0).to_numpy(dtype='int64')
+    transaction_type = dataframe['transaction_type'].to_numpy()
+    signed = np.where(transaction_type == 'DB', -amounts, np.where(transaction_type == 'CR', amounts, 0))
+    dataframe['balance'] = init_balance + np.cumsum(signed)
 
     return dataframe
 
 
-def save_to_csv(dataframe, output_filename):
+def to_rupiah(dataframe):
+
+    # Cents become exact Decimal rupiah only for the Excel and CSV output
+    dataframe = dataframe.copy()
+    for column in CURRENCY_COLUMNS:
+        dataframe[column] = [None if pd.isna(cents) else Decimal(int(cents)).scaleb(-2) for cents in dataframe[column]]
+
+    return dataframe
+
+
+def save_to_csv(dataframe, output_filename, periode):
     
     base_filename = output_filename.replace('.xlsx', '')
     csv_filename = f"{base_filename}_{periode}.csv"
@@ -159,90 +177,217 @@ def save_to_csv(dataframe, output_filename):
     
     df_trimmed.to_csv(csv_filename, index=False)
     
-    return
+    return csv_filename
 
 
-def save_to_excel(dataframe, output_filename):
+def get_year_month(sheet_name):
+    year, month_name = sheet_name.split(' ')
+    month_dict = {
+        'JANUARI': 1, 'FEBRUARI': 2, 'MARET': 3, 'APRIL': 4,
+        'MEI': 5, 'JUNI': 6, 'JULI': 7, 'AGUSTUS': 8,
+        'SEPTEMBER': 9, 'OKTOBER': 10, 'NOVEMBER': 11, 'DESEMBER': 12
+    }
+    return int(year), month_dict[month_name]
 
-    if os.path.isfile(output_filename):
-        writer = pd.ExcelWriter(output_filename, engine="openpyxl", mode='a', if_sheet_exists='replace')
-    else:
-        writer = pd.ExcelWriter(output_filename, engine="openpyxl")
 
-    dataframe.to_excel(writer, sheet_name=periode, index=False)
+def column_widths(dataframe):
+
+    # Vectorized autofit: longest string form of each column, header included
+    widths = []
+    for column in dataframe.columns:
+        lengths = dataframe[column].astype(str).str.len().fillna(0)
+        max_length = max(len(str(column)), int(lengths.max()) if len(lengths) else 0)
+        widths.append(max_length + (10 if column in CURRENCY_COLUMNS else 2))
+
+    return widths
+
+
+def write_sheet(worksheet, dataframe):
+
+    for index, width in enumerate(column_widths(dataframe), start=1):
+        worksheet.column_dimensions[get_column_letter(index)].width = width
 
-    workbook = writer.book
-    worksheet = writer.sheets[periode]
+    header_font = Font(bold=True)
+    header = []
+    for column in dataframe.columns:
+        cell = WriteOnlyCell(worksheet, value=column)
+        cell.font = header_font
+        header.append(cell)
+    worksheet.append(header)
 
     # Format column into currency IDR
-    for cell in worksheet['E']:
-        cell.number_format = '_-Rp* #,##0.00_-;[Red]-Rp* #,##0.00_-;_-Rp* "-"_-;_-@_-'
-    for cell in worksheet['G']:
-        cell.number_format = '_-Rp* #,##0.00_-;[Red]-Rp* #,##0.00_-;_-Rp* "-"_-;_-@_-'
+    currency_positions = [index for index, column in enumerate(dataframe.columns) if column in CURRENCY_COLUMNS]
+    for row in dataframe.itertuples(index=False, name=None):
+        values = [None if pd.isna(value) else value for value in row]
+        for index in currency_positions:
+            cell = WriteOnlyCell(worksheet, value=values[index])
+            cell.number_format = CURRENCY_FORMAT
+            values[index] = cell
+        worksheet.append(values)
 
-    # Autofit column width
-    for column_cells in worksheet.columns:
-        max_length = max(len(str(cell.value)) for cell in column_cells)
-        if str(column_cells[0].column) in ['5', '7']:
-            worksheet.column_dimensions[column_cells[0].column_letter].width = max_length + 10
-        else:
-            worksheet.column_dimensions[column_cells[0].column_letter].width = max_length + 2
+    return
+
+
+def stored_sheet(worksheet):
+
+    # Cell values as stored, one sheet at a time; no type inference as with pd.read_excel
+    rows = list(worksheet.iter_rows(values_only=True))
+    if not rows:
+        return pd.DataFrame()
+    return pd.DataFrame(rows[1:], columns=rows[0], dtype=object)
 
-    writer.close()
+
+def save_workbook(sheets, output_filename, force=False):
+
+    # Sheets of other periods are copied from the existing workbook, unless rebuilding from scratch
+    existing = None
+    if not force and os.path.isfile(output_filename):
+        existing = load_workbook(output_filename, read_only=True)
+    kept = [sheet_name for sheet_name in existing.sheetnames if sheet_name not in sheets] if existing else []
+
+    workbook = Workbook(write_only=True)
+    try:
+        # Sheet order is decided up front, newest period first
+        for periode in sorted([*sheets, *kept], key=get_year_month, reverse=True):
+            dataframe = sheets[periode] if periode in sheets else stored_sheet(existing[periode])
+            write_sheet(workbook.create_sheet(title=periode), dataframe)
+    finally:
+        if existing:
+            existing.close()
+
+    # Written aside and swapped in, so an interrupted save leaves the old workbook intact
+    temp_filename = f"{output_filename}.tmp"
+    workbook.save(temp_filename)
+    os.replace(temp_filename, output_filename)
 
     return
 
 
-def get_year_month(sheet_name):
-    year, month_name = sheet_name.split(' ')
-    month_dict = {
-        'JANUARI': 1, 'FEBRUARI': 2, 'MARET': 3, 'APRIL': 4,
-        'MEI': 5, 'JUNI': 6, 'JULI': 7, 'AGUSTUS': 8,
-        'SEPTEMBER': 9, 'OKTOBER': 10, 'NOVEMBER': 11, 'DESEMBER': 12
-    }
-    return int(year), month_dict[month_name]
+def parse_statement(file_path):
+
+    # Get header information
+    header_dataframe = read_pdf(file_path, area = (70, 315, 141, 548), pages='1', pandas_options={'header': None, 'dtype': str}, force_subprocess=True)[0]
+    periode = header_dataframe.loc[header_dataframe[0] == 'PERIODE', 2].values[0]
+    periode = ' '.join(reversed(periode.split()))
+    no_rekening = header_dataframe.loc[header_dataframe[0] == 'NO. REKENING', 2].values[0]
+
+    # y1, x1, y2, x2
+    dataframes = read_pdf(file_path, area = (231, 25, 797, 577), columns=[86, 184, 300, 340, 467], pages='all', pandas_options={'header': None, 'dtype': str}, force_subprocess=True)
+
+    init_balance = dataframes[0].loc[dataframes[0][1] == 'SALDO AWAL', 5].values[0]
+    init_balance = int(cents_from_parts(pd.Series([init_balance]).str.extract(AMOUNT_PATTERN)).iloc[0])
+
+    df = union_source(dataframes)
+    df = clean_numeric_columns(df, ['amount', 'balance'])
+    df = insert_shifted_column(df)
+
+    transaction_dataframe = extract_transactions(df)
+    transaction_dataframe = transaction_dataframe.drop('balance', axis=1)
+    transaction_dataframe = calculate_balance(transaction_dataframe, init_balance)
+
+    return periode, no_rekening, transaction_dataframe
+
+
+def load_manifest(manifest_path):
+
+    if not os.path.isfile(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
 
 
-def reorder_sheets(output_filename):
+def save_manifest(manifest, manifest_path):
 
-    wb = load_workbook(output_filename)
-    sheet_names = wb.sheetnames
-    sorted_sheets = sorted(sheet_names, key=get_year_month, reverse=True)
-    wb._sheets.sort(key=lambda x: sorted_sheets.index(x.title))
-    wb.save(output_filename)
+    temp_path = f"{manifest_path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(temp_path, manifest_path)
 
     return
 
-statements_folder = "statements"
-pbar = tqdm(os.listdir(statements_folder))
-for filename in pbar:
-    file_path = os.path.join(statements_folder, filename)
-    pbar.set_description("Processing %s" % filename)
 
-    if os.path.isfile(file_path):
+def is_unchanged(entry, file_path):
 
-        # Get header information
-        header_dataframe = read_pdf(file_path, area = (70, 315, 141, 548), pages='1', pandas_options={'header': None, 'dtype': str}, force_subprocess=True)[0]
-        periode = header_dataframe.loc[header_dataframe[0] == 'PERIODE', 2].values[0]
-        periode = ' '.join(reversed(periode.split()))
-        no_rekening = header_dataframe.loc[header_dataframe[0] == 'NO. REKENING', 2].values[0]
-        output_filename = f'{no_rekening}.xlsx'
+    # A statement is skipped when its content is unchanged and its outputs still exist
+    if not entry:
+        return False
+    if not (os.path.isfile(entry['workbook']) and os.path.isfile(entry['csv'])):
+        return False
+
+    stat = os.stat(file_path)
+    if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+        return True
+    if file_sha256(file_path) == entry['sha256']:
+        entry['mtime'] = stat.st_mtime
+        return True
+
+    return False
+
+
+def main():
 
-        # y1, x1, y2, x2
-        dataframes = read_pdf(file_path, area = (231, 25, 797, 577), columns=[86, 184, 300, 340, 467], pages='all', pandas_options={'header': None, 'dtype': str}, force_subprocess=True)
+    parser = argparse.ArgumentParser(description='Convert BCA e-statements into Excel and CSV')
+    parser.add_argument('--statements', default='statements', help='Folder with statement PDFs')
+    parser.add_argument('--jobs', type=int, default=1, help='Statements parsed in parallel (default: 1)')
+    parser.add_argument('--force', action='store_true', help='Reparse every statement, ignoring the manifest')
+    parser.add_argument('--manifest', default=MANIFEST_FILENAME, help='Manifest of processed statements')
+    args = parser.parse_args()
 
-        init_balance = dataframes[0].loc[dataframes[0][1] == 'SALDO AWAL', 5].values[0]
-        init_balance = float(init_balance.replace(',', ''))
+    file_paths = [os.path.join(args.statements, filename) for filename in os.listdir(args.statements)]
+    file_paths = [file_path for file_path in file_paths if os.path.isfile(file_path)]
+
+    manifest = {} if args.force else load_manifest(args.manifest)
+    manifest = {file_path: entry for file_path, entry in manifest.items() if file_path in file_paths}
+
+    # Only new or changed statements are parsed, their accounts' sheets and CSVs rewritten
+    file_paths = [file_path for file_path in file_paths if not is_unchanged(manifest.get(file_path), file_path)]
+    if not file_paths:
+        save_manifest(manifest, args.manifest)
+        print("All statements are up to date")
+        return
+
+    workbooks = {}
+    pbar = tqdm(total=len(file_paths))
+
+    if args.jobs > 1:
+        # Parse in worker processes, write in this one so output stays serialized and ordered
+        executor = ProcessPoolExecutor(max_workers=args.jobs)
+        results = executor.map(parse_statement, file_paths)
+    else:
+        executor = None
+        results = map(parse_statement, file_paths)
+
+    try:
+        for file_path, (periode, no_rekening, transaction_dataframe) in zip(file_paths, results):
+            pbar.set_description("Processing %s" % os.path.basename(file_path))
+            output_filename = f'{no_rekening}.xlsx'
+            transaction_dataframe = to_rupiah(transaction_dataframe)
+            csv_filename = save_to_csv(transaction_dataframe, output_filename, periode)
+            workbooks.setdefault(output_filename, {})[periode] = transaction_dataframe
+
+            stat = os.stat(file_path)
+            manifest[file_path] = {
+                'sha256': file_sha256(file_path),
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'account': no_rekening,
+                'periode': periode,
+                'workbook': output_filename,
+                'sheet': periode,
+                'csv': csv_filename,
+            }
+            pbar.update(1)
+    finally:
+        if executor:
+            executor.shutdown()
+        pbar.close()
 
-        df = union_source(dataframes)
-        df = clean_numeric_columns(df, ['amount', 'balance'])
-        df = insert_shifted_column(df)
+    # Each account workbook is written once, with every period collected above
+    for output_filename, sheets in sorted(workbooks.items()):
+        save_workbook(sheets, output_filename, force=args.force)
 
-        transaction_dataframe = extract_transactions(df)
-        transaction_dataframe = transaction_dataframe.drop('balance', axis=1)
-        transaction_dataframe = calculate_balance(transaction_dataframe)
+    save_manifest(manifest, args.manifest)
 
-        save_to_excel(transaction_dataframe, output_filename)
-        save_to_csv(transaction_dataframe, output_filename)
 
-reorder_sheets(output_filename)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+AFTIS Memory Budgets
+Per-job memory figures (tracemalloc heap peak and sampled RSS), a process
+pool whose workers are replaced after a number of jobs or once their RSS
+passes a threshold, and admission of parse jobs by their estimated size so
+concurrent large statements cannot push a container past its memory limit.
+"""
+
+import os
+import json
+import queue
+import resource
+import threading
+import tracemalloc
+import multiprocessing
+from concurrent.futures import Future
+
+# Total memory parse jobs may use at once, by their estimates; 0 disables admission control
+PARSE_MEMORY_BUDGET_MB = float(os.getenv('PARSE_MEMORY_BUDGET_MB', '2048'))
+# Estimate of a job before any has been measured: base (interpreter, pandas, a tabula JVM) plus per page
+PARSE_MEMORY_BASE_MB = float(os.getenv('PARSE_MEMORY_BASE_MB', '300'))
+PARSE_MEMORY_PER_PAGE_MB = float(os.getenv('PARSE_MEMORY_PER_PAGE_MB', '2'))
+# Long-lived parse workers are replaced after this many jobs or above this RSS
+PARSE_WORKER_MAX_JOBS = int(os.getenv('PARSE_WORKER_MAX_JOBS', '50'))
+PARSE_WORKER_MAX_RSS_MB = float(os.getenv('PARSE_WORKER_MAX_RSS_MB', '1024'))
+# tracemalloc slows allocation-heavy code; RSS figures are collected either way
+PARSE_TRACEMALLOC = os.getenv('PARSE_TRACEMALLOC', 'true').lower() == 'true'
+
+RSS_SAMPLE_SECONDS = 0.05
+# Smaller jobs are dominated by the base cost and say nothing about the per-page cost
+LEARN_MIN_PAGES = 10
+# Prefix of the stderr line the parser reports its memory figures on
+MEMORY_REPORT_PREFIX = 'AFTIS_MEMORY '
+MB = 2 ** 20
+
+
+def rss_bytes(pid='self'):
+    """Current resident set size of a process, 0 if unknown"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def children_peak_bytes():
+    """Largest peak RSS of any terminated child, e.g. a tabula JVM"""
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+
+
+class JobMemory:
+    """Measure one job: Python heap peak with tracemalloc, process RSS sampled in the background"""
+
+    def __init__(self, trace=PARSE_TRACEMALLOC):
+        self.trace = trace
+        self.figures = {}
+        self.stopped = threading.Event()
+
+    def __enter__(self):
+        if self.trace:
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+            else:
+                tracemalloc.start()
+        self.rss_start = self.rss_peak = rss_bytes()
+        self.children_start = children_peak_bytes()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+        return self
+
+    def sample(self):
+        while not self.stopped.wait(RSS_SAMPLE_SECONDS):
+            self.rss_peak = max(self.rss_peak, rss_bytes())
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.sampler.join()
+        rss_end = rss_bytes()
+        children_peak = children_peak_bytes()
+        self.figures = {
+            'rss_start_mb': round(self.rss_start / MB, 1),
+            'rss_peak_mb': round(max(self.rss_peak, rss_end) / MB, 1),
+            'rss_end_mb': round(rss_end / MB, 1),
+            # Only children that reached a new peak during this job are attributed to it
+            'children_peak_mb': round(children_peak / MB, 1) if children_peak > self.children_start else None,
+        }
+        if self.trace:
+            self.figures['heap_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / MB, 1)
+            tracemalloc.stop()
+        return False
+
+
+def total_peak_mb(figures):
+    """Peak of a job's process plus its largest child, the figure budgets are kept in"""
+    return figures['rss_peak_mb'] + (figures.get('children_peak_mb') or 0)
+
+
+def format_memory(figures):
+    heap = f"heap {figures['heap_peak_mb']} MB, " if figures.get('heap_peak_mb') is not None else ''
+    children = f", JVM {figures['children_peak_mb']} MB" if figures.get('children_peak_mb') else ''
+    return f"{heap}RSS peak {figures['rss_peak_mb']} MB (end {figures['rss_end_mb']} MB){children}"
+
+
+def memory_report_line(figures):
+    return MEMORY_REPORT_PREFIX + json.dumps(figures)
+
+
+def split_memory_report(stderr_text):
+    """(figures or None, remaining stderr) of a parser's stderr output"""
+    figures = None
+    lines = []
+    for line in stderr_text.splitlines():
+        if line.startswith(MEMORY_REPORT_PREFIX):
+            try:
+                figures = json.loads(line[len(MEMORY_REPORT_PREFIX):])
+                continue
+            except ValueError:
+                pass
+        lines.append(line)
+    return figures, '\n'.join(lines)
+
+
+class MemoryBudgetExceeded(Exception):
+    """Raised for a job whose estimated memory alone is above the budget"""
+
+    def __init__(self, estimate_mb, budget_mb):
+        super().__init__(f"Estimated {estimate_mb:.0f} MB exceeds the {budget_mb:.0f} MB parse memory budget")
+        self.estimate_mb = estimate_mb
+        self.budget_mb = budget_mb
+
+
+class MemoryBudget:
+    """Admit parse jobs while the estimates of running jobs fit the budget
+
+    A job's estimate is a base plus a per-page cost learned from the peaks of
+    measured jobs of LEARN_MIN_PAGES pages or more (the largest recent
+    per-page figure, so estimates err high).
+    """
+
+    def __init__(self, budget_mb=PARSE_MEMORY_BUDGET_MB, base_mb=PARSE_MEMORY_BASE_MB,
+                 per_page_mb=PARSE_MEMORY_PER_PAGE_MB, window=200):
+        self.budget_mb = budget_mb
+        self.base_mb = base_mb
+        self.default_per_page_mb = per_page_mb
+        self.window = window
+        self.condition = threading.Condition()
+        self.reserved_mb = 0.0
+        self.running = 0
+        self.per_page_samples = []
+        self.peaks = []
+        self.last_job = None
+        self.counts = {'admitted': 0, 'waited': 0, 'rejected': 0, 'measured': 0}
+
+    @property
+    def per_page_mb(self):
+        return max(self.per_page_samples) if self.per_page_samples else self.default_per_page_mb
+
+    def estimate(self, pages):
+        with self.condition:
+            return self.base_mb + self.per_page_mb * max(1, pages)
+
+    def acquire(self, estimate_mb, aborted=lambda: False):
+        """Reserve estimate_mb, waiting for running jobs to finish; raises MemoryBudgetExceeded
+
+        Returns False, without a reservation, if the caller's abort check turns
+        true while waiting; otherwise give the reservation back with release().
+        A job estimated above the whole budget is rejected outright, and one
+        job is always admitted when nothing else runs.
+        """
+        with self.condition:
+            if not self.budget_mb:
+                self.running += 1
+                self.counts['admitted'] += 1
+                return True
+            if estimate_mb > self.budget_mb:
+                self.counts['rejected'] += 1
+                raise MemoryBudgetExceeded(estimate_mb, self.budget_mb)
+            if self.running and self.reserved_mb + estimate_mb > self.budget_mb:
+                self.counts['waited'] += 1
+                while self.running and self.reserved_mb + estimate_mb > self.budget_mb:
+                    if aborted():
+                        return False
+                    self.condition.wait(0.5)
+            self.reserved_mb += estimate_mb
+            self.running += 1
+            self.counts['admitted'] += 1
+            return True
+
+    def release(self, estimate_mb):
+        with self.condition:
+            if self.budget_mb:
+                self.reserved_mb = max(0.0, self.reserved_mb - estimate_mb)
+            self.running -= 1
+            self.condition.notify_all()
+
+    def observe(self, pages, figures):
+        """Learn from a finished job's measured figures"""
+        peak_mb = total_peak_mb(figures)
+        with self.condition:
+            self.counts['measured'] += 1
+            self.last_job = dict(figures, pages=pages)
+            self.peaks.append(peak_mb)
+            del self.peaks[:-self.window]
+            if pages >= LEARN_MIN_PAGES:
+                self.per_page_samples.append(max(0.0, peak_mb - self.base_mb) / pages)
+                del self.per_page_samples[:-self.window]
+
+    def snapshot(self):
+        with self.condition:
+            peaks = sorted(self.peaks)
+            return dict(
+                self.counts,
+                budget_mb=self.budget_mb,
+                reserved_mb=round(self.reserved_mb, 1),
+                running=self.running,
+                per_page_mb=round(self.per_page_mb, 2),
+                peak_p50_mb=peaks[(len(peaks) - 1) // 2] if peaks else None,
+                peak_max_mb=peaks[-1] if peaks else None,
+                last_job=self.last_job,
+            )
+
+
+class WorkerCrashed(Exception):
+    """Raised for a job whose worker process died, e.g. killed for using too much memory"""
+
+
+def worker_main(conn, max_jobs, max_rss_mb):
+    """Run jobs sent over conn until told to stop or due for recycling"""
+    jobs = 0
+    while True:
+        task = conn.recv()
+        if task is None:
+            return
+        func, args = task
+        with JobMemory() as meter:
+            try:
+                ok, value = True, func(*args)
+            except Exception as e:
+                ok, value = False, e
+        jobs += 1
+        # pandas and tabula rarely give memory back; a fresh process does
+        recycle = 'jobs' if jobs >= max_jobs else 'rss' if meter.figures['rss_end_mb'] > max_rss_mb else None
+        try:
+            conn.send((ok, value, meter.figures, recycle))
+        except Exception as e:
+            # Unpicklable result or exception
+            conn.send((False, RuntimeError(f"{type(value).__name__}: {value}"[:500] if not ok else str(e)),
+                       meter.figures, recycle))
+        if recycle:
+            return
+
+
+class WorkerPool:
+    """Process pool of measured jobs whose workers are replaced after max_jobs jobs or above max_rss_mb
+
+    submit() returns a concurrent.futures.Future; its `memory` attribute holds
+    the job's figures once it is done. A worker that dies fails its job with
+    WorkerCrashed and is replaced.
+    """
+
+    def __init__(self, workers, max_jobs=PARSE_WORKER_MAX_JOBS, max_rss_mb=PARSE_WORKER_MAX_RSS_MB):
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.tasks = queue.Queue()
+        self.lock = threading.Lock()
+        self.recycled = {'jobs': 0, 'rss': 0, 'crashed': 0}
+        self.threads = [threading.Thread(target=self.supervise, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, func, *args):
+        future = Future()
+        future.memory = None
+        self.tasks.put((future, func, args))
+        return future
+
+    def start_worker(self):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(
+            target=worker_main, args=(child_conn, self.max_jobs, self.max_rss_mb), daemon=True
+        )
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+
+    def supervise(self):
+        """Feed one worker process at a time, replacing it when it recycles itself or dies"""
+        process = conn = None
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            future, func, args = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            if process is None:
+                process, conn = self.start_worker()
+            try:
+                conn.send((func, args))
+                ok, value, figures, recycle = conn.recv()
+            except (EOFError, OSError):
+                process.join()
+                with self.lock:
+                    self.recycled['crashed'] += 1
+                future.set_exception(WorkerCrashed(f"Parse worker exited with status {process.exitcode}"))
+                process = None
+                continue
+            future.memory = figures
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+            if recycle:
+                process.join()
+                with self.lock:
+                    self.recycled[recycle] += 1
+                process = None
+        if process:
+            conn.send(None)
+            process.join()
+
+    def shutdown(self, cancel_futures=False):
+        if cancel_futures:
+            while True:
+                try:
+                    self.tasks.get_nowait()[0].cancel()
+                except queue.Empty:
+                    break
+        for _ in self.threads:
+            self.tasks.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        self.shutdown(cancel_futures=exc_type is not None)
+        return False
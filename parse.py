@@ -1,177 +1,326 @@
 #!/usr/bin/env python3
 """
 AFTIS PDF Parser - Extracts BCA e-statement transactions to JSON
-Usage: python parse.py <pdf_file_path>
+Usage: python parse.py [--stream [--format msgpack|json]] <pdf_file_path>
 """
 
+import os
 import sys
 import json
+import argparse
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from tabula import read_pdf
 import pandas as pd
 import numpy as np
 from datetime import datetime
+from transaction_batch import TransactionBatch, json_transaction, write_frame, msgpack
+from layouts import select_template
+from memory import JobMemory, memory_report_line
+import tracing
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+try:
+    import pyarrow  # noqa: F401
+    STRING_DTYPE = 'string[pyarrow]'
+except ImportError:
+    STRING_DTYPE = 'string'
+
+# Page-parallel extraction: each worker runs its own tabula JVM over a page range
+PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', str(min(4, os.cpu_count() or 1))))
+PARALLEL_MIN_PAGES = int(os.getenv('PARALLEL_MIN_PAGES', '20'))
+# Pages per chunk and transactions per batch in streaming mode (--stream / iter_parse_batches)
+STREAM_CHUNK_PAGES = int(os.getenv('STREAM_CHUNK_PAGES', '25'))
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', '500'))
+
+# BCA amount text such as "1,234,567.89 DB": sign, whole part, the two fraction digits, DB/CR
+AMOUNT_PATTERN = r'(-)?([\d,]+)(?:\.(\d)(\d)?\d*)?\s*(DB|CR)?'
+
+
+def cents_from_parts(parts):
+    """Int64 cents from the sign/whole/fraction digit groups of AMOUNT_PATTERN"""
+    # Integer arithmetic on float64 is exact below 2**53 cents, far above any balance
+    whole = pd.to_numeric(parts[1].str.replace(',', '', regex=False), errors='coerce').to_numpy(dtype='float64')
+    tens = pd.to_numeric(parts[2]).fillna(0).to_numpy(dtype='float64')
+    units = pd.to_numeric(parts[3]).fillna(0).to_numpy(dtype='float64')
+    cents = whole * 100 + tens * 10 + units
+    cents = np.where(parts[0].isna().to_numpy(), cents, -cents)
+    return pd.Series(pd.array(cents, dtype='Int64'), index=parts.index)
+
+
+def extract_amounts(values):
+    """AMOUNT_PATTERN groups of the non-empty cells, reindexed to every row"""
+    return values[values.notna()].str.extract(AMOUNT_PATTERN).reindex(values.index)
 
 
 def clean_numeric_columns(dataframe, columns):
+    """Parse amount strings into exact Int64 cents; columns already in cents are kept"""
     for column in columns:
-        dataframe[column] = dataframe[column].str.replace(',', '')
-        dataframe[column] = pd.to_numeric(dataframe[column], errors='coerce')
-        dataframe[column] = dataframe[column].astype('float')
+        if not pd.api.types.is_integer_dtype(dataframe[column]):
+            dataframe[column] = cents_from_parts(extract_amounts(dataframe[column]))
     return dataframe
 
 
 def union_source(dataframes):
-    dfs = []
-    for temp_df in dataframes:
-        # Split DB/CR and amount into separate columns
-        temp_df[['amount', 'type']] = temp_df[4].str.extract(r'([\d,]+(?:\.\d+)?)\s*(DB|CR)?')
-        temp_df = temp_df.drop(temp_df.columns[4], axis=1)
-        
-        if len(temp_df.columns) == 7:
-            temp_df.columns = ['date', 'desc', 'detail', 'branch', 'balance', 'amount', 'type']
-            temp_df = temp_df[['date', 'desc', 'detail', 'branch', 'amount', 'type', 'balance']]
-            dfs.append(temp_df)
+    """Normalize the 6-column table pages into one frame with compact dtypes"""
+    # Cells of every transaction page copied once into a single object array
+    cells = np.concatenate([temp_df.to_numpy(dtype=object) for temp_df in dataframes if len(temp_df.columns) == 6])
     
-    df = pd.concat(dfs, ignore_index=True)
-    return df.fillna(value=np.nan)
+    # Amount in cents and DB/CR from one pass over the whole mutasi column
+    parts = extract_amounts(pd.Series(cells[:, 4], dtype=object))
+    
+    # Repetitive columns (dates, keywords, branch codes, DB/CR) as categoricals,
+    # free text as Arrow-backed strings when pyarrow is installed
+    return pd.DataFrame({
+        'date': pd.Categorical(cells[:, 0]),
+        'desc': pd.Categorical(cells[:, 1]),
+        'detail': pd.array(cells[:, 2], dtype=STRING_DTYPE),
+        'branch': pd.Categorical(cells[:, 3]),
+        'amount': cents_from_parts(parts).array,
+        'type': pd.Categorical(parts[4]),
+        # Converted to cents right away by clean_numeric_columns
+        'balance': pd.Series(cells[:, 5], dtype=object),
+    })
 
 
-def extract_transactions(dataframe):
-    transactions = []
+def cents_or_none(value):
+    return None if pd.isna(value) else int(value)
+
+
+def build_transaction(temp, descs, details):
+    return {
+        "date": temp['date'],
+        "description": ' | '.join(descs) if descs else '',
+        "detail": ' | '.join(details) if details else '',
+        "branch": temp['branch'],
+        "amount": cents_or_none(temp['amount']),
+        "transaction_type": temp['transaction_type'] if temp['transaction_type'] == 'DB' else 'CR',
+        "balance": cents_or_none(temp['balance'])
+    }
+
+
+def iter_extract_transactions(dataframes):
+    """Yield transactions from consecutive row chunks, stitching rows across chunk boundaries"""
     details = []
     descs = []
     temp = {}
+    prev_amount = np.nan
     
-    # Add shifted columns for comparison
-    dataframe['prev_amount'] = dataframe['amount'].shift(1)
-    
-    for index, row in dataframe.iterrows():
-        # Skip certain types
-        if row['desc'] in ['DR KOREKSI BUNGA', 'BUNGA', 'SALDO AWAL']:
-            if row['desc'] in ['DR KOREKSI BUNGA', 'BUNGA'] and temp:
-                transaction = {
-                    "date": temp['date'],
-                    "description": ' | '.join(descs) if descs else '',
-                    "detail": ' | '.join(details) if details else '',
-                    "branch": temp['branch'],
-                    "amount": temp['amount'],
-                    "transaction_type": temp['transaction_type'] if temp['transaction_type'] == 'DB' else 'CR',
-                    "balance": temp['balance']
-                }
-                transactions.append(transaction)
-                break
-            continue
-        
-        # New transaction detected
-        if (not pd.isna(row['amount'])) and ((pd.isna(row['prev_amount'])) or row['amount'] != row['prev_amount']):
-            # Save previous transaction
-            if temp:
-                transaction = {
-                    "date": temp['date'],
-                    "description": ' | '.join(descs) if descs else '',
-                    "detail": ' | '.join(details) if details else '',
-                    "branch": temp['branch'],
-                    "amount": temp['amount'],
-                    "transaction_type": temp['transaction_type'] if temp['transaction_type'] == 'DB' else 'CR',
-                    "balance": temp['balance']
+    for dataframe in dataframes:
+        for index, row in dataframe.iterrows():
+            # Previous row's amount, carried over from the last chunk for its first row
+            row_prev_amount, prev_amount = prev_amount, row['amount']
+            
+            # Skip certain types
+            if row['desc'] in ['DR KOREKSI BUNGA', 'BUNGA', 'SALDO AWAL']:
+                if row['desc'] in ['DR KOREKSI BUNGA', 'BUNGA'] and temp:
+                    yield build_transaction(temp, descs, details)
+                    return
+                continue
+            
+            # New transaction detected
+            if (not pd.isna(row['amount'])) and ((pd.isna(row_prev_amount)) or row['amount'] != row_prev_amount):
+                # Save previous transaction
+                if temp:
+                    yield build_transaction(temp, descs, details)
+                    details = []
+                    descs = []
+                    temp = {}
+                
+                temp = {
+                    'date': row['date'],
+                    'branch': row['branch'],
+                    'amount': row['amount'],
+                    'transaction_type': row['type'],
+                    'balance': row['balance']
                 }
-                transactions.append(transaction)
-                details = []
-                descs = []
-                temp = {}
             
-            temp = {
-                'date': row['date'],
-                'branch': row['branch'],
-                'amount': row['amount'],
-                'transaction_type': row['type'],
-                'balance': row['balance']
-            }
-        
-        # Collect descriptions and details
-        if not pd.isna(row['desc']):
-            descs.append(row['desc'])
-        if not pd.isna(row['detail']):
-            details.append(row['detail'])
-    
-    return transactions
+            # Collect descriptions and details
+            if not pd.isna(row['desc']):
+                descs.append(row['desc'])
+            if not pd.isna(row['detail']):
+                details.append(row['detail'])
 
 
-def parse_pdf(pdf_path):
+def extract_transactions(dataframe):
+    return list(iter_extract_transactions([dataframe]))
+
+
+def count_pages(pdf_path):
+    """Cheap page count from the PDF page tree, None if pypdf is unavailable"""
+    if PdfReader is None:
+        return None
     try:
-        # Extract header information
-        header_df = read_pdf(
-            pdf_path, 
-            area=(70, 315, 141, 548), 
-            pages='1', 
-            pandas_options={'header': None, 'dtype': str}, 
-            force_subprocess=True
-        )[0]
-        
-        periode = header_df.loc[header_df[0] == 'PERIODE', 2].values[0]
-        periode = ' '.join(reversed(periode.split()))
-        account_number = header_df.loc[header_df[0] == 'NO. REKENING', 2].values[0]
-        
-        # Extract transaction tables
-        dataframes = read_pdf(
+        return len(PdfReader(pdf_path).pages)
+    except Exception:
+        return None
+
+
+def page_ranges(page_count, parts):
+    """Split pages 1..page_count into at most `parts` contiguous tabula ranges"""
+    parts = max(1, min(parts, page_count))
+    size, extra = divmod(page_count, parts)
+    ranges = []
+    start = 1
+    for index in range(parts):
+        end = start + size - 1 + (1 if index < extra else 0)
+        ranges.append(f"{start}-{end}")
+        start = end + 1
+    return ranges
+
+
+def read_table_pages(pdf_path, pages, template):
+    with tracing.span('tabula_tables', pages=pages):
+        return read_pdf(
             pdf_path,
-            area=(231, 25, 797, 577),
-            columns=[86, 184, 300, 340, 467],
-            pages='all',
+            area=template['table_area'],
+            columns=template['table_columns'],
+            pages=pages,
             pandas_options={'header': None, 'dtype': str},
             force_subprocess=True
         )
-        
-        # Process data
-        df = union_source(dataframes)
-        df = clean_numeric_columns(df, ['amount', 'balance'])
-        
-        transactions = extract_transactions(df)
-        
-        # Add metadata to each transaction
-        for transaction in transactions:
-            transaction['account_number'] = account_number
-            transaction['period'] = periode
-            
-            # Handle NaN values by converting them to None
-            for key, value in transaction.items():
-                if pd.isna(value) or (isinstance(value, float) and np.isnan(value)):
-                    transaction[key] = None
+
+
+def iter_table_frames(pdf_path, template, workers=None, chunk_pages=None):
+    """Yield per-page table frames chunk by chunk, in page order
+
+    Large PDFs are split into page ranges extracted by up to `workers` tabula
+    JVMs at a time; at most `workers` ranges are held ahead of the consumer.
+    """
+    workers = PARSE_WORKERS if workers is None else workers
+    page_count = count_pages(pdf_path) if workers > 1 or chunk_pages else None
+
+    if not page_count or page_count < PARALLEL_MIN_PAGES:
+        yield read_table_pages(pdf_path, 'all', template)
+        return
+
+    if chunk_pages:
+        ranges = page_ranges(page_count, -(-page_count // chunk_pages))
+    else:
+        ranges = page_ranges(page_count, workers)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        pending = deque()
+        for pages in ranges:
+            # Worker threads run in a copy of the caller's context so their spans keep its trace
+            pending.append(executor.submit(contextvars.copy_context().run, read_table_pages, pdf_path, pages, template))
+            if len(pending) > max(1, workers):
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def extract_table_frames(pdf_path, template, workers=None):
+    """Extract per-page table frames, in page order, splitting large PDFs across workers"""
+    # Frames are merged in page order before union_source/extract_transactions, so
+    # transactions continuing across a page or range boundary are stitched exactly
+    # as in the single 'all' call
+    dataframes = []
+    for frames in iter_table_frames(pdf_path, template, workers):
+        dataframes.extend(frames)
+    return dataframes
+
+
+def read_header(pdf_path, template):
+    """Read account number and period (e.g. '2024 DESEMBER') from page 1"""
+    header_df = read_pdf(
+        pdf_path, 
+        area=template['header_area'], 
+        pages='1', 
+        pandas_options={'header': None, 'dtype': str}, 
+        force_subprocess=True
+    )[0]
+    
+    periode = header_df.loc[header_df[0] == 'PERIODE', 2].values[0]
+    periode = ' '.join(reversed(periode.split()))
+    account_number = header_df.loc[header_df[0] == 'NO. REKENING', 2].values[0]
+    return account_number, periode
+
+
+def finalize_transaction(transaction, account_number, periode):
+    """Add metadata and ISO date; return None for transactions without a valid date"""
+    transaction['account_number'] = account_number
+    transaction['period'] = periode
+    
+    # Handle NaN values by converting them to None
+    for key, value in transaction.items():
+        if pd.isna(value) or (isinstance(value, float) and np.isnan(value)):
+            transaction[key] = None
+    
+    # Convert date to ISO format if possible
+    try:
+        if transaction['date'] and not pd.isna(transaction['date']):
+            date_str = str(transaction['date']).strip()
+            # Extract year from period (format: "DEC 2024" or "2024 DEC")
+            period_parts = periode.split()
+            year = None
+            for part in period_parts:
+                if part.isdigit() and len(part) == 4:
+                    year = part
+                    break
             
-            # Convert date to ISO format if possible
-            try:
-                if transaction['date'] and not pd.isna(transaction['date']):
-                    date_str = str(transaction['date']).strip()
-                    # Extract year from period (format: "DEC 2024" or "2024 DEC")
-                    period_parts = periode.split()
-                    year = None
-                    for part in period_parts:
-                        if part.isdigit() and len(part) == 4:
-                            year = part
-                            break
-                    
-                    if year and '/' in date_str:
-                        # Handle DD/MM format by adding year
-                        if len(date_str.split('/')) == 2:
-                            date_str = f"{date_str}/{year}"
-                        
-                        # Parse DD/MM/YYYY format
-                        date_obj = datetime.strptime(date_str, '%d/%m/%Y')
-                        transaction['date'] = date_obj.strftime('%Y-%m-%d')
-                    else:
-                        # If we can't extract year or parse date, keep original
-                        pass
-            except Exception as e:
-                # Keep original date if parsing fails
+            if year and '/' in date_str:
+                # Handle DD/MM format by adding year
+                if len(date_str.split('/')) == 2:
+                    date_str = f"{date_str}/{year}"
+                
+                # Parse DD/MM/YYYY format
+                date_obj = datetime.strptime(date_str, '%d/%m/%Y')
+                transaction['date'] = date_obj.strftime('%Y-%m-%d')
+            else:
+                # If we can't extract year or parse date, keep original
                 pass
-        
-        # Filter out transactions with invalid dates (None or empty)
-        valid_transactions = []
-        for transaction in transactions:
-            if transaction.get('date') and transaction['date'] not in [None, '', 'None']:
-                valid_transactions.append(transaction)
-        
-        return valid_transactions
+    except Exception as e:
+        # Keep original date if parsing fails
+        pass
+    
+    # Filter out transactions with invalid dates (None or empty)
+    if transaction.get('date') and transaction['date'] not in [None, '', 'None']:
+        return transaction
+    return None
+
+
+def iter_parse_pdf(pdf_path, chunk_pages=None):
+    """Yield finished transactions as each chunk of pages is processed
+
+    Raises on unparseable input; parse_pdf() is the forgiving list version.
+    """
+    # Areas and columns come from the template matched by a page-1 fingerprint
+    with tracing.span('select_template') as template_span:
+        template = select_template(pdf_path)
+        template_span.set_attribute('template', template['name'])
+    with tracing.span('tabula_header'):
+        account_number, periode = read_header(pdf_path, template)
+    
+    def processed_chunks():
+        for dataframes in iter_table_frames(pdf_path, template, chunk_pages=chunk_pages):
+            # Chunks without transaction tables (e.g. a trailing summary page) are skipped
+            if not any(len(temp_df.columns) == 6 for temp_df in dataframes):
+                continue
+            with tracing.span('normalize_pages', pages=len(dataframes)):
+                df = clean_numeric_columns(union_source(dataframes), ['amount', 'balance'])
+            yield df
+    
+    for transaction in iter_extract_transactions(processed_chunks()):
+        transaction = finalize_transaction(transaction, account_number, periode)
+        if transaction:
+            yield transaction
+
+
+def iter_parse_batches(pdf_path, chunk_pages=None, batch_size=STREAM_BATCH_SIZE):
+    """Yield TransactionBatch objects of at most batch_size rows as pages are processed"""
+    return TransactionBatch.from_transactions(iter_parse_pdf(pdf_path, chunk_pages), batch_size)
+
+
+def parse_pdf(pdf_path):
+    """Parse a statement into transaction dicts with amounts in integer cents"""
+    try:
+        return list(iter_parse_pdf(pdf_path))
         
     except Exception as e:
         print(f"Error parsing PDF: {str(e)}", file=sys.stderr)
@@ -179,16 +328,51 @@ def parse_pdf(pdf_path):
 
 
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python parse.py <pdf_file_path>", file=sys.stderr)
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description='Extract BCA e-statement transactions')
+    parser.add_argument('pdf_path')
+    parser.add_argument('--stream', action='store_true',
+                        help='Write transaction batches to stdout as pages are parsed')
+    parser.add_argument('--format', choices=['msgpack', 'json'], default='msgpack',
+                        help='Stream format: length-prefixed msgpack frames or columnar JSON lines')
+    args = parser.parse_args()
+    
+    if args.stream:
+        if args.format == 'msgpack' and msgpack is None:
+            print("Error: msgpack is not installed, use --format json", file=sys.stderr)
+            sys.exit(1)
+        
+        # Stream mode fails loudly so callers can tell a bad statement from an empty one;
+        # the server passes its trace context in TRACEPARENT
+        failed = False
+        with tracing.span('parse_pdf', parent=os.getenv('TRACEPARENT'), file=os.path.basename(args.pdf_path)) as parse_span:
+            with JobMemory() as meter:
+                try:
+                    output = sys.stdout.buffer
+                    for batch in iter_parse_batches(args.pdf_path, chunk_pages=STREAM_CHUNK_PAGES):
+                        with tracing.span('write_batch', rows=len(batch)):
+                            if args.format == 'msgpack':
+                                write_frame(output, batch)
+                            else:
+                                output.write(json.dumps(batch.to_columns(), default=str).encode() + b'\n')
+                            output.flush()
+                except Exception as e:
+                    parse_span.record_error(e)
+                    print(f"Error parsing PDF: {str(e)}", file=sys.stderr)
+                    failed = True
+            for key, value in meter.figures.items():
+                parse_span.set_attribute(f"memory.{key}", value)
+        # The server reads this line for its per-job memory logs, metrics and budget
+        print(memory_report_line(meter.figures), file=sys.stderr)
+        if failed:
+            sys.exit(1)
+        return
     
-    pdf_path = sys.argv[1]
-    transactions = parse_pdf(pdf_path)
+    with tracing.span('parse_pdf', parent=os.getenv('TRACEPARENT'), file=os.path.basename(args.pdf_path)):
+        transactions = parse_pdf(args.pdf_path)
     
-    # Output JSON to stdout
-    print(json.dumps(transactions, indent=2, default=str))
+    # Output JSON to stdout, amounts in rupiah
+    print(json.dumps([json_transaction(txn) for txn in transactions], indent=2, default=str))
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
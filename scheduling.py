@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+AFTIS Inbox Scheduling
+Orders inbox files by estimated cost, their page count read cheaply from the
+PDF page tree, so a large statement does not hold up many one-page ones.
+Policies: fifo (arrival order), sjf (shortest job first, with aging so large
+files still progress) and lanes (one worker for small files, one for large
+files that also helps the small lane when idle).
+Files of several named inboxes share the workers by weighted fair queueing:
+each inbox is charged the pages it was given divided by its weight, and the
+inbox charged least goes next, so one inbox's bulk drop cannot starve others.
+"""
+
+import os
+import json
+import time
+import threading
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+POLICIES = ('fifo', 'sjf', 'lanes')
+LANES = ('small', 'large')
+# Rough size of one statement page, used when the page tree cannot be read
+ESTIMATED_BYTES_PER_PAGE = 30_000
+
+
+def estimate_pages(file_path):
+    """Page count from the PDF page tree, or a file size estimate without pypdf"""
+    if PdfReader is not None:
+        try:
+            return len(PdfReader(file_path).pages)
+        except Exception:
+            pass
+    try:
+        return max(1, round(os.path.getsize(file_path) / ESTIMATED_BYTES_PER_PAGE))
+    except OSError:
+        return 1
+
+
+class Inbox:
+    """A watched directory with its own failed directory, retry policy and share of the workers"""
+
+    def __init__(self, name, path, failed_path, weight=1.0, max_workers=0, max_retries=3,
+                 retry_max_backoff_seconds=30.0, auto_delete=True):
+        self.name = name
+        self.path = os.path.abspath(path)
+        self.failed_path = failed_path
+        self.weight = float(weight)
+        self.max_workers = int(max_workers)  # 0: no limit beyond the weighted share
+        # Attempts per file; 0 would never try it, leaving it in the inbox for good
+        self.max_retries = max(1, int(max_retries))
+        self.retry_max_backoff_seconds = float(retry_max_backoff_seconds)
+        self.auto_delete = auto_delete
+        if self.weight <= 0:
+            raise ValueError(f"Inbox {name!r}: weight must be positive")
+
+
+def load_inboxes(config_path, default):
+    """Inboxes listed in a JSON config file, or only `default` without one
+
+    Entries need name and path; other settings default to those of `default`,
+    with failed files going to a subdirectory of its failed directory per inbox.
+    """
+    if not config_path:
+        return [default]
+    with open(config_path) as f:
+        entries = json.load(f)
+    inboxes = []
+    for entry in entries:
+        settings = {
+            'failed_path': os.path.join(default.failed_path, entry['name']),
+            'weight': 1.0,
+            'max_workers': 0,
+            'max_retries': default.max_retries,
+            'retry_max_backoff_seconds': default.retry_max_backoff_seconds,
+            'auto_delete': default.auto_delete,
+        }
+        settings.update(entry)
+        inboxes.append(Inbox(**settings))
+    for key in ('name', 'path'):
+        values = [getattr(inbox, key) for inbox in inboxes]
+        if len(set(values)) != len(values):
+            raise ValueError(f"Inbox {key}s must be unique in {config_path}")
+    return inboxes
+
+
+def percentile(ordered, pct):
+    return ordered[max(0, -(-len(ordered) * pct // 100) - 1)] if ordered else None
+
+
+class ScheduledFile:
+    __slots__ = ('path', 'pages', 'lane', 'inbox', 'sequence', 'queued_at', 'started_at', 'context')
+
+    def __init__(self, path, pages, lane, inbox, sequence, queued_at, context):
+        self.path = path
+        self.pages = pages
+        self.lane = lane
+        self.inbox = inbox
+        self.sequence = sequence
+        self.queued_at = queued_at
+        self.started_at = None
+        self.context = context  # Caller data carried to the worker, e.g. the file's trace span
+
+
+class LaneStats:
+    """Queue depth, queue wait, service time and throughput of one lane or inbox"""
+
+    def __init__(self, started, window=1000):
+        self.window = window
+        self.started = started
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.pages = 0
+        self.waits = []
+        self.service_times = []
+        self.latencies = []  # Queued to done
+
+    def record(self, samples, value):
+        samples.append(value)
+        del samples[:-self.window]
+
+    def snapshot(self, now):
+        waits = sorted(self.waits)
+        service_times = sorted(self.service_times)
+        latencies = sorted(self.latencies)
+        minutes = max(now - self.started, 1e-9) / 60
+        return {
+            'queued': self.queued,
+            'running': self.running,
+            'completed': self.completed,
+            'failed': self.failed,
+            'pages': self.pages,
+            'files_per_minute': round(self.completed / minutes, 2),
+            'pages_per_minute': round(self.pages / minutes, 2),
+            'wait_p50_seconds': round(percentile(waits, 50), 3) if waits else None,
+            'wait_p95_seconds': round(percentile(waits, 95), 3) if waits else None,
+            'service_p50_seconds': round(percentile(service_times, 50), 3) if service_times else None,
+            'latency_p50_seconds': round(percentile(latencies, 50), 3) if latencies else None,
+            'latency_p95_seconds': round(percentile(latencies, 95), 3) if latencies else None,
+        }
+
+
+class InboxShare:
+    """Weight, worker limit and weighted fair queueing charge of one inbox"""
+
+    def __init__(self, weight, max_workers, stats):
+        self.weight = weight
+        self.max_workers = max_workers
+        self.stats = stats
+        self.virtual_pages = 0.0  # Pages given to the inbox divided by its weight
+
+
+class Scheduler:
+    """Thread-safe queue of inbox files handed to workers in policy order"""
+
+    def __init__(self, policy='sjf', large_pages=20, aging_pages_per_minute=10.0, clock=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown scheduling policy {policy!r}, expected one of {', '.join(POLICIES)}")
+        self.clock = clock or time.monotonic
+        self.policy = policy
+        self.large_pages = large_pages
+        self.aging_pages_per_minute = aging_pages_per_minute
+        self.condition = threading.Condition()
+        self.queue = []
+        self.paths = set()  # Queued or running, so a file is never scheduled twice
+        self.sequence = 0
+        self.lanes = {lane: LaneStats(self.clock()) for lane in LANES}
+        self.inboxes = {}
+        self.virtual_time = 0.0  # Charge of the inbox served last; idle inboxes resume from it
+
+    def add_inbox(self, name, weight=1.0, max_workers=0):
+        with self.condition:
+            self.inboxes[name] = InboxShare(weight, max_workers, LaneStats(self.clock()))
+
+    def inbox_share(self, name):
+        if name not in self.inboxes:
+            self.inboxes[name] = InboxShare(1.0, 0, LaneStats(self.clock()))
+        return self.inboxes[name]
+
+    def __contains__(self, path):
+        with self.condition:
+            return path in self.paths
+
+    def lane_of(self, pages):
+        return 'large' if pages >= self.large_pages else 'small'
+
+    def worker_lanes(self, count):
+        """Lanes each of `count` workers takes from, in preference order"""
+        if self.policy != 'lanes':
+            return [LANES] * count
+        if count <= 1:
+            # A single worker serves both lanes; never start more threads than configured
+            return [('large', 'small')] * count
+        # The large-lane worker helps with small files rather than idling
+        return [('small',)] * (count - 1) + [('large', 'small')]
+
+    def submit(self, path, pages, context=None, inbox='default'):
+        """Queue a file; returns False if it is already queued or running"""
+        with self.condition:
+            if path in self.paths:
+                return False
+            share = self.inbox_share(inbox)
+            if not share.stats.queued and not share.stats.running:
+                # An inbox that was idle gets no credit for it, or it would starve the busy ones
+                share.virtual_pages = max(share.virtual_pages, self.virtual_time)
+            self.sequence += 1
+            item = ScheduledFile(path, pages, self.lane_of(pages), inbox, self.sequence, self.clock(), context)
+            self.queue.append(item)
+            self.paths.add(path)
+            self.lanes[item.lane].queued += 1
+            share.stats.queued += 1
+            self.condition.notify_all()
+            return True
+
+    def cost(self, item, now):
+        """Estimated pages, lowered the longer the file has waited"""
+        return item.pages - self.aging_pages_per_minute * (now - item.queued_at) / 60
+
+    def pick(self, lanes):
+        candidates = [
+            item for item in self.queue
+            if item.lane in lanes and not (
+                self.inboxes[item.inbox].max_workers
+                and self.inboxes[item.inbox].stats.running >= self.inboxes[item.inbox].max_workers
+            )
+        ]
+        if not candidates:
+            return None
+        # Weighted fair queueing across inboxes, then the policy within the chosen one
+        inbox = min(candidates, key=lambda item: (self.inboxes[item.inbox].virtual_pages, item.sequence)).inbox
+        candidates = [item for item in candidates if item.inbox == inbox]
+        if self.policy == 'sjf':
+            now = self.clock()
+            return min(candidates, key=lambda item: (self.cost(item, now), item.sequence))
+        if self.policy == 'lanes':
+            # First lane with work, arrival order within it
+            for lane in lanes:
+                in_lane = [item for item in candidates if item.lane == lane]
+                if in_lane:
+                    return min(in_lane, key=lambda item: item.sequence)
+        return min(candidates, key=lambda item: item.sequence)
+
+    def take(self, lanes=LANES, timeout=None):
+        """Block until a file of one of `lanes` is queued and return it, None on timeout"""
+        with self.condition:
+            item = self.pick(lanes)
+            while item is None:
+                if not self.condition.wait(timeout) and timeout is not None:
+                    return None
+                item = self.pick(lanes)
+            self.queue.remove(item)
+            item.started_at = self.clock()
+            share = self.inboxes[item.inbox]
+            self.virtual_time = share.virtual_pages
+            share.virtual_pages += max(1, item.pages) / share.weight
+            for stats in (self.lanes[item.lane], share.stats):
+                stats.queued -= 1
+                stats.running += 1
+                stats.record(stats.waits, item.started_at - item.queued_at)
+            return item
+
+    def done(self, item, succeeded=True):
+        with self.condition:
+            self.paths.discard(item.path)
+            now = self.clock()
+            for stats in (self.lanes[item.lane], self.inboxes[item.inbox].stats):
+                stats.running -= 1
+                stats.completed += 1
+                stats.pages += item.pages
+                stats.failed += 0 if succeeded else 1
+                stats.record(stats.service_times, now - item.started_at)
+                stats.record(stats.latencies, now - item.queued_at)
+            # A worker may now take a file of an inbox that was at its worker limit
+            self.condition.notify_all()
+
+    def snapshot(self):
+        with self.condition:
+            now = self.clock()
+            return {
+                'policy': self.policy,
+                'lanes': {lane: stats.snapshot(now) for lane, stats in self.lanes.items()},
+                'inboxes': {
+                    name: dict(share.stats.snapshot(now), weight=share.weight)
+                    for name, share in self.inboxes.items()
+                },
+            }
+
+    def summary(self):
+        """One log line of per-lane queue metrics"""
+        parts = []
+        for lane, stats in self.snapshot()['lanes'].items():
+            wait = (f", wait p50 {stats['wait_p50_seconds']:.1f}s p95 {stats['wait_p95_seconds']:.1f}s"
+                    if stats['wait_p50_seconds'] is not None else '')
+            parts.append(f"{lane} {stats['queued']} queued/{stats['running']} running/{stats['completed']} done{wait}")
+        return f"{self.policy}: " + '; '.join(parts)
+
+    def inbox_summaries(self):
+        """One log line per inbox: queue, failures, throughput and queued-to-done latency"""
+        lines = []
+        for name, stats in self.snapshot()['inboxes'].items():
+            latency = (f", latency p50 {stats['latency_p50_seconds']:.1f}s p95 {stats['latency_p95_seconds']:.1f}s"
+                       if stats['latency_p50_seconds'] is not None else '')
+            lines.append(f"{name} (weight {stats['weight']:g}): {stats['queued']} queued/{stats['running']} running/"
+                         f"{stats['completed']} done, {stats['failed']} failed, "
+                         f"{stats['files_per_minute']:.1f} files/min{latency}")
+        return lines
@@ -12,6 +12,7 @@ CREATE TABLE transactions (
     balance DECIMAL(15,2),
     account_number VARCHAR(20),
     period VARCHAR(20),
+    category TEXT,
     processed_at TIMESTAMP DEFAULT NOW(),
     created_at TIMESTAMP DEFAULT NOW()
 );
@@ -21,6 +22,46 @@ CREATE INDEX idx_transactions_date ON transactions(date);
 CREATE INDEX idx_transactions_account ON transactions(account_number);
 CREATE INDEX idx_transactions_period ON transactions(period);
 CREATE INDEX idx_transactions_created_at ON transactions(created_at);
+CREATE INDEX idx_transactions_category ON transactions(category);
+
+-- Categorization rules the stored categories were computed with; reloading the
+-- rules file recategorizes only rows matching a pattern that changed since
+CREATE TABLE category_rules (
+    pattern TEXT PRIMARY KEY,
+    category TEXT NOT NULL
+);
+
+-- End-of-day balance per account, maintained by the ingest path for the dates each
+-- statement touches; balance-at-date and balance-over-time queries are primary key lookups
+CREATE TABLE daily_balances (
+    account_number VARCHAR(20) NOT NULL,
+    date DATE NOT NULL,
+    balance DECIMAL(15,2) NOT NULL,
+    updated_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (account_number, date)
+);
+
+-- Statements loaded by backfill.py, by content hash; written in the same transaction
+-- as their rows, so an interrupted backfill resumes after the last committed file
+CREATE TABLE statement_files (
+    sha256 CHAR(64) PRIMARY KEY,
+    path TEXT,
+    account_number VARCHAR(20),
+    period VARCHAR(20),
+    rows INTEGER NOT NULL,
+    loaded_at TIMESTAMP DEFAULT NOW()
+);
+
+-- One entry per committed statement, numbered in commit order: the rows it inserted as
+-- [first, last, ...] id ranges. GET /changes and /changes/stream serve entries after a cursor
+CREATE TABLE transaction_changes (
+    seq BIGSERIAL PRIMARY KEY,
+    account_number VARCHAR(20),
+    period VARCHAR(20),
+    rows INTEGER NOT NULL,
+    id_ranges BIGINT[] NOT NULL,
+    committed_at TIMESTAMP DEFAULT NOW()
+);
 
 -- Create a view for monthly summaries
 CREATE VIEW monthly_summary AS
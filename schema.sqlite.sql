@@ -0,0 +1,76 @@
+-- AFTIS Transactions Table
+-- SQLite schema for single-node deployments (STORAGE_BACKEND=sqlite), equivalent to schema.sql.
+-- Amounts and balances are integer cents, declared CENTS; the server reads them back as decimals.
+
+-- AUTOINCREMENT: ids are never reused, like a PostgreSQL SERIAL, so change feed id ranges stay valid
+CREATE TABLE transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date DATE NOT NULL,
+    description TEXT,
+    detail TEXT,
+    branch TEXT,
+    amount CENTS NOT NULL,
+    transaction_type VARCHAR(2) CHECK (transaction_type IN ('DB', 'CR')),
+    balance CENTS,
+    account_number VARCHAR(20),
+    period VARCHAR(20),
+    category TEXT,
+    processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Create indexes for common queries
+CREATE INDEX idx_transactions_date ON transactions(date);
+CREATE INDEX idx_transactions_account ON transactions(account_number);
+CREATE INDEX idx_transactions_period ON transactions(period);
+CREATE INDEX idx_transactions_created_at ON transactions(created_at);
+CREATE INDEX idx_transactions_category ON transactions(category);
+
+-- Categorization rules the stored categories were computed with
+CREATE TABLE category_rules (
+    pattern TEXT PRIMARY KEY,
+    category TEXT NOT NULL
+);
+
+-- End-of-day balance per account, maintained by the ingest path
+CREATE TABLE daily_balances (
+    account_number VARCHAR(20) NOT NULL,
+    date DATE NOT NULL,
+    balance CENTS NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (account_number, date)
+) WITHOUT ROWID;
+
+-- Statements loaded by backfill.py, by content hash
+CREATE TABLE statement_files (
+    sha256 CHAR(64) PRIMARY KEY,
+    path TEXT,
+    account_number VARCHAR(20),
+    period VARCHAR(20),
+    rows INTEGER NOT NULL,
+    loaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Change feed entries; id_ranges is a JSON array [first, last, ...]
+CREATE TABLE transaction_changes (
+    seq INTEGER PRIMARY KEY,
+    account_number VARCHAR(20),
+    period VARCHAR(20),
+    rows INTEGER NOT NULL,
+    id_ranges TEXT NOT NULL,
+    committed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Create a view for monthly summaries, amounts as decimal text (NULL like NUMERIC when there is no balance)
+CREATE VIEW monthly_summary AS
+SELECT
+    account_number,
+    period,
+    COUNT(*) as transaction_count,
+    printf('%.2f', SUM(CASE WHEN transaction_type = 'DB' THEN amount ELSE 0 END) / 100.0) as total_debits,
+    printf('%.2f', SUM(CASE WHEN transaction_type = 'CR' THEN amount ELSE 0 END) / 100.0) as total_credits,
+    MIN(date) as period_start,
+    MAX(date) as period_end,
+    CASE WHEN MAX(balance) IS NOT NULL THEN printf('%.2f', MAX(balance) / 100.0) END as ending_balance
+FROM transactions
+GROUP BY account_number, period;
@@ -7,75 +7,816 @@ Provides REST API for PDF parsing with PostgreSQL integration
 import os
 import json
 import shutil
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import urlparse, parse_qs
+import hashlib
+import time
+import select
+import signal
+import socket
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
 import subprocess
 import sys
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import tempfile
 import logging
+from datetime import date, timedelta
+from collections import deque
+from contextlib import contextmanager
+from transaction_batch import TransactionBatch, read_frames, rupiah, msgpack
+from categorize import Categorizer, load_rules, changed_patterns, CATEGORY_RULES_PATH
+from layouts import file_sha256
+from scheduling import estimate_pages
+from memory import MemoryBudget, MemoryBudgetExceeded, split_memory_report, format_memory
+import storage
+import tracing
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+TMP_PATH = os.getenv('TMP_PATH', '/srv/aftis/tmp')
+PARSER_SCRIPT = os.getenv('PARSER_SCRIPT', '/srv/aftis/parse.py')
+DB_BATCH_SIZE = int(os.getenv('DB_BATCH_SIZE', '500'))
+# Parser → server transport: binary msgpack frames, or columnar JSON lines without msgpack
+PARSER_TRANSPORT = os.getenv('PARSER_TRANSPORT', 'msgpack' if msgpack else 'json')
+
+# Uploads are streamed to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Reloads changing more patterns than this rescan every row instead of filtering by pattern
+RECATEGORIZE_FILTER_MAX_PATTERNS = int(os.getenv('RECATEGORIZE_FILTER_MAX_PATTERNS', '200'))
+RECATEGORIZE_BATCH_SIZE = 5000
+
+# Longest date range served by /balance?from=&to=, one point per day per account
+MAX_BALANCE_RANGE_DAYS = int(os.getenv('MAX_BALANCE_RANGE_DAYS', '3660'))
+
+# Change feed: every ingest commit is logged in transaction_changes
+CHANGES_CHANNEL = storage.CHANGES_CHANNEL
+CHANGES_AFTER = """
+    SELECT seq, account_number, period, rows, id_ranges, committed_at FROM transaction_changes
+    WHERE seq > %s ORDER BY seq LIMIT %s
+"""
+# Recent changes kept in memory for /changes consumers, in rows
+CHANGE_FEED_BUFFER_ROWS = int(os.getenv('CHANGE_FEED_BUFFER_ROWS', '50000'))
+CHANGE_FEED_MAX_WAIT_SECONDS = 60
+CHANGE_FEED_HEARTBEAT_SECONDS = 15
+
+
+# Error categories of /parse and /parse-and-store: HTTP status and whether retrying can help
+ERROR_CATEGORIES = {
+    'invalid_request': (400, False),
+    'file_not_found': (404, False),
+    'unparseable_pdf': (422, False),
+    'database_rejected': (422, False),
+    'parser_output': (500, False),
+    'processing_error': (500, False),
+    'parse_timeout': (504, False),
+    'memory_budget_exceeded': (413, False),
+    'parser_crashed': (503, True),
+    'parse_cancelled': (503, True),
+    'database_unavailable': (503, True),
+}
+RETRY_AFTER_SECONDS = int(os.getenv('RETRY_AFTER_SECONDS', '5'))
+# Unused request bodies up to this size are read and dropped; larger ones close the connection
+DISCARD_BODY_MAX_BYTES = 1024 * 1024
+# Per-job deadline; the parser and its tabula JVMs are killed when it expires
+PARSE_TIMEOUT = float(os.getenv('PARSE_TIMEOUT_SECONDS', '300'))
+# A job no request waits for any more is cancelled after this grace period, so a
+# client retrying right after its own timeout still attaches to the running job
+CANCEL_GRACE_SECONDS = float(os.getenv('CANCEL_GRACE_SECONDS', '15'))
+# How often a request waiting on a job checks whether its client went away
+DISCONNECT_POLL_SECONDS = 0.5
+# Idle keep-alive connections are closed after this many seconds
+KEEPALIVE_TIMEOUT = float(os.getenv('KEEPALIVE_TIMEOUT_SECONDS', '75'))
+
+
+class HTTPStats:
+    """Connection reuse and per-route latency of the HTTP server, served by /metrics"""
+    
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.window = window
+        self.started_at = time.time()
+        self.connections = 0
+        self.open_connections = 0
+        self.requests = 0
+        self.reused_requests = 0
+        self.latencies = {}
+    
+    def connection_opened(self):
+        with self.lock:
+            self.connections += 1
+            self.open_connections += 1
+    
+    def connection_closed(self):
+        with self.lock:
+            self.open_connections -= 1
+    
+    def request_done(self, route, seconds, reused):
+        with self.lock:
+            self.requests += 1
+            self.reused_requests += reused
+            samples = self.latencies.setdefault(route, [])
+            samples.append(seconds)
+            if len(samples) > self.window:
+                del samples[:len(samples) - self.window]
+    
+    def snapshot(self):
+        with self.lock:
+            routes = {}
+            for route, samples in self.latencies.items():
+                ordered = sorted(samples)
+                routes[route] = {
+                    'samples': len(ordered),
+                    'p50_ms': round(ordered[(len(ordered) - 1) // 2] * 1000, 2),
+                    'p95_ms': round(ordered[max(0, -(-len(ordered) * 95 // 100) - 1)] * 1000, 2),
+                    'max_ms': round(ordered[-1] * 1000, 2),
+                }
+            return {
+                'uptime_seconds': round(time.time() - self.started_at, 1),
+                'connections': self.connections,
+                'open_connections': self.open_connections,
+                'requests': self.requests,
+                'requests_per_connection': round(self.requests / self.connections, 2) if self.connections else None,
+                'connection_reuse_rate': round(self.reused_requests / self.requests, 4) if self.requests else None,
+                'latency': routes,
+            }
+
+
+http_stats = HTTPStats()
+
+# Compiled categorization rules used at ingest, None when there is no rules file
+categorizer = None
+categories_lock = threading.Lock()
+
+
+class ParserError(Exception):
+    """Raised when the parser subprocess exits with an error"""
+    
+    def __init__(self, message, returncode=None):
+        super().__init__(message)
+        self.returncode = returncode
+
+
+class JobAborted(Exception):
+    """Raised for a job stopped by its deadline ('timeout') or abandoned by every client ('cancelled')"""
+    
+    def __init__(self, reason):
+        super().__init__(f"Parse job {'exceeded its deadline' if reason == 'timeout' else 'was cancelled'}")
+        self.reason = reason
+
+
+def kill_process_group(process):
+    """Kill a parser started in its own session together with its tabula JVMs"""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+class ParseJob:
+    """One parse of one PDF content, shared by every request asking for it while it runs"""
+    
+    def __init__(self, key):
+        self.key = key
+        self.waiters = 0
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.aborted = None
+        self.process = None
+        self.memory = None  # Figures the parser reported for itself, see memory.JobMemory
+        self.deadline = None
+        self.lock = threading.Lock()
+    
+    def start_deadline(self, seconds):
+        """Abort the job as 'timeout' after `seconds`; started once it is admitted to parse"""
+        with self.lock:
+            if self.deadline or self.aborted or self.done.is_set():
+                return
+            self.deadline = threading.Timer(seconds, self.abort, ('timeout',))
+            self.deadline.daemon = True
+            self.deadline.start()
+    
+    def stop_deadline(self):
+        with self.lock:
+            if self.deadline:
+                self.deadline.cancel()
+    
+    def attach_process(self, process):
+        with self.lock:
+            self.process = process
+            aborted = self.aborted
+        if aborted:
+            kill_process_group(process)
+    
+    def abort(self, reason):
+        """Stop the job: kill its parser now, fail its next batch"""
+        with self.lock:
+            if self.aborted or self.done.is_set():
+                return
+            self.aborted = reason
+            process = self.process
+        logger.warning(f"Aborting parse job {self.key[:24]}: {reason}")
+        if process:
+            kill_process_group(process)
+    
+    def check(self):
+        if self.aborted:
+            raise JobAborted(self.aborted)
+
+
+class JobRegistry:
+    """In-flight parse jobs by route and content hash, so duplicate requests share one parse"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.counts = {'started': 0, 'deduplicated': 0, 'completed': 0, 'timed_out': 0, 'cancelled': 0}
+    
+    def submit(self, key, work):
+        """Join the running job for key, or run work(job) in a new thread; returns (job, attached)"""
+        with self.lock:
+            job = self.jobs.get(key)
+            if job:
+                job.waiters += 1
+                self.counts['deduplicated'] += 1
+                return job, True
+            job = self.jobs[key] = ParseJob(key)
+            job.waiters = 1
+            self.counts['started'] += 1
+        
+        thread = threading.Thread(target=self.run, args=(job, work, tracing.current_span.get()), daemon=True)
+        thread.start()
+        return job, False
+    
+    def run(self, job, work, parent):
+        # The PARSE_TIMEOUT deadline starts at memory admission (memory_budgeted): time spent
+        # waiting for the budget is bounded by the clients, whose departure cancels the job
+        try:
+            with tracing.span('parse_job', parent=parent):
+                job.result = work(job)
+        except Exception as e:
+            # Errors caused by killing the parser are reported as the abort itself
+            job.error = JobAborted(job.aborted) if job.aborted else e
+        finally:
+            job.stop_deadline()
+            with self.lock:
+                del self.jobs[job.key]
+                outcome = {'timeout': 'timed_out', 'cancelled': 'cancelled'}.get(job.aborted, 'completed')
+                self.counts[outcome] += 1
+            job.done.set()
+    
+    def release(self, job):
+        """A waiter leaves; a job left without waiters is cancelled after CANCEL_GRACE_SECONDS"""
+        with self.lock:
+            job.waiters -= 1
+            abandoned = job.waiters == 0 and not job.done.is_set()
+        if abandoned:
+            timer = threading.Timer(CANCEL_GRACE_SECONDS, self.cancel_if_abandoned, (job,))
+            timer.daemon = True
+            timer.start()
+    
+    def cancel_if_abandoned(self, job):
+        with self.lock:
+            if job.waiters == 0 and not job.done.is_set():
+                job.abort('cancelled')
+    
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts, in_flight=len(self.jobs), waiters=sum(job.waiters for job in self.jobs.values()))
+
+
+parse_jobs = JobRegistry()
+# Parse jobs start only while their estimated memory fits PARSE_MEMORY_BUDGET_MB
+memory_budget = MemoryBudget()
+
+
 def get_db_connection():
-    """Get PostgreSQL database connection"""
+    """Get a connection to the STORAGE_BACKEND database, None if unreachable"""
+    return storage.backend.connect()
+
+
+def upsert_daily_balances(cursor, batch):
+    """Record the end-of-day balances of the dates a batch touches"""
+    if batch.account_number is None:
+        return
+    storage.backend.upsert_daily_balances(cursor, [
+        (batch.account_number, day, cents) for day, cents in batch.daily_balances()
+    ])
+
+
+def insert_transaction_batches(batches):
+    """Bulk load TransactionBatch objects (COPY, or batched inserts on SQLite) inside one database transaction
+
+    Each batch is sent as soon as it arrives; nothing is committed until the
+    iterable is exhausted. daily_balances is updated in the same transaction
+    for the dates each batch touches. Returns the number of rows stored, or
+    None if the database is unreachable. Rows the database rejects and errors
+    raised by the iterable roll back and propagate.
+    """
+    # Not made current: time spent waiting on `batches` belongs to the producer's spans
+    insert_span = tracing.start_span('insert_transactions')
+    total = 0
     try:
-        conn = psycopg2.connect(
-            host=os.getenv('POSTGRES_HOST', 'postgres'),
-            port=os.getenv('POSTGRES_PORT', '5432'),
-            database=os.getenv('POSTGRES_DB', 'aftis'),
-            user=os.getenv('POSTGRES_USER', 'aftis_user'),
-            password=os.getenv('POSTGRES_PASSWORD', 'aftis_password')
-        )
-        return conn
-    except Exception as e:
-        logger.error(f"Database connection failed: {e}")
-        return None
+        with tracing.span('db_connect', parent=insert_span):
+            conn = get_db_connection()
+        if not conn:
+            insert_span.set_attribute('error.category', 'database_unavailable')
+            return None
+        
+        try:
+            cursor = conn.cursor()
+            first_id = storage.backend.first_possible_id(cursor)
+            account_number = period = None
+            
+            for batch in batches:
+                account_number, period = batch.account_number, batch.period
+                with tracing.span('copy_batch', parent=insert_span, rows=len(batch)):
+                    active_categorizer = categorizer
+                    if active_categorizer:
+                        active_categorizer.apply(batch)
+                    storage.backend.insert_batches(cursor, [batch])
+                    upsert_daily_balances(cursor, batch)
+                total += len(batch)
+            
+            with tracing.span('commit', parent=insert_span):
+                storage.backend.record_changes(cursor, first_id, [(account_number, period, total)])
+                conn.commit()
+            if not storage.backend.notifies:
+                change_feed.wake()
+            logger.info(f"Inserted {total} transactions into database")
+            return total
+            
+        except storage.UnavailableError as e:
+            logger.error(f"Database insert failed: {e}")
+            insert_span.record_error(e)
+            if not getattr(conn, 'closed', False):
+                conn.rollback()
+            return None
+        except Exception as e:
+            insert_span.record_error(e)
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+    finally:
+        insert_span.set_attribute('rows', total)
+        insert_span.end()
+
+
+def fetch_changes(cursor, after, limit):
+    """Change entries after seq `after` with their rows, as (seq, rows, JSON text) tuples"""
+    cursor.execute(storage.backend.sql(CHANGES_AFTER), (after, limit))
+    changes = cursor.fetchall()
+    if not changes:
+        return []
+    rows = storage.backend.change_rows(cursor, changes)
+    
+    # Serialized once, shared by every consumer
+    return [
+        (change['seq'], change['rows'], json.dumps({
+            'seq': change['seq'],
+            'account_number': change['account_number'],
+            'period': change['period'],
+            'rows': change['rows'],
+            'committed_at': change['committed_at'],
+            'transactions': rows.get(change['seq'], []),
+        }, default=str))
+        for change in changes
+    ]
+
+
+class ChangeFeed:
+    """Recently committed changes, loaded once per NOTIFY and shared by every /changes consumer
+
+    A background thread LISTENs on CHANGES_CHANNEL; on SQLite, which has no
+    NOTIFY, the ingest path wakes the feed after each commit instead. Consumers
+    whose cursor is within the buffer are served from memory; older cursors
+    read the database.
+    """
+    
+    def __init__(self, buffer_rows=CHANGE_FEED_BUFFER_ROWS):
+        self.buffer_rows = buffer_rows
+        self.condition = threading.Condition()
+        self.changes = deque()
+        self.buffered_rows = 0
+        self.buffered_after = None  # Every change after this seq is in the buffer
+        self.latest = None
+        self.listening = False
+        self.waiting = 0
+        self.counts = {'notifications': 0, 'served_from_buffer': 0, 'served_from_database': 0}
+        self.load_lock = threading.Lock()
+    
+    def start(self):
+        if storage.backend.notifies:
+            threading.Thread(target=self.listen, daemon=True).start()
+        elif self.wake():
+            with self.condition:
+                self.listening = True
+            logger.info(f"Change feed following {storage.backend.name} commits after change {self.latest}")
+    
+    def wake(self):
+        """Load changes committed by this process, for backends without NOTIFY; False if that failed"""
+        conn = get_db_connection()
+        if not conn:
+            return False
+        try:
+            with self.condition:
+                self.counts['notifications'] += 1
+            self.load(conn)
+            return True
+        except storage.Error as e:
+            logger.error(f"Change feed failed to load changes: {e}")
+            return False
+        finally:
+            conn.close()
+    
+    def listen(self):
+        while True:
+            conn = get_db_connection()
+            if not conn:
+                time.sleep(RETRY_AFTER_SECONDS)
+                continue
+            try:
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {CHANGES_CHANNEL}")
+                # Changes committed while not listening are loaded before waiting for new ones
+                self.load(conn)
+                with self.condition:
+                    self.listening = True
+                logger.info(f"Change feed listening on {CHANGES_CHANNEL} after change {self.latest}")
+                while True:
+                    if not select.select([conn], [], [], CHANGE_FEED_HEARTBEAT_SECONDS)[0]:
+                        conn.cursor().execute("SELECT 1")  # Notices a dropped connection
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        with self.condition:
+                            self.counts['notifications'] += len(conn.notifies)
+                        conn.notifies.clear()
+                        self.load(conn)
+            except storage.Error as e:
+                logger.error(f"Change feed listener failed, reconnecting: {e}")
+            finally:
+                with self.condition:
+                    self.listening = False
+                conn.close()
+            time.sleep(RETRY_AFTER_SECONDS)
+    
+    def load(self, conn):
+        """Append changes committed after the newest known one and wake waiting consumers"""
+        with self.load_lock:
+            self.load_locked(storage.backend.dict_cursor(conn))
+    
+    def load_locked(self, cursor):
+        if self.latest is None:
+            # The feed starts at the current end; history is read from the database on request
+            cursor.execute("SELECT COALESCE(MAX(seq), 0) AS seq FROM transaction_changes")
+            with self.condition:
+                self.latest = self.buffered_after = cursor.fetchone()['seq']
+            return
+        while True:
+            changes = fetch_changes(cursor, self.latest, 1000)
+            if not changes:
+                return
+            with self.condition:
+                for change in changes:
+                    self.changes.append(change)
+                    self.buffered_rows += change[1]
+                    self.latest = change[0]
+                while self.buffered_rows > self.buffer_rows and len(self.changes) > 1:
+                    evicted = self.changes.popleft()
+                    self.buffered_rows -= evicted[1]
+                    self.buffered_after = evicted[0]
+                self.condition.notify_all()
+    
+    def cursor(self):
+        """Seq of the newest committed change, where a consumer without a cursor starts"""
+        with self.condition:
+            if self.latest is not None:
+                return self.latest
+        conn = get_db_connection()
+        if not conn:
+            return None
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM transaction_changes")
+            return cursor.fetchone()[0]
+        finally:
+            conn.close()
+    
+    def changes_after(self, after, limit):
+        """Up to `limit` changes after seq `after`; None if the database is needed and unreachable"""
+        with self.condition:
+            if self.listening and after >= self.buffered_after:
+                self.counts['served_from_buffer'] += 1
+                return [change for change in self.changes if change[0] > after][:limit]
+            self.counts['served_from_database'] += 1
+        conn = get_db_connection()
+        if not conn:
+            return None
+        try:
+            return fetch_changes(storage.backend.dict_cursor(conn), after, limit)
+        finally:
+            conn.close()
+    
+    def wait(self, after, limit, timeout):
+        """Changes after seq `after`, waiting up to `timeout` seconds for one to be committed"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            self.waiting += 1
+            try:
+                while not (self.listening and self.latest > after):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+            finally:
+                self.waiting -= 1
+        return self.changes_after(after, limit)
+    
+    def snapshot(self):
+        with self.condition:
+            return dict(
+                self.counts,
+                listening=self.listening,
+                latest=self.latest,
+                buffered_changes=len(self.changes),
+                buffered_rows=self.buffered_rows,
+                waiting_consumers=self.waiting,
+            )
+
+
+change_feed = ChangeFeed()
+
+
+def reload_categories():
+    """Load the rules file and recategorize only the rows its changes can affect
+
+    A row's category depends only on the patterns occurring in its text, so
+    rows are examined only if they contain a pattern added, removed or moved
+    to another category since the rules in category_rules were applied.
+    Returns a summary dict, or None if the database is unreachable; the new
+    rules are used for ingest either way.
+    """
+    global categorizer
+    
+    with categories_lock:
+        rules = load_rules(CATEGORY_RULES_PATH)
+        new_categorizer = Categorizer(rules)
+        categorizer = new_categorizer
+        
+        conn = get_db_connection()
+        if not conn:
+            return None
+        
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pattern, category FROM category_rules")
+            applied = dict(cursor.fetchall())
+            changed = changed_patterns(applied, rules)
+            summary = {'rules': len(rules), 'changed_patterns': len(changed), 'examined': 0, 'recategorized': 0}
+            if not changed:
+                return summary
+            
+            if len(changed) > RECATEGORIZE_FILTER_MAX_PATTERNS:
+                condition, params = '1 = 1', []
+            else:
+                condition, params = storage.backend.contains_any(('description', 'detail'), changed)
+            # Pages by id rather than one server-side cursor, which SQLite cannot hold open across updates
+            query = storage.backend.sql(
+                "SELECT id, description, detail, category FROM transactions "
+                f"WHERE id > %s AND ({condition}) ORDER BY id LIMIT %s"
+            )
+            last_id = 0
+            
+            while True:
+                cursor.execute(query, [last_id] + params + [RECATEGORIZE_BATCH_SIZE])
+                chunk = cursor.fetchall()
+                if not chunk:
+                    break
+                last_id = chunk[-1][0]
+                categories = new_categorizer.categorize([row[1] for row in chunk], [row[2] for row in chunk])
+                updates = [(row[0], category) for row, category in zip(chunk, categories) if category != row[3]]
+                if updates:
+                    storage.backend.update_categories(cursor, updates)
+                summary['examined'] += len(chunk)
+                summary['recategorized'] += len(updates)
+            
+            condition, params = storage.backend.any_of('pattern', changed)
+            cursor.execute(storage.backend.sql(f"DELETE FROM category_rules WHERE {condition}"), params)
+            storage.backend.insert_values(
+                cursor,
+                "INSERT INTO category_rules (pattern, category) VALUES %s",
+                [(pattern, rules[pattern]) for pattern in changed if pattern in rules]
+            )
+            conn.commit()
+            logger.info(f"Categories reloaded: {summary}")
+            return summary
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
 
 def insert_transactions(transactions):
-    """Insert transactions into PostgreSQL database"""
+    """Insert transactions (dicts with cents amounts, or a TransactionBatch) into the database"""
     if not transactions:
         return False
     
-    conn = get_db_connection()
-    if not conn:
+    if isinstance(transactions, TransactionBatch):
+        batches = [transactions]
+    else:
+        batches = TransactionBatch.from_transactions(transactions, DB_BATCH_SIZE)
+    try:
+        return insert_transaction_batches(batches) is not None
+    except storage.Error as e:
+        logger.error(f"Database insert failed: {e}")
         return False
-    
+
+
+def stream_parser(pdf_path, parent=None, job=None):
+    """Run parse.py --stream and yield TransactionBatch objects as the parser emits them
+
+    Raises ParserError after the last batch if the parser exited with an error,
+    ValueError if the stream cannot be decoded. The subprocess is traced as a
+    child of `parent` and continues the trace through TRACEPARENT. It runs in
+    its own session, so aborting `job` kills it along with its tabula JVMs.
+    """
+    parser_span = tracing.start_span('parser', parent=parent, file=os.path.basename(pdf_path))
+    with tempfile.TemporaryFile(mode='w+') as stderr:
+        process = subprocess.Popen(
+            [sys.executable, PARSER_SCRIPT, '--stream', '--format', PARSER_TRANSPORT, pdf_path],
+            stdout=subprocess.PIPE, stderr=stderr, start_new_session=True,
+            env=dict(os.environ, TRACEPARENT=parser_span.traceparent)
+        )
+        if job:
+            job.attach_process(process)
+        try:
+            if PARSER_TRANSPORT == 'msgpack':
+                yield from read_frames(process.stdout)
+            else:
+                for line in process.stdout:
+                    if line.strip():
+                        yield TransactionBatch.from_columns(json.loads(line))
+            
+            returncode = process.wait()
+            stderr.seek(0)
+            figures, errors = split_memory_report(stderr.read())
+            if job and figures:
+                job.memory = figures
+            if returncode != 0:
+                raise ParserError(errors or f"exit status {returncode}", returncode)
+        except BaseException as e:
+            parser_span.record_error(e)
+            raise
+        finally:
+            process.stdout.close()
+            if process.poll() is None or process.returncode != 0:
+                # Stopped early or failed: no tabula JVM of this parser may outlive it
+                kill_process_group(process)
+                process.wait()
+            parser_span.set_attribute('returncode', process.returncode)
+            parser_span.end()
+
+
+def copy_to_tmp(pdf_path, sha256):
+    """Private copy of the PDF for one job; /parse and /parse-and-store of one file each get their own"""
+    fd, temp_path = tempfile.mkstemp(dir=TMP_PATH, prefix=f"{sha256[:16]}-",
+                                     suffix=f"-{os.path.basename(pdf_path)}")
+    os.close(fd)
+    with tracing.span('copy_to_tmp'):
+        try:
+            shutil.copy2(pdf_path, temp_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+    return temp_path
+
+
+@contextmanager
+def memory_budgeted(pdf_path, job):
+    """Hold a job's estimated memory while it parses, then log and learn from its measured figures
+
+    Waits while running jobs use the budget; raises MemoryBudgetExceeded for a
+    statement that would not fit even alone. The job's PARSE_TIMEOUT deadline
+    starts once it is admitted, so a queued job is never stopped as timed out.
+    """
+    filename = os.path.basename(pdf_path)
+    pages = estimate_pages(pdf_path)
+    estimate = memory_budget.estimate(pages)
+    with tracing.span('memory_admission', pages=pages, estimate_mb=round(estimate)):
+        try:
+            if not memory_budget.acquire(estimate, lambda: job.aborted):
+                job.check()
+        except MemoryBudgetExceeded:
+            logger.warning(f"Rejected {filename}: {pages} pages, estimated {estimate:.0f} MB")
+            raise
+    job.start_deadline(PARSE_TIMEOUT)
     try:
-        cursor = conn.cursor()
-        
-        insert_query = """
-            INSERT INTO transactions (date, description, detail, branch, amount, transaction_type, balance, account_number, period)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """
+        yield
+    finally:
+        memory_budget.release(estimate)
+        if job.memory:
+            memory_budget.observe(pages, job.memory)
+            logger.info(f"Parse memory of {filename} ({pages} pages, estimated {estimate:.0f} MB): "
+                        f"{format_memory(job.memory)}")
+
+
+def parse_job(pdf_path, sha256, job):
+    """Parse a PDF without storing it; returns the batches"""
+    with memory_budgeted(pdf_path, job):
+        temp_path = copy_to_tmp(pdf_path, sha256)
+        try:
+            # Batches stay columnar until the HTTP response needs dicts
+            return list(stream_parser(temp_path, job=job))
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+def parse_and_store_job(pdf_path, sha256, job):
+    """Parse and store a PDF page by page in one database transaction
+
+    Returns the number of transactions parsed, None if the database is unavailable.
+    """
+    with memory_budgeted(pdf_path, job):
+        temp_path = copy_to_tmp(pdf_path, sha256)
+        parsed = {'count': 0}
         
-        for txn in transactions:
-            cursor.execute(insert_query, (
-                txn.get('date'),
-                txn.get('description'),
-                txn.get('detail'),
-                txn.get('branch'),
-                txn.get('amount'),
-                txn.get('transaction_type'),
-                txn.get('balance'),
-                txn.get('account_number'),
-                txn.get('period')
-            ))
+        def counted(batches):
+            for batch in batches:
+                # An aborted job rolls back instead of committing what was parsed so far
+                job.check()
+                parsed['count'] += len(batch)
+                yield batch
         
-        conn.commit()
-        logger.info(f"Inserted {len(transactions)} transactions into database")
-        return True
+        transactions = stream_parser(temp_path, job=job)
+        try:
+            # Bounded batches, one database transaction
+            stored = insert_transaction_batches(counted(transactions))
+        finally:
+            # Stops the parser if storing ended early, then cleans up temp file
+            transactions.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
         
-    except Exception as e:
-        logger.error(f"Database insert failed: {e}")
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
+        return None if stored is None else parsed['count']
+
 
 class AFTISHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections open between requests; every response carries Content-Length
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT
+    # Headers and body go out as separate writes; without TCP_NODELAY a kept-alive
+    # connection waits on the peer's delayed ACK for every response
+    disable_nagle_algorithm = True
+    
+    def setup(self):
+        super().setup()
+        self.requests_on_connection = 0
+        http_stats.connection_opened()
+    
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            http_stats.connection_closed()
+    
+    def handle_one_request(self):
+        started = time.perf_counter()
+        self.path = None
+        super().handle_one_request()
+        if self.path is not None:
+            http_stats.request_done(urlparse(self.path).path, time.perf_counter() - started,
+                                    self.requests_on_connection > 0)
+            self.requests_on_connection += 1
+    
+    def send_response(self, code, message=None):
+        self.response_status = code
+        super().send_response(code, message)
+    
+    def traced(self, handler):
+        """Run a request handler as a server span continuing the client's traceparent"""
+        self.response_status = None
+        path = urlparse(self.path).path
+        with tracing.span(f"{self.command} {path}", parent=self.headers.get('traceparent'), kind='server') as server_span:
+            handler()
+            server_span.set_attribute('http.status_code', self.response_status)
+    
+    def send_json(self, body, status=200, headers=None):
+        """Send a JSON response with Content-Length so the connection can be kept alive"""
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
     
     def do_GET(self):
         """Handle GET requests for file scanning"""
@@ -85,26 +826,48 @@ class AFTISHandler(BaseHTTPRequestHandler):
             self.health_check()
         elif self.path == '/db-health':
             self.db_health_check()
+        elif self.path.startswith('/changes/stream'):
+            self.stream_changes()
+        elif self.path.startswith('/changes'):
+            self.get_changes()
         elif self.path.startswith('/transactions'):
             self.get_transactions()
+        elif self.path.startswith('/balance'):
+            self.get_balance()
+        elif self.path == '/metrics':
+            self.send_json(json.dumps(dict(
+                http_stats.snapshot(), jobs=parse_jobs.snapshot(), memory=memory_budget.snapshot(),
+                changes=change_feed.snapshot()
+            )))
         else:
             self.send_error(404)
     
     def do_POST(self):
         """Handle POST requests for PDF parsing"""
         print(f"POST request to {self.path}")
-        print(f"Headers: {dict(self.headers)}")
         if self.path == '/parse':
-            self.parse_pdf()
+            self.traced(self.parse_pdf)
         elif self.path == '/parse-and-store':
-            self.parse_and_store_pdf()
+            self.traced(self.parse_and_store_pdf)
         elif self.path == '/test':
+            self.discard_body()
             self.test_response()
+        elif self.path == '/categories/reload':
+            self.discard_body()
+            self.reload_categories()
+        else:
+            self.send_error(404)
+    
+    def do_PUT(self):
+        """Handle PUT requests for streamed uploads into the inbox"""
+        if self.path.startswith('/inbox/'):
+            self.traced(self.upload_inbox_file)
         else:
             self.send_error(404)
     
     def do_DELETE(self):
         """Handle DELETE requests"""
+        self.discard_body()
         if self.path.startswith('/inbox/'):
             self.delete_inbox_file()
         elif self.path == '/inbox':
@@ -112,16 +875,113 @@ class AFTISHandler(BaseHTTPRequestHandler):
         else:
             self.send_error(404)
     
+    def discard_body(self):
+        """Consume a body the endpoint does not use, so it is not read as the next kept-alive request"""
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = None
+        if length is None or self.headers.get('Transfer-Encoding') or length > DISCARD_BODY_MAX_BYTES:
+            # Not worth reading: answer, then close the connection instead
+            self.close_connection = True
+            return
+        while length > 0:
+            chunk = self.rfile.read(min(length, 64 * 1024))
+            if not chunk:
+                self.close_connection = True
+                return
+            length -= len(chunk)
+    
+    def send_json_error(self, category, message):
+        """Send a structured error: category, message and whether the client should retry"""
+        status, retryable = ERROR_CATEGORIES[category]
+        response_json = json.dumps({
+            'success': False,
+            'error': {'category': category, 'message': message, 'retryable': retryable}
+        })
+        self.send_json(response_json, status, {'Retry-After': str(RETRY_AFTER_SECONDS)} if retryable else None)
+    
+    def send_processing_error(self, error):
+        """Classify an exception raised while parsing or storing a PDF"""
+        if isinstance(error, MemoryBudgetExceeded):
+            self.send_json_error('memory_budget_exceeded', str(error))
+        elif isinstance(error, JobAborted):
+            if error.reason == 'timeout':
+                self.send_json_error('parse_timeout', f'Parse exceeded the {PARSE_TIMEOUT:g}s deadline and was stopped')
+            else:
+                self.send_json_error('parse_cancelled', 'Parse was cancelled, no client was waiting for it')
+        elif isinstance(error, ParserError):
+            # A parser killed by a signal (e.g. out of memory) may succeed later; a nonzero exit will not
+            crashed = error.returncode is not None and error.returncode < 0
+            self.send_json_error('parser_crashed' if crashed else 'unparseable_pdf', f'Parser error: {str(error)}')
+        elif isinstance(error, FileNotFoundError):
+            self.send_json_error('file_not_found', f'File not found: {error.filename}')
+        elif isinstance(error, storage.Error):
+            self.send_json_error('database_rejected', f'Database error: {str(error)}')
+        elif isinstance(error, ValueError):
+            self.send_json_error('parser_output', f'Parser output error: {str(error)}')
+        else:
+            self.send_json_error('processing_error', f'Processing error: {str(error)}')
+    
+    def read_pdf_path(self):
+        """Read pdf_path from the JSON request body; sends the error and returns None if invalid"""
+        try:
+            content_length = int(self.headers['Content-Length'])
+            data = json.loads(self.rfile.read(content_length).decode())
+            pdf_path = data.get('pdf_path')
+        except (TypeError, ValueError, AttributeError):
+            self.send_json_error('invalid_request', 'JSON body with pdf_path required')
+            return None
+        
+        if not pdf_path:
+            self.send_json_error('invalid_request', 'pdf_path required')
+            return None
+        return pdf_path
+    
+    def client_disconnected(self):
+        """True once the client closed its connection; a pipelined next request does not count"""
+        try:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            return bool(readable) and self.connection.recv(1, socket.MSG_PEEK) == b''
+        except OSError:
+            return True
+    
+    def run_parse_job(self, route, work):
+        """Start or join the job parsing this request's PDF and wait for it
+
+        Returns the finished job, or None if a response was already sent or
+        the client went away; work left without any client is cancelled.
+        """
+        pdf_path = self.read_pdf_path()
+        if not pdf_path:
+            return None
+        
+        with tracing.span('hash_pdf'):
+            sha256 = file_sha256(pdf_path)
+        job, attached = parse_jobs.submit(f"{route}:{sha256}", lambda job: work(pdf_path, sha256, job))
+        server_span = tracing.current_span.get()
+        if server_span:
+            server_span.set_attribute('job.attached', attached)
+        if attached:
+            logger.info(f"Attached to the running {route} job for {os.path.basename(pdf_path)}")
+        
+        try:
+            while not job.done.wait(DISCONNECT_POLL_SECONDS):
+                if self.client_disconnected():
+                    logger.info(f"Client disconnected while waiting for {os.path.basename(pdf_path)}")
+                    self.close_connection = True
+                    return None
+        finally:
+            parse_jobs.release(job)
+        return job
+    
     def test_response(self):
         """Simple test endpoint"""
         try:
             test_data = {'message': 'hello', 'count': 123}
             response_json = json.dumps(test_data)
             
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(response_json.encode())
+            self.send_json(response_json)
         except Exception as e:
             self.send_error(500, str(e))
     
@@ -136,10 +996,7 @@ class AFTISHandler(BaseHTTPRequestHandler):
                     if filename.lower().endswith('.pdf'):
                         pdf_files.append(os.path.join(inbox_path, filename))
             
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'files': pdf_files}).encode())
+            self.send_json(json.dumps({'files': pdf_files}))
             
         except Exception as e:
             self.send_error(500, str(e))
@@ -147,76 +1004,53 @@ class AFTISHandler(BaseHTTPRequestHandler):
     def parse_pdf(self):
         """Parse a PDF file"""
         try:
-            # Get content length
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode())
-            
-            pdf_path = data.get('pdf_path')
-            if not pdf_path:
-                self.send_error(400, 'pdf_path required')
+            job = self.run_parse_job('parse', parse_job)
+            if not job:
                 return
+            if job.error:
+                self.send_processing_error(job.error)
+                return
+            batches = job.result
             
-            # Copy to temp directory
-            temp_path = f"/srv/aftis/tmp/{os.path.basename(pdf_path)}"
-            shutil.copy2(pdf_path, temp_path)
-            
-            # Run parser
-            result = subprocess.run([
-                'python3', '/srv/aftis/parse.py', temp_path
-            ], capture_output=True, text=True)
-            
-            # Clean up temp file
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-            
-            if result.returncode == 0:
-                try:
-                    transactions = json.loads(result.stdout)
-                    
-                    # Create minimal, clean response
-                    clean_transactions = []
-                    for i, txn in enumerate(transactions[:3]):  # Only first 3 for testing
-                        clean_txn = {
-                            'id': i + 1,
-                            'date': str(txn.get('date', '')).replace('/', '-') if txn.get('date') else '',
-                            'amount': float(txn.get('amount', 0)) if txn.get('amount') else 0,
-                            'type': str(txn.get('transaction_type', ''))[:2] if txn.get('transaction_type') else '',
-                            'description': str(txn.get('description', ''))[:50] if txn.get('description') else ''  # Truncate long descriptions
-                        }
-                        clean_transactions.append(clean_txn)
-                    
-                    response_data = {
-                        'success': True,
-                        'count': len(clean_transactions),
-                        'total': len(transactions),
-                        'data': clean_transactions
+            try:
+                total = sum(len(batch) for batch in batches)
+                first_transactions = []
+                for batch in batches:
+                    first_transactions.extend(batch[i].to_dict() for i in range(min(len(batch), 3 - len(first_transactions))))
+                
+                # Create minimal, clean response
+                clean_transactions = []
+                for i, txn in enumerate(first_transactions):  # Only first 3 for testing
+                    clean_txn = {
+                        'id': i + 1,
+                        'date': str(txn.get('date', '')).replace('/', '-') if txn.get('date') else '',
+                        'amount': rupiah(txn.get('amount')) or 0,
+                        'type': str(txn.get('transaction_type', ''))[:2] if txn.get('transaction_type') else '',
+                        'description': str(txn.get('description', ''))[:50] if txn.get('description') else ''  # Truncate long descriptions
                     }
-                    
-                    # Ensure clean JSON with no special characters
-                    response_json = json.dumps(response_data, ensure_ascii=True, separators=(',', ':'))
-                    
-                    self.send_response(200)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(response_json.encode('ascii'))
-                    
-                except json.JSONDecodeError as e:
-                    self.send_error(500, f'JSON parse error: {str(e)}')
-                except Exception as e:
-                    self.send_error(500, f'Processing error: {str(e)}')
-            else:
-                self.send_error(500, f'Parser error: {result.stderr}')
+                    clean_transactions.append(clean_txn)
+                
+                response_data = {
+                    'success': True,
+                    'count': len(clean_transactions),
+                    'total': total,
+                    'data': clean_transactions
+                }
+                
+                # Ensure clean JSON with no special characters
+                response_json = json.dumps(response_data, ensure_ascii=True, separators=(',', ':'))
+                
+                self.send_json(response_json)
+                
+            except Exception as e:
+                self.send_json_error('processing_error', f'Processing error: {str(e)}')
                 
         except Exception as e:
-            self.send_error(500, str(e))
+            self.send_processing_error(e)
     
     def health_check(self):
         """Health check endpoint"""
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps({'status': 'healthy'}).encode())
+        self.send_json(json.dumps({'status': 'healthy'}))
     
     def db_health_check(self):
         """Database health check endpoint"""
@@ -227,10 +1061,7 @@ class AFTISHandler(BaseHTTPRequestHandler):
                 cursor.execute("SELECT 1")
                 conn.close()
                 
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({'database': 'healthy'}).encode())
+                self.send_json(json.dumps({'database': 'healthy'}))
             else:
                 self.send_error(503, 'Database connection failed')
         except Exception as e:
@@ -246,13 +1077,14 @@ class AFTISHandler(BaseHTTPRequestHandler):
             limit = int(query_params.get('limit', ['100'])[0])
             account = query_params.get('account', [None])[0]
             period = query_params.get('period', [None])[0]
+            category = query_params.get('category', [None])[0]
             
             conn = get_db_connection()
             if not conn:
                 self.send_error(503, 'Database connection failed')
                 return
             
-            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor = storage.backend.dict_cursor(conn)
             
             # Build query
             query = "SELECT * FROM transactions WHERE 1=1"
@@ -266,77 +1098,252 @@ class AFTISHandler(BaseHTTPRequestHandler):
                 query += " AND period = %s"
                 params.append(period)
             
+            if category:
+                query += " AND category = %s"
+                params.append(category)
+            
             query += " ORDER BY date DESC, created_at DESC LIMIT %s"
             params.append(limit)
             
-            cursor.execute(query, params)
+            cursor.execute(storage.backend.sql(query), params)
             transactions = cursor.fetchall()
             conn.close()
             
             # Convert to list of dicts for JSON serialization
             transactions_list = [dict(txn) for txn in transactions]
             
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(transactions_list, default=str).encode())
+            self.send_json(json.dumps(transactions_list, default=str))
             
         except Exception as e:
             self.send_error(500, f'Error retrieving transactions: {str(e)}')
     
+    def get_changes(self):
+        """Long-poll for transactions committed after a cursor: ?after=SEQ&limit=100&wait=30
+
+        Without `after` the cursor is the newest change, so only later commits
+        are returned. The response's cursor is the `after` of the next request.
+        """
+        query_params = parse_qs(urlparse(self.path).query)
+        try:
+            after = query_params.get('after', [None])[0]
+            after = int(after) if after is not None else None
+            limit = max(1, min(int(query_params.get('limit', ['100'])[0]), 1000))
+            timeout = max(0.0, min(float(query_params.get('wait', ['30'])[0]), CHANGE_FEED_MAX_WAIT_SECONDS))
+        except ValueError:
+            self.send_json_error('invalid_request', 'after and limit must be integers, wait a number of seconds')
+            return
+        
+        if after is None:
+            after = change_feed.cursor()
+        changes = change_feed.wait(after, limit, timeout) if after is not None else None
+        if changes is None:
+            self.send_json_error('database_unavailable', 'Database connection failed')
+            return
+        cursor = changes[-1][0] if changes else after
+        # Entries are pre-serialized; only the envelope is built per consumer
+        self.send_json(f'{{"cursor": {cursor}, "changes": [{", ".join(change[2] for change in changes)}]}}')
+    
+    def stream_changes(self):
+        """Server-Sent Events of committed changes, resuming after Last-Event-ID (or ?after=SEQ)"""
+        try:
+            after = self.headers.get('Last-Event-ID') or parse_qs(urlparse(self.path).query).get('after', [None])[0]
+            after = int(after) if after is not None else change_feed.cursor()
+        except ValueError:
+            self.send_json_error('invalid_request', 'Last-Event-ID and after must be change seqs')
+            return
+        if after is None:
+            self.send_json_error('database_unavailable', 'Database connection failed')
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            self.wfile.write(b'retry: 1000\n\n')
+            self.wfile.flush()
+            while True:
+                changes = change_feed.wait(after, 100, CHANGE_FEED_HEARTBEAT_SECONDS)
+                if changes is None:
+                    time.sleep(RETRY_AFTER_SECONDS)
+                    continue
+                if not changes:
+                    self.wfile.write(b': keepalive\n\n')
+                for seq, _, data in changes:
+                    self.wfile.write(f'id: {seq}\nevent: change\ndata: {data}\n\n'.encode())
+                    after = seq
+                self.wfile.flush()
+        except OSError:
+            pass  # Consumer disconnected; it reconnects with Last-Event-ID
+    
+    def reload_categories(self):
+        """Reload the categorization rules file and recategorize the rows it affects"""
+        try:
+            summary = reload_categories()
+        except OSError as e:
+            self.send_json_error('processing_error', f'Cannot read rules file: {str(e)}')
+            return
+        except storage.Error as e:
+            self.send_json_error('database_rejected', f'Database error: {str(e)}')
+            return
+        
+        if summary is None:
+            self.send_json_error('database_unavailable', 'Database unavailable, rules loaded for new statements only')
+            return
+        self.send_json(json.dumps(dict(summary, success=True)))
+    
+    def get_balance(self):
+        """End-of-day balance of accounts on a date, or one point per day over a range"""
+        try:
+            query_params = parse_qs(urlparse(self.path).query)
+            accounts = list(dict.fromkeys(
+                account for value in query_params.get('account', []) for account in value.split(',') if account
+            ))
+            at = query_params.get('date', [None])[0]
+            start = query_params.get('from', [None])[0]
+            end = query_params.get('to', [None])[0]
+            
+            if not accounts or not (at or (start and end)):
+                self.send_error(400, 'account and either date or from/to required')
+                return
+            try:
+                if at:
+                    at = date.fromisoformat(at)
+                else:
+                    start, end = date.fromisoformat(start), date.fromisoformat(end)
+            except ValueError:
+                self.send_error(400, 'Dates must be YYYY-MM-DD')
+                return
+            if not at and not 0 <= (end - start).days < MAX_BALANCE_RANGE_DAYS:
+                self.send_error(400, f'from/to must span 1 to {MAX_BALANCE_RANGE_DAYS} days')
+                return
+            
+            conn = get_db_connection()
+            if not conn:
+                self.send_error(503, 'Database connection failed')
+                return
+            
+            try:
+                cursor = conn.cursor()
+                # Balance carried into the first day: the latest snapshot on or before it
+                latest = {
+                    account: (day, balance)
+                    for account, day, balance in storage.backend.balances_at(cursor, accounts, at or start)
+                }
+                
+                if at:
+                    response_data = {
+                        'date': at,
+                        'accounts': {
+                            account: {'balance': balance, 'as_of': day}
+                            for account, (day, balance) in latest.items()
+                        }
+                    }
+                else:
+                    condition, params = storage.backend.any_of('account_number', accounts)
+                    cursor.execute(storage.backend.sql(
+                        "SELECT account_number, date, balance FROM daily_balances "
+                        f"WHERE {condition} AND date > %s AND date <= %s ORDER BY date"
+                    ), params + [start, end])
+                    changes = {}
+                    for account, day, balance in cursor.fetchall():
+                        changes[(account, day)] = balance
+                    
+                    # Days without transactions keep the previous day's balance
+                    series = {account: [] for account in accounts}
+                    for offset in range((end - start).days + 1):
+                        day = start + timedelta(days=offset)
+                        for account in accounts:
+                            balance = changes.get((account, day), latest[account][1])
+                            latest[account] = (day, balance)
+                            if balance is not None:
+                                series[account].append({'date': day, 'balance': balance})
+                    response_data = {'from': start, 'to': end, 'accounts': series}
+            finally:
+                conn.close()
+            
+            self.send_json(json.dumps(response_data, default=str))
+            
+        except Exception as e:
+            self.send_error(500, f'Error retrieving balances: {str(e)}')
+    
     def parse_and_store_pdf(self):
         """Parse a PDF file and store results in database"""
         try:
-            # Get content length
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode())
+            # Duplicate requests for a PDF already being stored wait for that job
+            job = self.run_parse_job('parse-and-store', parse_and_store_job)
+            if not job:
+                return
+            if job.error:
+                self.send_processing_error(job.error)
+                return
             
-            pdf_path = data.get('pdf_path')
-            if not pdf_path:
-                self.send_error(400, 'pdf_path required')
+            parsed_count = job.result
+            if parsed_count is None:
+                self.send_json_error('database_unavailable', 'Database unavailable, nothing was stored')
                 return
             
-            # Copy to temp directory
-            temp_path = f"/srv/aftis/tmp/{os.path.basename(pdf_path)}"
-            shutil.copy2(pdf_path, temp_path)
+            response_data = {
+                'success': True,
+                'parsed_count': parsed_count,
+                'database_stored': True,
+                'message': f"Parsed {parsed_count} transactions, stored in database"
+            }
             
-            # Run parser
-            result = subprocess.run([
-                'python3', '/srv/aftis/parse.py', temp_path
-            ], capture_output=True, text=True)
+            self.send_json(json.dumps(response_data))
+                
+        except Exception as e:
+            self.send_processing_error(e)
+    
+    def upload_inbox_file(self):
+        """Stream the request body into the inbox, renamed into place once complete"""
+        try:
+            inbox_path = os.getenv('INBOX_PATH', '/srv/aftis/inbox')
+            filename = os.path.basename(unquote(urlparse(self.path).path))
+            if filename.startswith('.') or not filename.lower().endswith('.pdf'):
+                self.send_error(400, 'Only .pdf files can be uploaded')
+                return
             
-            # Clean up temp file
-            if os.path.exists(temp_path):
+            content_length = self.headers.get('Content-Length')
+            if content_length is None:
+                self.send_error(411, 'Content-Length required')
+                return
+            
+            # Written under a hidden .part name so the auto-processor only sees complete files
+            temp_path = os.path.join(inbox_path, f".{filename}.part")
+            remaining = int(content_length)
+            sha256 = hashlib.sha256()
+            with open(temp_path, 'wb') as f:
+                while remaining > 0:
+                    chunk = self.rfile.read(min(UPLOAD_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    sha256.update(chunk)
+                    remaining -= len(chunk)
+            
+            expected = self.headers.get('X-Content-SHA256')
+            if remaining or (expected and expected.lower() != sha256.hexdigest()):
                 os.remove(temp_path)
+                self.close_connection = True
+                self.send_error(400, 'Incomplete upload' if remaining else 'Checksum mismatch')
+                return
             
-            if result.returncode == 0:
-                try:
-                    transactions = json.loads(result.stdout)
-                    
-                    # Store in database
-                    db_success = insert_transactions(transactions)
-                    
-                    response_data = {
-                        'success': True,
-                        'parsed_count': len(transactions),
-                        'database_stored': db_success,
-                        'message': f"Parsed {len(transactions)} transactions" + 
-                                 (", stored in database" if db_success else ", database storage failed")
-                    }
-                    
-                    self.send_response(200)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(json.dumps(response_data).encode())
-                    
-                except json.JSONDecodeError as e:
-                    self.send_error(500, f'JSON parse error: {str(e)}')
-                except Exception as e:
-                    self.send_error(500, f'Processing error: {str(e)}')
-            else:
-                self.send_error(500, f'Parser error: {result.stderr}')
-                
+            os.replace(temp_path, os.path.join(inbox_path, filename))
+            logger.info(f"Received {filename} ({content_length} bytes)")
+            
+            response_json = json.dumps({
+                'success': True,
+                'filename': filename,
+                'size': int(content_length),
+                'sha256': sha256.hexdigest()
+            }).encode()
+            self.send_json(response_json, status=201)
+            
+        except OSError as e:
+            self.send_error(500, f'Failed to store upload: {str(e)}')
         except Exception as e:
             self.send_error(500, str(e))
     
@@ -360,13 +1367,10 @@ class AFTISHandler(BaseHTTPRequestHandler):
             os.remove(file_path)
             logger.info(f"Deleted file: {filename}")
             
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({
+            self.send_json(json.dumps({
                 'success': True,
                 'message': f'File {filename} deleted successfully'
-            }).encode())
+            }))
             
         except OSError as e:
             self.send_error(500, f'Failed to delete file: {str(e)}')
@@ -393,15 +1397,12 @@ class AFTISHandler(BaseHTTPRequestHandler):
                     except OSError as e:
                         logger.error(f"Failed to delete {filename}: {e}")
             
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({
+            self.send_json(json.dumps({
                 'success': True,
                 'deleted_files': deleted_files,
                 'count': len(deleted_files),
                 'message': f'Deleted {len(deleted_files)} PDF files from inbox'
-            }).encode())
+            }))
             
         except Exception as e:
             self.send_error(500, str(e))
@@ -410,10 +1411,19 @@ def main():
     # Ensure directories exist
     inbox_path = os.getenv('INBOX_PATH', '/srv/aftis/inbox')
     os.makedirs(inbox_path, exist_ok=True)
-    os.makedirs('/srv/aftis/tmp', exist_ok=True)
+    os.makedirs(TMP_PATH, exist_ok=True)
+    
+    if os.path.isfile(CATEGORY_RULES_PATH):
+        try:
+            logger.info(f"Categorization rules: {reload_categories()}")
+        except Exception as e:
+            logger.error(f"Failed to apply categorization rules: {e}")
+    
+    change_feed.start()
     
     port = int(os.getenv('AFTIS_PORT', '8080'))
-    server = HTTPServer(('0.0.0.0', port), AFTISHandler)
+    # One thread per connection, so an idle keep-alive client cannot block the others
+    server = ThreadingHTTPServer(('0.0.0.0', port), AFTISHandler)
     print(f"AFTIS Parser Server starting on port {port}...")
     server.serve_forever()
 
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Synthetic BCA e-statement generator
+Builds BCA-layout statements offline for benchmarks and load tests, either as
+the page frames tabula would return or as real PDF files.
+Usage: python statement_generator.py [--pages 1 10 100 500] [--count N] [--out-dir DIR]
+"""
+
+import os
+import sys
+import zlib
+import random
+import argparse
+import calendar
+
+MONTHS = [
+    'JANUARI', 'FEBRUARI', 'MARET', 'APRIL', 'MEI', 'JUNI', 'JULI',
+    'AGUSTUS', 'SEPTEMBER', 'OKTOBER', 'NOVEMBER', 'DESEMBER'
+]
+
+# (description, transaction type) pairs seen on real BCA statements
+TRANSACTION_KINDS = [
+    ('TRSF E-BANKING DB', 'DB'),
+    ('TARIKAN ATM', 'DB'),
+    ('KARTU DEBIT', 'DB'),
+    ('BI-FAST DB', 'DB'),
+    ('BIAYA ADM', 'DB'),
+    ('TRSF E-BANKING CR', 'CR'),
+    ('SWITCHING CR', 'CR'),
+    ('SETORAN TUNAI', 'CR'),
+    ('BI-FAST CR', 'CR'),
+]
+
+COUNTERPARTIES = [
+    'TOKOPEDIA', 'SHOPEE', 'INDOMARET', 'ALFAMART', 'PLN PREPAID',
+    'TELKOMSEL', 'GOPAY', 'OVO', 'BPJS KESEHATAN', 'PT MAJU JAYA',
+    'BUDI SANTOSO', 'SITI AMINAH', 'GRAB', 'PERTAMINA', 'KOPI KENANGAN'
+]
+
+BRANCHES = ['0000', '0938', '0061', '0271']
+
+# PDF geometry, in points from the top-left corner like tabula's area/columns
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+FONT_SIZE = 7
+ROW_PITCH = 12
+TABLE_TOP = 236
+ROWS_PER_PAGE = 44
+HEADER_ROWS_TOP = 80
+HEADER_X = (320, 400, 410)
+TABLE_X = (30, 90, 188, 304, 345, 472)
+
+
+def format_amount(cents):
+    """Format integer cents the way BCA prints amounts: 1,234,567.89"""
+    return f"{cents // 100:,}.{cents % 100:02d}"
+
+
+def generate_statement(pages=1, seed=0, account_number=None, year=2024, month=12,
+                       multiline_ratio=0.6, db_ratio=0.7, include_bunga=True):
+    """Generate a statement dict with per-page table rows in BCA layout"""
+    rng = random.Random(seed)
+    if account_number is None:
+        account_number = ''.join(str(rng.randint(0, 9)) for _ in range(10))
+
+    days = calendar.monthrange(year, month)[1]
+    target_rows = pages * ROWS_PER_PAGE - (2 if include_bunga else 1)
+
+    init_balance = rng.randint(50_000_000, 500_000_000) * 100
+    balance = init_balance
+    rows = [[f"01/{month:02d}", 'SALDO AWAL', None, None, None, format_amount(init_balance)]]
+
+    # Build transactions first so the balance can be printed on the last one of each day
+    transactions = []
+    row_count = 0
+    prev_amount = None
+    while row_count < target_rows:
+        desc, txn_type = rng.choice(TRANSACTION_KINDS)
+        if txn_type == 'CR' and rng.random() < db_ratio:
+            desc, txn_type = rng.choice([k for k in TRANSACTION_KINDS if k[1] == 'DB'])
+        elif txn_type == 'DB' and rng.random() >= db_ratio:
+            desc, txn_type = rng.choice([k for k in TRANSACTION_KINDS if k[1] == 'CR'])
+
+        max_rupiah = 2_000_000 if txn_type == 'DB' else 5_000_000
+        amount = rng.randint(1_000, max_rupiah) * 100 + rng.choice([0, 0, 0, rng.randint(1, 99)])
+        # Identical consecutive amounts are merged by the extractor, keep them distinct
+        if amount == prev_amount:
+            amount += 100
+        prev_amount = amount
+
+        counterparty = rng.choice(COUNTERPARTIES)
+        lines = [(desc, f"{rng.randint(1000, 9999)}/FTSCY/WS{rng.randint(10000, 99999)}")]
+        if rng.random() < multiline_ratio:
+            lines.append((None, f"{amount // 100}.00"))
+            lines.append((None, counterparty))
+            for _ in range(rng.randint(0, 2)):
+                lines.append((f"TRANSFER DR {rng.randint(100, 999)}", f"REF{rng.randint(100000, 999999)}"))
+        lines = lines[:target_rows - row_count]
+
+        transactions.append({
+            'amount': amount,
+            'type': txn_type,
+            'branch': rng.choice(BRANCHES),
+            'lines': lines
+        })
+        row_count += len(lines)
+
+    for index, txn in enumerate(transactions):
+        day = min(days, 1 + index * days // max(len(transactions), 1))
+        txn['date'] = f"{day:02d}/{month:02d}"
+        balance += -txn['amount'] if txn['type'] == 'DB' else txn['amount']
+        txn['balance'] = balance
+
+    for index, txn in enumerate(transactions):
+        last_of_day = index == len(transactions) - 1 or transactions[index + 1]['date'] != txn['date']
+        mutasi = format_amount(txn['amount']) + (' DB' if txn['type'] == 'DB' else '')
+        first_desc, first_detail = txn['lines'][0]
+        rows.append([
+            txn['date'], first_desc, first_detail, txn['branch'], mutasi,
+            format_amount(txn['balance']) if last_of_day else None
+        ])
+        for desc, detail in txn['lines'][1:]:
+            rows.append([None, desc, detail, None, None, None])
+
+    if include_bunga:
+        interest = rng.randint(1_000, 50_000) * 100 + 1
+        balance += interest
+        rows.append([f"{days:02d}/{month:02d}", 'BUNGA', None, None, format_amount(interest), format_amount(balance)])
+
+    page_rows = [rows[i:i + ROWS_PER_PAGE] for i in range(0, len(rows), ROWS_PER_PAGE)]
+
+    return {
+        'account_number': account_number,
+        'periode': f"{MONTHS[month - 1]} {year}",
+        'init_balance': init_balance,
+        'final_balance': balance,
+        'transaction_count': len(transactions),
+        'row_count': len(rows),
+        'pages': page_rows
+    }
+
+
+def page_frames(statement):
+    """Return the per-page DataFrames tabula would extract from the table area"""
+    import numpy as np
+    import pandas as pd
+
+    frames = []
+    for rows in statement['pages']:
+        cells = [[np.nan if value is None else value for value in row] for row in rows]
+        frames.append(pd.DataFrame(cells, columns=range(6), dtype=object))
+    return frames
+
+
+def _pdf_text(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def _page_content(statement, page_index, page_count):
+    ops = ["BT", f"/F1 {FONT_SIZE} Tf"]
+
+    def put(x, top, text):
+        y = PAGE_HEIGHT - top - FONT_SIZE
+        ops.append(f"1 0 0 1 {x} {y} Tm ({_pdf_text(text)}) Tj")
+
+    header = [
+        ('NO. REKENING', statement['account_number']),
+        ('HALAMAN', f"{page_index + 1} / {page_count}"),
+        ('PERIODE', statement['periode']),
+        ('MATA UANG', 'IDR'),
+    ]
+    for row_index, (label, value) in enumerate(header):
+        top = HEADER_ROWS_TOP + row_index * ROW_PITCH
+        put(HEADER_X[0], top, label)
+        put(HEADER_X[1], top, ':')
+        put(HEADER_X[2], top, value)
+
+    put(30, 40, 'REKENING TAHAPAN')
+    for x, title in zip(TABLE_X, ['TANGGAL', 'KETERANGAN', '', 'CBG', 'MUTASI', 'SALDO']):
+        if title:
+            put(x, TABLE_TOP - 18, title)
+
+    for row_index, row in enumerate(statement['pages'][page_index]):
+        top = TABLE_TOP + row_index * ROW_PITCH
+        for x, value in zip(TABLE_X, row):
+            if value is not None:
+                put(x, top, value)
+
+    ops.append("ET")
+    return '\n'.join(ops).encode('latin-1')
+
+
+def write_pdf(statement, pdf_path):
+    """Write the statement as a minimal Helvetica PDF with BCA table geometry"""
+    page_count = len(statement['pages'])
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(None)
+    pages_ref = add(None)
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+
+    kids = []
+    for page_index in range(page_count):
+        content = zlib.compress(_page_content(statement, page_index, page_count))
+        stream = add(
+            f"<< /Length {len(content)} /Filter /FlateDecode >>\nstream\n".encode()
+            + content + b"\nendstream"
+        )
+        kids.append(add(
+            f"<< /Type /Page /Parent {pages_ref} 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 {font} 0 R >> >> /Contents {stream} 0 R >>".encode()
+        ))
+
+    objects[catalog - 1] = f"<< /Type /Catalog /Pages {pages_ref} 0 R >>".encode()
+    objects[pages_ref - 1] = (
+        f"<< /Type /Pages /Kids [{' '.join(f'{kid} 0 R' for kid in kids)}] /Count {page_count} >>".encode()
+    )
+
+    output = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+
+    xref_offset = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        output += f"{offset:010d} 00000 n \n".encode()
+    output += (
+        f"trailer\n<< /Size {len(objects) + 1} /Root {catalog} 0 R >>\n"
+        f"startxref\n{xref_offset}\n%%EOF\n"
+    ).encode()
+
+    with open(pdf_path, 'wb') as f:
+        f.write(output)
+    return pdf_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic BCA e-statement PDFs')
+    parser.add_argument('--pages', type=int, nargs='+', default=[1, 10, 100, 500],
+                        help='Page counts to generate (1-500)')
+    parser.add_argument('--count', type=int, default=1, help='Statements per page count')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--out-dir', default='generated', help='Output directory')
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    for pages in args.pages:
+        if not 1 <= pages <= 500:
+            print(f"Error: page count {pages} outside 1-500", file=sys.stderr)
+            sys.exit(1)
+        for index in range(args.count):
+            statement = generate_statement(pages=pages, seed=args.seed + index)
+            pdf_path = os.path.join(args.out_dir, f"{statement['account_number']}_{pages}p.pdf")
+            write_pdf(statement, pdf_path)
+            print(f"✓ {pdf_path}: {len(statement['pages'])} pages, "
+                  f"{statement['transaction_count']} transactions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+AFTIS Storage Backends
+The SQL that differs between PostgreSQL (the default) and an embedded SQLite
+database in WAL mode, for single-node deployments without a database server.
+STORAGE_BACKEND selects one; the server, backfill.py and the benchmarks use it
+through `backend`. Queries both accept are written once with %s parameters
+and passed through backend.sql().
+"""
+
+import io
+import os
+import json
+import logging
+import sqlite3
+from datetime import date, datetime
+from decimal import Decimal
+
+import psycopg2
+from psycopg2.extras import RealDictCursor, execute_values
+
+from transaction_batch import COLUMNS, format_cents
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'postgres')
+SQLITE_PATH = os.getenv('SQLITE_PATH', '/srv/aftis/aftis.db')
+# A writer waits this long for another one to commit before failing with "database is locked"
+SQLITE_BUSY_TIMEOUT_SECONDS = float(os.getenv('SQLITE_BUSY_TIMEOUT_SECONDS', '30'))
+SQLITE_BATCH_ROWS = 5000
+
+BASE_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# Database errors of either backend, for except clauses
+Error = (psycopg2.Error, sqlite3.Error)
+# The database went away or is busy: worth retrying later
+UnavailableError = (psycopg2.OperationalError, psycopg2.InterfaceError, sqlite3.OperationalError)
+# The database refused the rows themselves
+RejectedError = (psycopg2.DataError, psycopg2.IntegrityError, sqlite3.DataError, sqlite3.IntegrityError)
+
+COPY_QUERY = f"COPY transactions ({', '.join(COLUMNS)}) FROM STDIN"
+UPSERT_DAILY_BALANCES = """
+    INSERT INTO daily_balances (account_number, date, balance) VALUES %s
+    ON CONFLICT (account_number, date) DO UPDATE SET balance = EXCLUDED.balance, updated_at = CURRENT_TIMESTAMP
+"""
+# Latest end-of-day balance on or before a date, for each account of an array
+BALANCE_AT_QUERY = """
+    SELECT accounts.account_number, latest.date, latest.balance
+    FROM unnest(%s::text[]) AS accounts(account_number)
+    LEFT JOIN LATERAL (
+        SELECT date, balance FROM daily_balances
+        WHERE account_number = accounts.account_number AND date <= %s
+        ORDER BY date DESC LIMIT 1
+    ) latest ON TRUE
+"""
+# Change feed (PostgreSQL): every ingest commit is logged in transaction_changes and announced on this channel
+CHANGES_CHANNEL = 'aftis_transactions'
+# Held from logging a change until commit, so change numbers follow commit order
+CHANGES_LOCK_KEY = 0x41465449
+FIRST_POSSIBLE_ID = """
+    SELECT COALESCE(pg_sequence_last_value(pg_get_serial_sequence('transactions', 'id')::regclass), 0)
+"""
+# Rows this database transaction inserted; ids of concurrent ingests may interleave with them
+OWN_INSERTED_IDS = "SELECT id FROM transactions WHERE id > %s AND xmin = pg_current_xact_id()::xid ORDER BY id"
+INSERT_CHANGES = """
+    INSERT INTO transaction_changes (account_number, period, rows, id_ranges) VALUES %s RETURNING seq
+"""
+CHANGE_ROWS = """
+    SELECT ranges.seq AS change_seq, t.*
+    FROM unnest(%s::bigint[], %s::bigint[], %s::bigint[]) AS ranges(seq, first_id, last_id)
+    JOIN transactions t ON t.id BETWEEN ranges.first_id AND ranges.last_id
+    ORDER BY ranges.seq, t.id
+"""
+
+
+def id_ranges(ids):
+    """Ascending ids as a flat [first, last, first, last, ...] list of consecutive runs"""
+    ranges = []
+    for transaction_id in ids:
+        if ranges and ranges[-1] == transaction_id - 1:
+            ranges[-1] = transaction_id
+        else:
+            ranges.extend((transaction_id, transaction_id))
+    return ranges
+
+
+def change_entries(groups, ids):
+    """(account_number, period, rows, id_ranges) of each group's slice of the inserted ids"""
+    entries = []
+    position = 0
+    for account_number, period, rows in groups:
+        own = ids[position:position + rows]
+        position += rows
+        if own:
+            entries.append((account_number, period, len(own), id_ranges(own)))
+    return entries
+
+
+def like_pattern(pattern):
+    """LIKE pattern matching text that contains `pattern` literally, with \\ as escape character"""
+    escaped = pattern.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+
+class PostgresStorage:
+    """PostgreSQL through psycopg2: COPY for inserts, LISTEN/NOTIFY for the change feed"""
+
+    name = 'postgres'
+    schema_path = os.path.join(BASE_PATH, 'schema.sql')
+    # Commits are announced with NOTIFY, also those of other processes
+    notifies = True
+
+    def connect(self):
+        try:
+            return psycopg2.connect(
+                host=os.getenv('POSTGRES_HOST', 'postgres'),
+                port=os.getenv('POSTGRES_PORT', '5432'),
+                database=os.getenv('POSTGRES_DB', 'aftis'),
+                user=os.getenv('POSTGRES_USER', 'aftis_user'),
+                password=os.getenv('POSTGRES_PASSWORD', 'aftis_password')
+            )
+        except Exception as e:
+            logger.error(f"Database connection failed: {e}")
+            return None
+
+    def sql(self, query):
+        return query
+
+    def dict_cursor(self, conn):
+        return conn.cursor(cursor_factory=RealDictCursor)
+
+    def tables(self, cursor):
+        cursor.execute("SELECT tablename FROM pg_tables WHERE schemaname = current_schema()")
+        return {row[0] for row in cursor.fetchall()}
+
+    def run_script(self, conn, script):
+        conn.cursor().execute(script)
+
+    def any_of(self, column, values):
+        """SQL condition and parameters of `column` being one of `values`; fragments use %s placeholders"""
+        return f"{column} = ANY(%s)", [list(values)]
+
+    def insert_values(self, cursor, query, rows):
+        """Run an INSERT ... VALUES %s for many rows"""
+        execute_values(cursor, query, rows, page_size=1000)
+
+    def insert_batches(self, cursor, batches):
+        """Store the rows of TransactionBatch objects with one COPY"""
+        if len(batches) == 1:
+            buffer = batches[0].copy_buffer()
+        else:
+            buffer = io.StringIO(''.join(batch.copy_buffer().getvalue() for batch in batches))
+        cursor.copy_expert(COPY_QUERY, buffer)
+
+    def upsert_daily_balances(self, cursor, balances):
+        """Record (account_number, date, balance cents) end-of-day balances"""
+        self.insert_values(cursor, UPSERT_DAILY_BALANCES, [
+            (account_number, day, format_cents(cents)) for account_number, day, cents in balances
+        ])
+
+    def balances_at(self, cursor, accounts, at):
+        """(account_number, date, balance) of each account's latest balance on or before `at`"""
+        cursor.execute(BALANCE_AT_QUERY, (accounts, at))
+        return cursor.fetchall()
+
+    def contains_any(self, columns, patterns):
+        """SQL condition and parameters of any of `columns` containing any pattern, ignoring case"""
+        likes = [like_pattern(pattern) for pattern in patterns]
+        return ' OR '.join(f"{column} ILIKE ANY(%s)" for column in columns), [likes] * len(columns)
+
+    def update_categories(self, cursor, updates):
+        """Set the category of (id, category) rows"""
+        execute_values(
+            cursor,
+            "UPDATE transactions SET category = v.category "
+            "FROM (VALUES %s) AS v(id, category) WHERE transactions.id = v.id",
+            updates
+        )
+
+    def first_possible_id(self, cursor):
+        """Lower bound of the ids the next inserts get, read before they start"""
+        cursor.execute(FIRST_POSSIBLE_ID)
+        return cursor.fetchone()[0]
+
+    def record_changes(self, cursor, first_id, groups):
+        """Log the rows this database transaction inserted as change feed entries, then notify on commit
+
+        groups are (account_number, period, rows) in insertion order, one entry each.
+        The advisory lock is held until commit, so entries are numbered in commit
+        order and a consumer's cursor never passes a transaction that commits late.
+        """
+        cursor.execute(OWN_INSERTED_IDS, (first_id,))
+        entries = change_entries(groups, [row[0] for row in cursor.fetchall()])
+        if not entries:
+            return
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (CHANGES_LOCK_KEY,))
+        seqs = execute_values(cursor, INSERT_CHANGES, entries, fetch=True)
+        cursor.execute("SELECT pg_notify(%s, %s)", (CHANGES_CHANNEL, json.dumps({
+            'seq': seqs[-1][0], 'rows': sum(entry[2] for entry in entries)
+        })))
+
+    def change_rows(self, cursor, changes):
+        """Stored rows of change entries, by seq"""
+        seqs, firsts, lasts = [], [], []
+        for change in changes:
+            ranges = change['id_ranges']
+            for index in range(0, len(ranges), 2):
+                seqs.append(change['seq'])
+                firsts.append(ranges[index])
+                lasts.append(ranges[index + 1])
+        cursor.execute(CHANGE_ROWS, (seqs, firsts, lasts))
+        rows = {}
+        for row in cursor.fetchall():
+            rows.setdefault(row.pop('change_seq'), []).append(dict(row))
+        return rows
+
+
+def dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+# Amounts are stored as integer cents (declared CENTS) and read back as decimals, like NUMERIC(15,2)
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_converter('CENTS', lambda value: Decimal(int(value)).scaleb(-2))
+sqlite3.register_converter('DATE', lambda value: date.fromisoformat(value.decode()))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+
+
+class SQLiteStorage:
+    """Embedded SQLite database in WAL mode; schema.sqlite.sql is loaded into a new file
+
+    Writers are serialized by SQLite itself, waiting up to
+    SQLITE_BUSY_TIMEOUT_SECONDS for each other; readers never block them.
+    """
+
+    name = 'sqlite'
+    schema_path = os.path.join(BASE_PATH, 'schema.sqlite.sql')
+    # No NOTIFY: the server wakes its change feed after its own commits
+    notifies = False
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self.schema_checked = False
+
+    def connect(self):
+        try:
+            conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT_SECONDS,
+                                   detect_types=sqlite3.PARSE_DECLTYPES)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # With WAL, a commit survives a crash of the process, only not one of the machine
+            conn.execute("PRAGMA synchronous=NORMAL")
+            if not self.schema_checked:
+                if 'transactions' not in self.tables(conn.cursor()):
+                    with open(self.schema_path) as f:
+                        conn.executescript(f.read())
+                    logger.info(f"Created SQLite database {self.path}")
+                self.schema_checked = True
+            return conn
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Database connection failed: {e}")
+            return None
+
+    def sql(self, query):
+        return query.replace('%s', '?')
+
+    def dict_cursor(self, conn):
+        cursor = conn.cursor()
+        cursor.row_factory = dict_row
+        return cursor
+
+    def tables(self, cursor):
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        return {row[0] for row in cursor.fetchall()}
+
+    def run_script(self, conn, script):
+        conn.executescript(script)
+
+    def any_of(self, column, values):
+        values = list(values)
+        return f"{column} IN ({', '.join(['%s'] * len(values))})", values
+
+    def insert_values(self, cursor, query, rows):
+        rows = list(rows)
+        if rows:
+            placeholders = f"({', '.join('?' * len(rows[0]))})"
+            cursor.executemany(self.sql(query.replace('VALUES %s', f'VALUES {placeholders}')), rows)
+
+    def insert_batches(self, cursor, batches):
+        """Store the rows of TransactionBatch objects with batched prepared inserts"""
+        query = f"INSERT INTO transactions ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+        for batch in batches:
+            rows = batch.rows()
+            for start in range(0, len(rows), SQLITE_BATCH_ROWS):
+                cursor.executemany(query, rows[start:start + SQLITE_BATCH_ROWS])
+
+    def upsert_daily_balances(self, cursor, balances):
+        self.insert_values(cursor, UPSERT_DAILY_BALANCES, balances)
+
+    def balances_at(self, cursor, accounts, at):
+        latest = []
+        for account in accounts:
+            cursor.execute(
+                "SELECT date, balance FROM daily_balances WHERE account_number = ? AND date <= ? "
+                "ORDER BY date DESC LIMIT 1", (account, at)
+            )
+            found = cursor.fetchone()
+            latest.append((account,) + (tuple(found) if found else (None, None)))
+        return latest
+
+    def contains_any(self, columns, patterns):
+        # LIKE ignores the case of ASCII letters, which is all bank descriptions use
+        likes = [like_pattern(pattern) for pattern in patterns]
+        condition = ' OR '.join(f"{column} LIKE %s ESCAPE '\\'" for column in columns for _ in likes)
+        return condition, likes * len(columns)
+
+    def update_categories(self, cursor, updates):
+        cursor.executemany("UPDATE transactions SET category = ? WHERE id = ?",
+                           [(category, transaction_id) for transaction_id, category in updates])
+
+    def first_possible_id(self, cursor):
+        return None
+
+    def record_changes(self, cursor, first_id, groups):
+        """Log the rows this database transaction inserted as change feed entries
+
+        SQLite holds the write lock from the first insert to the commit and
+        AUTOINCREMENT hands out ids in order without reusing deleted ones, so
+        this transaction's rows are the last `total` ids given out.
+        """
+        total = sum(rows for _, _, rows in groups)
+        if not total:
+            return
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'transactions'")
+        last_id = cursor.fetchone()[0]
+        entries = change_entries(groups, list(range(last_id - total + 1, last_id + 1)))
+        cursor.executemany(
+            "INSERT INTO transaction_changes (account_number, period, rows, id_ranges) VALUES (?, ?, ?, ?)",
+            [(account_number, period, rows, json.dumps(ranges)) for account_number, period, rows, ranges in entries]
+        )
+
+    def change_rows(self, cursor, changes):
+        rows = {}
+        for change in changes:
+            ranges = json.loads(change['id_ranges'])
+            for index in range(0, len(ranges), 2):
+                cursor.execute("SELECT * FROM transactions WHERE id BETWEEN ? AND ? ORDER BY id",
+                               (ranges[index], ranges[index + 1]))
+                rows.setdefault(change['seq'], []).extend(cursor.fetchall())
+        return rows
+
+
+BACKENDS = {'postgres': PostgresStorage, 'sqlite': SQLiteStorage}
+
+
+def get_backend(name=STORAGE_BACKEND):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown storage backend {name!r}, expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[name]()
+
+
+backend = get_backend()
@@ -0,0 +1,50 @@
+import pytest
+
+import layouts
+import statement_generator
+
+pytest.importorskip('pypdf')
+
+
+def write_statement(tmp_path, monkeypatch, label_ops=None):
+    """Generated one-page statement, with the NO. REKENING label drawn as `label_ops` if given"""
+    if label_ops:
+        page_content = statement_generator._page_content
+        monkeypatch.setattr(
+            statement_generator, '_page_content',
+            lambda *args: page_content(*args).replace(b'(NO. REKENING) Tj', label_ops)
+        )
+    statement = statement_generator.generate_statement(pages=1, seed=1)
+    return statement_generator.write_pdf(statement, str(tmp_path / 'statement.pdf'))
+
+
+def test_fingerprint_matches_generated_statement(tmp_path, monkeypatch):
+    assert layouts.fingerprint(write_statement(tmp_path, monkeypatch)) == 'bca-tahapan'
+
+
+def test_fingerprint_matches_label_split_across_text_runs(tmp_path, monkeypatch):
+    pdf_path = write_statement(tmp_path, monkeypatch, b'(NO.) Tj (REKENING) Tj')
+    # pypdf joins the runs without a space
+    assert any('NO.REKENING' in text for _, _, text in layouts.page_lines(pdf_path))
+    assert layouts.fingerprint(pdf_path, strict=True) == 'bca-tahapan'
+
+
+def test_unmatched_text_layer_falls_back_to_default_template(tmp_path, monkeypatch):
+    pdf_path = write_statement(tmp_path, monkeypatch)
+    templates = [dict(layouts.TEMPLATES[0], name='other', anchors=[{'text': 'XPRESI', 'area': (0, 0, 842, 595)}])]
+    assert layouts.fingerprint(pdf_path, templates) == layouts.DEFAULT_TEMPLATE
+    with pytest.raises(layouts.UnknownLayoutError):
+        layouts.fingerprint(pdf_path, templates, strict=True)
+
+
+def test_fallback_is_not_cached(tmp_path, monkeypatch):
+    pdf_path = write_statement(tmp_path, monkeypatch)
+    cache = layouts.LayoutCache(str(tmp_path / 'layout-cache.json'))
+    default = dict(layouts.TEMPLATES[0], anchors=[{'text': 'XPRESI', 'area': (0, 0, 842, 595)}])
+    assert layouts.select_template(pdf_path, [default], cache)['name'] == layouts.DEFAULT_TEMPLATE
+    assert cache.get(layouts.file_sha256(pdf_path)) is None
+
+    # A matching template added afterwards gets the file, and that match is cached
+    added = dict(layouts.TEMPLATES[0], name='bca-added')
+    assert layouts.select_template(pdf_path, [added, default], cache)['name'] == 'bca-added'
+    assert layouts.LayoutCache(cache.path).get(layouts.file_sha256(pdf_path)) == 'bca-added'
@@ -0,0 +1,171 @@
+import json
+import threading
+import urllib.request
+from contextlib import contextmanager, ExitStack
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip('psycopg2')
+
+import storage
+import server
+from benchmark import throwaway_postgres, SkipCase
+from transaction_batch import TransactionBatch
+
+# Differ between runs and backends by nature
+VOLATILE = ('processed_at', 'created_at')
+
+
+def transactions(account_number, period, days, balances=True):
+    """Fixed statement rows, amounts in cents as the parser emits them"""
+    rows = []
+    balance = 1_000_000
+    for index, day in enumerate(days):
+        amount = 12_345 + index * 101
+        kind = 'DB' if index % 3 else 'CR'
+        balance += amount if kind == 'CR' else -amount
+        rows.append({
+            'date': day,
+            'description': 'KARTU DEBIT' if kind == 'DB' else 'SETORAN TUNAI',
+            'detail': f"ALFAMART {index}",
+            'branch': '0938',
+            'amount': amount,
+            'transaction_type': kind,
+            'balance': balance if balances else None,
+            'account_number': account_number,
+            'period': period,
+        })
+    return rows
+
+
+@contextmanager
+def serving(selected):
+    """Server module wired to an empty database of `selected`, with its HTTP API on a free port"""
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(storage, 'backend', selected)
+        monkeypatch.setattr(server, 'categorizer', None)
+        monkeypatch.setattr(server, 'change_feed', server.ChangeFeed())
+
+        httpd = ThreadingHTTPServer(('127.0.0.1', 0), server.AFTISHandler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        try:
+            yield f"http://127.0.0.1:{httpd.server_address[1]}"
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+
+def sqlite_output(tmp_path):
+    with serving(storage.SQLiteStorage(str(tmp_path / 'aftis.db'))) as base_url:
+        return load(base_url)
+
+
+def postgres_output():
+    with ExitStack() as stack:
+        try:
+            env = stack.enter_context(throwaway_postgres())
+        except SkipCase as e:
+            pytest.skip(f"SQLite/PostgreSQL parity NOT verified: no throwaway PostgreSQL ({e})")
+        monkeypatch = stack.enter_context(pytest.MonkeyPatch.context())
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        return load(stack.enter_context(serving(storage.PostgresStorage())))
+
+
+def get(base_url, path):
+    with urllib.request.urlopen(base_url + path, timeout=10) as response:
+        return json.load(response)
+
+
+def query(sql, params=()):
+    conn = server.get_db_connection()
+    try:
+        cursor = storage.backend.dict_cursor(conn)
+        cursor.execute(storage.backend.sql(sql), params)
+        return [dict(row) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+def stable(rows):
+    return [{key: value for key, value in row.items() if key not in VOLATILE} for row in rows]
+
+
+def load(base_url):
+    """Three commits (one of them two batches), with rows deleted in between; returns what each API gives back"""
+    december = [f"2024-12-{day:02d}" for day in (2, 2, 3, 9, 17, 31)]
+    assert server.insert_transaction_batches(
+        TransactionBatch.from_transactions(transactions('0011223344', '2024 DESEMBER', december), size=4)
+    ) == 6
+    # The newest ids are gone before the next commit: SQLite may hand them out again
+    conn = server.get_db_connection()
+    conn.cursor().execute("DELETE FROM transactions WHERE date = '2024-12-31'")
+    conn.commit()
+    conn.close()
+    november = [f"2024-11-{day:02d}" for day in (5, 28)]
+    assert server.insert_transaction_batches(
+        TransactionBatch.from_transactions(transactions('0011223344', '2024 NOVEMBER', november))
+    ) == 2
+    assert server.insert_transaction_batches(
+        TransactionBatch.from_transactions(transactions('5566778899', '2024 DESEMBER', december[:2], balances=False))
+    ) == 2
+
+    conn = server.get_db_connection()
+    try:
+        changes = server.fetch_changes(storage.backend.dict_cursor(conn), 0, 100)
+    finally:
+        conn.close()
+
+    return {
+        'transactions': sorted(
+            stable(get(base_url, '/transactions?limit=1000')),
+            key=lambda row: (row['account_number'], row['date'], row['detail'])
+        ),
+        'balance_at': get(base_url, '/balance?account=0011223344,5566778899,404&date=2024-12-05'),
+        'balance_before_first': get(base_url, '/balance?account=0011223344&date=2024-10-01'),
+        'balance_range': get(base_url, '/balance?account=0011223344,404&from=2024-11-27&to=2024-12-04'),
+        # Ids are compared too: neither backend hands out the ids of deleted rows again
+        'changes': [
+            {
+                key: value for key, value in json.loads(change[2]).items() if key != 'committed_at'
+            } | {'transactions': stable(json.loads(change[2])['transactions'])}
+            for change in changes
+        ],
+        'monthly_summary': [
+            {key: None if value is None else str(value) for key, value in row.items()}
+            for row in query("SELECT * FROM monthly_summary ORDER BY account_number, period")
+        ],
+    }
+
+
+def test_sqlite_round_trip(tmp_path):
+    output = sqlite_output(tmp_path)
+
+    # Each commit's change entry carries exactly the rows it inserted
+    assert [(change['account_number'], change['period'], change['rows'], len(change['transactions']))
+            for change in output['changes']] == [
+        ('0011223344', '2024 DESEMBER', 6, 5),
+        ('0011223344', '2024 NOVEMBER', 2, 2),
+        ('5566778899', '2024 DESEMBER', 2, 2),
+    ]
+    assert [row['date'] for row in output['changes'][1]['transactions']] == ['2024-11-05', '2024-11-28']
+    # The deleted row's id (6) is not given out again
+    assert [row['id'] for row in output['changes'][1]['transactions']] == [7, 8]
+    # Amounts come back as exact decimals
+    assert output['transactions'][0]['amount'] == '123.45'
+    assert output['balance_at']['accounts'] == {
+        '0011223344': {'balance': '9873.52', 'as_of': '2024-12-03'},
+        '5566778899': {'balance': None, 'as_of': None},
+        '404': {'balance': None, 'as_of': None},
+    }
+    assert output['balance_before_first']['accounts']['0011223344'] == {'balance': None, 'as_of': None}
+    assert output['balance_range']['accounts']['404'] == []
+    assert [row['ending_balance'] for row in output['monthly_summary']] == ['10123.45', '10123.45', None]
+    assert output['monthly_summary'][0]['total_debits'] == '377.42'
+
+
+def test_backends_agree(tmp_path):
+    """The same scenario on both backends gives identical API output"""
+    postgres = postgres_output()
+    assert sqlite_output(tmp_path) == postgres
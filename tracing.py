@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+AFTIS Tracing
+Minimal W3C Trace Context spans shared by the auto-processor, the server and
+the parser. Context crosses HTTP as a `traceparent` header and the parser
+subprocess as the TRACEPARENT environment variable; finished spans are
+appended to TRACE_EXPORT_PATH as OTLP/JSON lines, one resourceSpans per line.
+Usage: python tracing.py [traces.jsonl] [--trace TRACE_ID | --file NAME]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Spans are exported only when this is set; context is propagated either way
+TRACE_EXPORT_PATH = os.getenv('TRACE_EXPORT_PATH', '')
+SERVICE_NAME = os.getenv(
+    'TRACE_SERVICE_NAME', f"aftis-{os.path.splitext(os.path.basename(sys.argv[0] or 'python'))[0]}"
+)
+
+SPAN_KINDS = {'internal': 1, 'server': 2, 'client': 3}
+STATUS_ERROR = 2
+
+current_span = contextvars.ContextVar('current_span', default=None)
+export_lock = threading.Lock()
+
+
+def parse_traceparent(header):
+    """(trace_id, parent span_id) of a `00-<trace>-<span>-<flags>` header, None if invalid"""
+    parts = (header or '').strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    if parts[1] == '0' * 32 or parts[2] == '0' * 16:
+        return None
+    return parts[1], parts[2]
+
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class Span:
+    """One timed operation; ended spans are written to the export file"""
+
+    __slots__ = ('name', 'kind', 'trace_id', 'span_id', 'parent_id', 'start_ns', 'end_ns', 'attributes', 'status')
+
+    def __init__(self, name, parent=None, kind='internal', attributes=None):
+        if parent is None:
+            parent = current_span.get()
+        if isinstance(parent, Span):
+            self.trace_id, self.parent_id = parent.trace_id, parent.span_id
+        else:
+            self.trace_id, self.parent_id = parse_traceparent(parent) or (os.urandom(16).hex(), None)
+        self.name = name
+        self.kind = kind
+        self.span_id = os.urandom(8).hex()
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.status = (0, '')
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def record_error(self, error):
+        self.status = (STATUS_ERROR, f"{type(error).__name__}: {error}"[:500])
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            export(self)
+
+    def to_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': SPAN_KINDS[self.kind],
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [{'key': key, 'value': otlp_value(value)} for key, value in self.attributes.items()],
+            'status': {'code': self.status[0], 'message': self.status[1]} if self.status[0] else {},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+def export(span):
+    """Append a finished span to TRACE_EXPORT_PATH as one OTLP/JSON resourceSpans line"""
+    if not TRACE_EXPORT_PATH:
+        return
+    line = json.dumps({'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+        'scopeSpans': [{'scope': {'name': 'aftis'}, 'spans': [span.to_otlp()]}],
+    }]}, separators=(',', ':'))
+    # One write per line on an O_APPEND file, so lines from several processes do not interleave
+    with export_lock:
+        try:
+            with open(TRACE_EXPORT_PATH, 'a') as f:
+                f.write(line + '\n')
+        except OSError:
+            pass  # Tracing must never break processing
+
+
+def start_span(name, parent=None, kind='internal', **attributes):
+    """Start a span without making it current; the caller must end() it
+
+    Use this for work that spans generator yields, where a context manager
+    would leak the span into the consumer's context.
+    """
+    return Span(name, parent, kind, attributes)
+
+
+@contextmanager
+def span(name, parent=None, kind='internal', **attributes):
+    """Run a block as the current span, a child of `parent` (a Span or traceparent) or of the current span"""
+    active = Span(name, parent, kind, attributes)
+    token = current_span.set(active)
+    try:
+        yield active
+    except Exception as e:
+        active.record_error(e)
+        raise
+    finally:
+        current_span.reset(token)
+        active.end()
+
+
+@contextmanager
+def use_span(active):
+    """Make a span started elsewhere, e.g. on another thread, current for a block without ending it"""
+    token = current_span.set(active)
+    try:
+        yield active
+    finally:
+        current_span.reset(token)
+
+
+def load_spans(path):
+    spans = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            for resource in json.loads(line)['resourceSpans']:
+                service = next(
+                    (attribute['value']['stringValue'] for attribute in resource['resource']['attributes']
+                     if attribute['key'] == 'service.name'), '?'
+                )
+                for scope in resource['scopeSpans']:
+                    for item in scope['spans']:
+                        item['service'] = service
+                        item['attributes'] = {
+                            attribute['key']: next(iter(attribute['value'].values()))
+                            for attribute in item.get('attributes', [])
+                        }
+                        spans.append(item)
+    return spans
+
+
+def print_trace(spans):
+    """Print one trace as an indented tree: offset from the trace start, duration, service, span"""
+    by_parent = {}
+    ids = {item['spanId'] for item in spans}
+    for item in spans:
+        parent = item.get('parentSpanId')
+        by_parent.setdefault(parent if parent in ids else None, []).append(item)
+    origin = min(int(item['startTimeUnixNano']) for item in spans)
+
+    def walk(parent, depth):
+        for item in sorted(by_parent.get(parent, []), key=lambda item: int(item['startTimeUnixNano'])):
+            start = (int(item['startTimeUnixNano']) - origin) / 1e6
+            duration = (int(item['endTimeUnixNano']) - int(item['startTimeUnixNano'])) / 1e6
+            details = ' '.join(f"{key}={value}" for key, value in item['attributes'].items())
+            error = ' ERROR' if item.get('status', {}).get('code') == STATUS_ERROR else ''
+            print(f"{start:10.1f}ms {duration:10.1f}ms  {item['service']:20} {'  ' * depth}{item['name']}"
+                  f"{error}{'  ' + details if details else ''}")
+            walk(item['spanId'], depth + 1)
+
+    walk(None, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Break down the latency of one traced statement')
+    parser.add_argument('path', nargs='?', default=TRACE_EXPORT_PATH or 'traces.jsonl')
+    parser.add_argument('--trace', help='Trace ID (default: the most recent trace)')
+    parser.add_argument('--file', help='Most recent trace of this PDF file name')
+    args = parser.parse_args()
+
+    spans = load_spans(args.path)
+    if args.file:
+        spans_of_file = [item for item in spans if item['attributes'].get('file') == args.file]
+        if not spans_of_file:
+            print(f"No trace for {args.file}", file=sys.stderr)
+            sys.exit(1)
+        args.trace = max(spans_of_file, key=lambda item: int(item['startTimeUnixNano']))['traceId']
+    elif not args.trace and spans:
+        args.trace = max(spans, key=lambda item: int(item['startTimeUnixNano']))['traceId']
+
+    trace = [item for item in spans if item['traceId'] == args.trace]
+    if not trace:
+        print(f"No spans for trace {args.trace}", file=sys.stderr)
+        sys.exit(1)
+    print(f"Trace {args.trace}")
+    print_trace(trace)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+AFTIS Transaction Batch
+Column-oriented container for the transactions of one statement, passed from
+the parser to the database layer. Amounts and balances are integer cents in
+typed arrays, account number and period are stored once per batch.
+"""
+
+import io
+import sys
+import struct
+from array import array
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Binary stream framing: 4-byte big-endian payload length, then a msgpack map
+FRAME_HEADER = struct.Struct('>I')
+FRAME_VERSION = 2
+
+# Amounts and balances are int64 cents; this value marks a missing one
+MISSING_CENTS = -2 ** 63
+
+# Column order of the transactions table used by COPY and the JSON format
+COLUMNS = [
+    'date', 'description', 'detail', 'branch', 'amount',
+    'transaction_type', 'balance', 'account_number', 'period', 'category'
+]
+
+
+def _copy_text(value):
+    """Escape a value for PostgreSQL COPY text format"""
+    if value is None:
+        return '\\N'
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
+
+
+def _cents(value):
+    return None if value == MISSING_CENTS else value
+
+
+def _stored_cents(value):
+    return MISSING_CENTS if value is None else int(value)
+
+
+def format_cents(cents):
+    """Exact decimal text of integer cents, e.g. -123456 -> '-1234.56'"""
+    sign = '-' if cents < 0 else ''
+    whole, fraction = divmod(abs(cents), 100)
+    return f"{sign}{whole}.{fraction:02d}"
+
+
+def rupiah(cents):
+    """Integer cents as a rupiah number for JSON output, None stays None"""
+    return None if cents is None else cents / 100
+
+
+def json_transaction(transaction):
+    """Copy of a transaction dict with amount/balance in rupiah, the parse.py JSON format"""
+    transaction = dict(transaction)
+    transaction['amount'] = rupiah(transaction.get('amount'))
+    transaction['balance'] = rupiah(transaction.get('balance'))
+    return transaction
+
+
+def _little_endian(values):
+    """Raw bytes of a typed array in little-endian order"""
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+def write_frame(stream, batch):
+    """Write one batch to a binary stream as a length-prefixed msgpack frame"""
+    payload = msgpack.packb(batch.to_msgpack_map(), use_bin_type=True)
+    stream.write(FRAME_HEADER.pack(len(payload)))
+    stream.write(payload)
+
+
+def read_frames(stream):
+    """Yield batches from a binary stream of length-prefixed msgpack frames"""
+    while True:
+        header = stream.read(FRAME_HEADER.size)
+        if not header:
+            return
+        if len(header) < FRAME_HEADER.size:
+            raise ValueError('Truncated frame header')
+        (length,) = FRAME_HEADER.unpack(header)
+        payload = stream.read(length)
+        if len(payload) < length:
+            raise ValueError('Truncated frame payload')
+        yield TransactionBatch.from_msgpack_map(msgpack.unpackb(payload, raw=False))
+
+
+class TransactionRecord:
+    """Read-only view of one transaction in a batch, usable like the old dicts"""
+
+    __slots__ = ('batch', 'index')
+
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+
+    def __getitem__(self, key):
+        return self.batch.value(key, self.index)
+
+    def get(self, key, default=None):
+        try:
+            return self.batch.value(key, self.index)
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(COLUMNS)
+
+    def items(self):
+        return [(key, self[key]) for key in COLUMNS]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return f"TransactionRecord({self.to_dict()!r})"
+
+
+class TransactionBatch:
+    """Transactions of one account and period, stored column by column"""
+
+    __slots__ = (
+        'account_number', 'period', 'dates', 'descriptions', 'details',
+        'branches', 'amounts', 'types', 'balances', 'categories'
+    )
+
+    def __init__(self, account_number=None, period=None):
+        self.account_number = account_number
+        self.period = period
+        self.dates = []
+        self.descriptions = []
+        self.details = []
+        self.branches = []
+        self.amounts = array('q')
+        self.types = bytearray()  # 1 = DB, 0 = CR
+        self.balances = array('q')  # MISSING_CENTS where the statement shows no balance
+        self.categories = []  # Filled at ingest by categorize.Categorizer
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __iter__(self):
+        return (TransactionRecord(self, index) for index in range(len(self)))
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return TransactionRecord(self, index)
+
+    def value(self, key, index):
+        """Return one field of one transaction in the dict format (amounts in cents)"""
+        if key == 'date':
+            return self.dates[index]
+        if key == 'description':
+            return self.descriptions[index]
+        if key == 'detail':
+            return self.details[index]
+        if key == 'branch':
+            return self.branches[index]
+        if key == 'amount':
+            return _cents(self.amounts[index])
+        if key == 'transaction_type':
+            return 'DB' if self.types[index] else 'CR'
+        if key == 'balance':
+            return _cents(self.balances[index])
+        if key == 'account_number':
+            return self.account_number
+        if key == 'period':
+            return self.period
+        if key == 'category':
+            return self.categories[index]
+        raise KeyError(key)
+
+    def append(self, transaction):
+        """Append a transaction dict as produced by parse.finalize_transaction"""
+        account_number = transaction.get('account_number')
+        period = transaction.get('period')
+        if not len(self) and self.account_number is None and self.period is None:
+            self.account_number = account_number
+            self.period = period
+        elif (account_number, period) != (self.account_number, self.period):
+            raise ValueError('A batch holds transactions of a single account and period')
+
+        self.dates.append(transaction.get('date'))
+        self.descriptions.append(transaction.get('description'))
+        self.details.append(transaction.get('detail'))
+        self.branches.append(transaction.get('branch'))
+        self.amounts.append(_stored_cents(transaction.get('amount')))
+        self.types.append(1 if transaction.get('transaction_type') == 'DB' else 0)
+        self.balances.append(_stored_cents(transaction.get('balance')))
+        self.categories.append(transaction.get('category'))
+
+    @classmethod
+    def from_transactions(cls, transactions, size=None):
+        """Group transaction dicts into batches by account/period, at most `size` rows each"""
+        batch = None
+        for transaction in transactions:
+            key = (transaction.get('account_number'), transaction.get('period'))
+            if batch is not None and (
+                key != (batch.account_number, batch.period) or (size and len(batch) >= size)
+            ):
+                yield batch
+                batch = None
+            if batch is None:
+                batch = cls(*key)
+            batch.append(transaction)
+        if batch is not None and len(batch):
+            yield batch
+
+    def to_dicts(self):
+        """Convert to transaction dicts as produced by parse.iter_parse_pdf"""
+        return [record.to_dict() for record in self]
+
+    def rows(self):
+        """Row tuples in COLUMNS order, amounts in integer cents"""
+        account_number, period = self.account_number, self.period
+        return [
+            (date, description, detail, branch, _cents(amount), 'DB' if debit else 'CR', _cents(balance),
+             account_number, period, category)
+            for date, description, detail, branch, amount, debit, balance, category in zip(
+                self.dates, self.descriptions, self.details, self.branches,
+                self.amounts, self.types, self.balances, self.categories
+            )
+        ]
+
+    def to_columns(self):
+        """Compact JSON-serializable columnar form, amounts in integer cents"""
+        return {
+            'account_number': self.account_number,
+            'period': self.period,
+            'date': self.dates,
+            'description': self.descriptions,
+            'detail': self.details,
+            'branch': self.branches,
+            'amount': [_cents(value) for value in self.amounts],
+            'transaction_type': ''.join('D' if flag else 'C' for flag in self.types),
+            'balance': [_cents(value) for value in self.balances],
+            'category': self.categories,
+        }
+
+    @classmethod
+    def from_columns(cls, columns):
+        batch = cls(columns['account_number'], columns['period'])
+        batch.dates = list(columns['date'])
+        batch.descriptions = list(columns['description'])
+        batch.details = list(columns['detail'])
+        batch.branches = list(columns['branch'])
+        batch.amounts = array('q', (_stored_cents(value) for value in columns['amount']))
+        batch.types = bytearray(1 if flag == 'D' else 0 for flag in columns['transaction_type'])
+        batch.balances = array('q', (_stored_cents(value) for value in columns['balance']))
+        batch.categories = list(columns.get('category') or [None] * len(batch.dates))
+        return batch
+
+    def to_msgpack_map(self):
+        """Binary form: cents columns as raw little-endian int64 bytes"""
+        return {
+            'v': FRAME_VERSION,
+            'account_number': self.account_number,
+            'period': self.period,
+            'date': self.dates,
+            'description': self.descriptions,
+            'detail': self.details,
+            'branch': self.branches,
+            'amount': _little_endian(self.amounts),
+            'transaction_type': bytes(self.types),
+            'balance': _little_endian(self.balances),
+            'category': self.categories,
+        }
+
+    @classmethod
+    def from_msgpack_map(cls, data):
+        if data.get('v') != FRAME_VERSION:
+            raise ValueError(f"Unsupported frame version {data.get('v')}")
+        batch = cls(data['account_number'], data['period'])
+        batch.dates = data['date']
+        batch.descriptions = data['description']
+        batch.details = data['detail']
+        batch.branches = data['branch']
+        batch.amounts = _from_little_endian('q', data['amount'])
+        batch.types = bytearray(data['transaction_type'])
+        batch.balances = _from_little_endian('q', data['balance'])
+        batch.categories = data.get('category') or [None] * len(batch.dates)
+        return batch
+
+    def daily_balances(self):
+        """(date, balance cents) of each date in the batch: the last balance printed that day"""
+        balances = {}
+        for date, balance in zip(self.dates, self.balances):
+            if date is not None and balance != MISSING_CENTS:
+                balances[date] = balance
+        return list(balances.items())
+
+    def copy_buffer(self):
+        """Rows in PostgreSQL COPY text format, in COLUMNS order"""
+        account_number = _copy_text(self.account_number)
+        period = _copy_text(self.period)
+        buffer = io.StringIO()
+        for index in range(len(self)):
+            amount = self.amounts[index]
+            balance = self.balances[index]
+            buffer.write('\t'.join((
+                _copy_text(self.dates[index]),
+                _copy_text(self.descriptions[index]),
+                _copy_text(self.details[index]),
+                _copy_text(self.branches[index]),
+                '\\N' if amount == MISSING_CENTS else format_cents(amount),
+                'DB' if self.types[index] else 'CR',
+                '\\N' if balance == MISSING_CENTS else format_cents(balance),
+                account_number,
+                period,
+                _copy_text(self.categories[index]),
+            )))
+            buffer.write('\n')
+        buffer.seek(0)
+        return buffer
@@ -1,109 +1,270 @@
 #!/usr/bin/env python3
 """
-PDF File Watcher - Automatically copies PDF files to aftis-parser container
-Monitors a directory for new PDF files and copies them to the container inbox
+PDF File Watcher - Automatically uploads PDF files to the aftis-parser inbox
+Monitors a directory for new PDF files and streams them to the parser's
+PUT /inbox/<filename> endpoint over one persistent HTTP connection
 
-Usage: python watch-pdfs.py [watch_directory]
+Usage: python watch-pdfs.py [watch_directory] [--parser-url URL] [--ledger PATH]
 """
 
 import os
 import sys
+import json
 import time
-import shutil
-import subprocess
-from pathlib import Path
+import argparse
+import threading
+import http.client
+from datetime import datetime, timezone
+from urllib.parse import urlparse, quote
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
-class PDFHandler(FileSystemEventHandler):
-    def __init__(self, container_name="aftis-parser", container_path="/srv/aftis/inbox/"):
-        self.container_name = container_name
-        self.container_path = container_path
-        
-    def is_container_running(self):
-        """Check if the container is running"""
-        try:
-            result = subprocess.run(
-                ["docker", "ps", "--format", "{{.Names}}"],
-                capture_output=True, text=True, check=True
-            )
-            return self.container_name in result.stdout.split('\n')
-        except subprocess.CalledProcessError:
-            return False
-    
-    def copy_to_container(self, file_path):
-        """Copy file to container"""
-        try:
+from layouts import file_sha256
+
+DEFAULT_PARSER_URL = f"http://localhost:{os.getenv('AFTIS_PORT', '8080')}"
+# Files are sent once no new PDF event arrived for this long; replaces the fixed 1s sleep
+BATCH_WINDOW_SECONDS = float(os.getenv('WATCH_BATCH_WINDOW_SECONDS', '1'))
+BATCH_MAX_FILES = int(os.getenv('WATCH_BATCH_MAX_FILES', '50'))
+# Wait before resending files while the parser is unreachable
+RETRY_SECONDS = float(os.getenv('WATCH_RETRY_SECONDS', '5'))
+UPLOAD_TIMEOUT = float(os.getenv('WATCH_UPLOAD_TIMEOUT', '120'))
+
+
+def retry_delay(headers):
+    """Seconds the parser asked us to wait (Retry-After), or RETRY_SECONDS"""
+    try:
+        return max(RETRY_SECONDS, float(headers.get('Retry-After')))
+    except (TypeError, ValueError):
+        return RETRY_SECONDS
+
+
+class ParserConnection:
+    """Persistent HTTP connection to the parser, reopened when the server drops it"""
+
+    def __init__(self, parser_url, timeout=UPLOAD_TIMEOUT):
+        url = urlparse(parser_url)
+        connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self.parser_url = parser_url
+        self.base_path = url.path.rstrip('/')
+        self.connection = connection_class(url.hostname, url.port, timeout=timeout)
+        self.alive = None  # Unknown until the first request
+
+    def request(self, method, path, body=None, headers=None):
+        """Send one request and return (status, body, headers); raises OSError if the parser is unreachable"""
+        for attempt in (1, 2):
+            reused = self.connection.sock is not None
+            try:
+                self.connection.request(method, self.base_path + path, body=body, headers=headers or {})
+                response = self.connection.getresponse()
+                return response.status, response.read(), response.headers
+            except (OSError, http.client.HTTPException) as e:
+                self.connection.close()
+                # An idle kept-alive connection may have been closed by the server: retry once on a new one
+                if reused and attempt == 1:
+                    if hasattr(body, 'seek'):
+                        body.seek(0)
+                    continue
+                if isinstance(e, OSError):
+                    raise
+                raise ConnectionError(str(e)) from e
+
+    def upload(self, file_path, sha256):
+        filename = os.path.basename(file_path)
+        headers = {
+            'Content-Type': 'application/pdf',
+            'Content-Length': str(os.path.getsize(file_path)),
+            'X-Content-SHA256': sha256,
+        }
+        with open(file_path, 'rb') as f:
+            return self.request('PUT', f"/inbox/{quote(filename)}", body=f, headers=headers)
+
+    def close(self):
+        self.connection.close()
+
+
+class Uploader(threading.Thread):
+    """Collects detected PDFs and sends them in batches over one ParserConnection"""
+
+    def __init__(self, connection, ledger_path, batch_window=BATCH_WINDOW_SECONDS):
+        super().__init__(daemon=True)
+        self.connection = connection
+        self.ledger_path = ledger_path
+        self.batch_window = batch_window
+        self.ledger = self.load_ledger()
+        self.pending = {}  # file path -> time of its last event (or of its next retry)
+        self.last_event = 0.0
+        self.condition = threading.Condition()
+
+    def load_ledger(self):
+        if not os.path.isfile(self.ledger_path):
+            return {}
+        with open(self.ledger_path) as f:
+            return json.load(f)
+
+    def save_ledger(self):
+        temp_path = f"{self.ledger_path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self.ledger, f, indent=2, sort_keys=True)
+        os.replace(temp_path, self.ledger_path)
+
+    def add(self, file_path, delay=0.0):
+        with self.condition:
+            now = time.monotonic()
+            self.pending[file_path] = now + delay
+            if not delay:
+                self.last_event = now
+            self.condition.notify()
+
+    def take_batch(self):
+        """Block until a batch is ready: files quiet for batch_window, with no newer arrivals"""
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                ready = [path for path, seen in self.pending.items() if now - seen >= self.batch_window]
+                if ready and (now - self.last_event >= self.batch_window or len(ready) >= BATCH_MAX_FILES):
+                    ready.sort(key=self.pending.get)
+                    ready = ready[:BATCH_MAX_FILES]
+                    for path in ready:
+                        del self.pending[path]
+                    return ready
+
+                if self.pending:
+                    next_ready = min(self.pending.values()) + self.batch_window
+                    self.condition.wait(max(0.05, min(next_ready, self.last_event + self.batch_window) - now))
+                else:
+                    self.condition.wait()
+
+    def mark_alive(self, alive, error=None):
+        # Liveness is inferred from the connection itself, reported on change only
+        if alive and self.connection.alive is False:
+            print(f"✓ Parser at {self.connection.parser_url} is reachable again")
+        elif not alive and self.connection.alive is not False:
+            print(f"✗ Parser at {self.connection.parser_url} is not reachable: {error}")
+            print(f"  Holding files, retrying every {RETRY_SECONDS:g}s")
+        self.connection.alive = alive
+
+    def send_batch(self, batch):
+        started = time.monotonic()
+        sent = 0
+        sent_bytes = 0
+
+        for index, file_path in enumerate(batch):
             filename = os.path.basename(file_path)
-            target_path = f"{self.container_name}:{self.container_path}{filename}"
-            
-            subprocess.run(
-                ["docker", "cp", file_path, target_path],
-                check=True, capture_output=True
-            )
-            print(f"✓ Copied {filename} to container")
-            return True
-        except subprocess.CalledProcessError as e:
-            print(f"✗ Failed to copy {filename}: {e}")
-            return False
-    
-    def on_created(self, event):
-        """Handle file creation events"""
-        if event.is_directory:
-            return
-            
-        file_path = event.src_path
+            try:
+                sha256 = file_sha256(file_path)
+            except OSError:
+                continue  # Removed or renamed before it could be sent
+
+            if sha256 in self.ledger:
+                print(f"↷ Skipped {filename}: already sent as {self.ledger[sha256]['filename']}")
+                continue
+
+            try:
+                status, body, headers = self.connection.upload(file_path, sha256)
+            except OSError as e:
+                self.mark_alive(False, e)
+                for path in batch[index:]:
+                    self.add(path, delay=RETRY_SECONDS)
+                break
+
+            self.mark_alive(True)
+            if 200 <= status < 300:
+                size = os.path.getsize(file_path)
+                self.ledger[sha256] = {
+                    'filename': filename,
+                    'size': size,
+                    'sent_at': datetime.now(timezone.utc).isoformat(),
+                }
+                sent += 1
+                sent_bytes += size
+                print(f"✓ Sent {filename} to parser inbox")
+            elif status == 429 or status >= 500:
+                # Busy, failing or out of disk: the parser may take it later
+                delay = retry_delay(headers)
+                print(f"✗ Failed to send {filename}: HTTP {status}, retrying in {delay:g}s")
+                self.add(file_path, delay=delay)
+            else:
+                # Rejected for good (bad name, not a PDF...): sent again only when it changes
+                print(f"✗ Failed to send {filename}: HTTP {status} {body[:200].decode(errors='replace')}")
+
+        if sent:
+            self.save_ledger()
+            elapsed = time.monotonic() - started
+            print(f"Batch: {sent} file(s), {sent_bytes / 2 ** 20:.1f} MB in {elapsed:.2f}s")
+
+    def run(self):
+        while True:
+            self.send_batch(self.take_batch())
+
+
+class PDFHandler(FileSystemEventHandler):
+    def __init__(self, uploader):
+        self.uploader = uploader
+
+    def queue(self, file_path):
         if not file_path.lower().endswith('.pdf'):
             return
-            
-        # Wait a moment to ensure file is fully written
-        time.sleep(1)
-        
-        if not os.path.exists(file_path):
-            return
-            
-        print(f"New PDF detected: {os.path.basename(file_path)}")
-        
-        if not self.is_container_running():
-            print(f"✗ Container {self.container_name} is not running")
-            return
-            
-        self.copy_to_container(file_path)
-    
+        if file_path not in self.uploader.pending:
+            print(f"New PDF detected: {os.path.basename(file_path)}")
+        self.uploader.add(file_path)
+
+    def on_created(self, event):
+        """Handle file creation events"""
+        if not event.is_directory:
+            self.queue(event.src_path)
+
+    def on_modified(self, event):
+        """Handle writes to a detected file, which delay its upload until it is quiet"""
+        if not event.is_directory and event.src_path in self.uploader.pending:
+            self.uploader.add(event.src_path)
+
     def on_moved(self, event):
         """Handle file move events (treats as new file)"""
-        if event.is_directory:
-            return
-            
-        if event.dest_path.lower().endswith('.pdf'):
-            # Treat moved PDF as new file
-            event.src_path = event.dest_path
-            self.on_created(event)
+        if not event.is_directory:
+            self.queue(event.dest_path)
+
 
 def main():
-    watch_dir = sys.argv[1] if len(sys.argv) > 1 else "./statements"
-    
-    if not os.path.exists(watch_dir):
-        print(f"Error: Directory '{watch_dir}' does not exist")
+    parser = argparse.ArgumentParser(description='Upload new PDF statements to the AFTIS parser inbox')
+    parser.add_argument('watch_dir', nargs='?', default='./statements')
+    parser.add_argument('--parser-url', default=os.getenv('WATCH_PARSER_URL', DEFAULT_PARSER_URL),
+                        help=f'Parser base URL (default: {DEFAULT_PARSER_URL})')
+    parser.add_argument('--ledger', default=os.getenv('WATCH_LEDGER_PATH', 'watch-pdfs-ledger.json'),
+                        help='Hashes of files already sent, so re-detections are skipped')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.watch_dir):
+        print(f"Error: Directory '{args.watch_dir}' does not exist")
         sys.exit(1)
-    
-    print(f"Watching directory: {os.path.abspath(watch_dir)}")
+
+    connection = ParserConnection(args.parser_url)
+    uploader = Uploader(connection, args.ledger)
+
+    print(f"Watching directory: {os.path.abspath(args.watch_dir)}")
+    print(f"Uploading to: {args.parser_url}/inbox/")
+    try:
+        status, _, _ = connection.request('GET', '/health')
+        uploader.mark_alive(status == 200, f"HTTP {status}")
+    except OSError as e:
+        uploader.mark_alive(False, e)
     print("Monitoring for PDF files...")
     print("Press Ctrl+C to stop")
-    
-    event_handler = PDFHandler()
+
+    event_handler = PDFHandler(uploader)
     observer = Observer()
-    observer.schedule(event_handler, watch_dir, recursive=True)
-    
+    observer.schedule(event_handler, args.watch_dir, recursive=True)
+
     try:
+        uploader.start()
         observer.start()
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
         print("\nStopping file watcher...")
         observer.stop()
-    
+
     observer.join()
+    connection.close()
     print("File watcher stopped")
 
 if __name__ == "__main__":
@@ -114,5 +275,5 @@ if __name__ == "__main__":
         print("Error: watchdog library not installed")
         print("Install with: pip install watchdog")
         sys.exit(1)
-    
-    main()
\ No newline at end of file
+
+    main()